@@ -22,6 +22,7 @@
 // Machine constants and parameters:
 #define NUMBER_OF_AXES			4
 #define NUMBER_OF_STEPPERS		3
+#define MAX_VALUES				8		// Values in a single packet
 
 
 // Names:
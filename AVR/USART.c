@@ -1,6 +1,8 @@
 #include <avr/io.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <util/crc16.h>
+#include <util/delay.h>
 #include "USART.h"
 
 #define BAUD_PRESCALE ((F_CPU / (BAUD * 16UL)) - 1) 
@@ -41,6 +43,21 @@ void flush(void) {
 	while (UCSR0A & (1<<RXC0)) trash = UDR0;
 }
 
+void discard(void) {
+	char trash;
+	uint16_t idle = 0;
+	while (idle < FRAME_IDLE_US) {
+		if (UCSR0A & (1<<RXC0)) {
+			trash = UDR0;
+			idle = 0;
+		}
+		else {
+			_delay_us(10);
+			idle += 10;
+		}
+	}
+}
+
 void print_string(const char str[]) {
 	uint8_t i = 0;
 	while (str[i]) {
@@ -115,6 +132,35 @@ void print_float(float number, uint8_t precision) {
 	print_string(str);
 }
 
+char receive_frame(float values[], uint8_t max_values) {
+	uint8_t opcode = receive_byte();
+	uint8_t length = receive_byte();
+	uint16_t crc = _crc_xmodem_update(0xFFFF, opcode);
+	crc = _crc_xmodem_update(crc, length);
+
+	uint8_t count = length / FRAME_VALUE_SIZE;
+	if (count > max_values || length % FRAME_VALUE_SIZE) return '0';
+
+	for (uint8_t i = 0; i < count; i++) {
+		int32_t value = 0;
+		// Little endian:
+		for (uint8_t j = 0; j < FRAME_VALUE_SIZE; j++) {
+			uint8_t data = receive_byte();
+			crc = _crc_xmodem_update(crc, data);
+			value |= (int32_t)data << (8 * j);
+		}
+		// Extend the sign of int24:
+		if (value & 0x800000) value |= 0xFF000000;
+		values[i] = value / FRAME_SCALE;
+	}
+
+	uint16_t received_crc = receive_byte();
+	received_crc |= (uint16_t)receive_byte() << 8;
+	if (received_crc != crc) return '0';
+
+	return opcode;
+}
+
 /*
 Consider use of interrupts...
 */
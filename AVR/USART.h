@@ -21,6 +21,14 @@ REQUIRES:
 // Length of string to print or read
 #define LENGTH 21
 
+// Binary frame:
+// SYNC | opcode | length | int24 values... | CRC-16/CCITT-FALSE
+#define FRAME_SYNC			0xA5
+#define FRAME_VALUE_SIZE	3
+#define FRAME_SCALE			100.0
+#define FRAME_NAK			0x15	// Reply to a rejected frame, instead of '1'
+#define FRAME_IDLE_US		1000	// Line idle after a frame, about 4 bytes at 38400
+
 /* 
 Takes the defined BAUD and F_CPU,
 calculates the bit-clock multiplier,
@@ -44,6 +52,12 @@ Flushes data that remains in the receive buffer
 */
 void flush(void);
 
+/*
+Drops received data until the line is idle for FRAME_IDLE_US,
+the rest of a rejected frame
+*/
+void discard(void);
+
 /*
 Sends char array str[] char by char to USART,
 until '\r' char (Enter) is received or max_length is reached
@@ -77,4 +91,11 @@ Maximum length of char array is defined as LENGTH macro
 */
 void print_float(float number, uint8_t precision);
 
+/*
+Reads the rest of a binary frame, after FRAME_SYNC byte was received.
+Stores fixed point values as floats in values[]
+Returns: opcode of the frame or '0' if the frame is corrupted
+*/
+char receive_frame(float values[], uint8_t max_values);
+
 #endif
@@ -16,10 +16,12 @@ void init_scara(void);
 void set_feed(float feed[]);
 void wait(float time_s);
 void menu(void);
+static void receive_values(char function_code, float values[]);
 
 
 // Global variables:
 static uint8_t is_initialized = 0;
+static uint8_t reply = '1';		// Sent by the next menu() call
 
 
 // Z Axis Endstop inerrupt:
@@ -84,12 +86,28 @@ void wait(float time_s) {
 }
 
 void menu(void) {	
-	// Send ready signal:
-	transmit_byte('1');	
+	float values[MAX_VALUES];
+
+	// Send ready signal, or NAK if the last frame was rejected:
+	transmit_byte(reply);
+	reply = '1';
 
 	// Get function code:
 	char function_code = receive_byte();
-	receive_byte();
+	if ((uint8_t)function_code == FRAME_SYNC) {
+		// Binary frame:
+		function_code = receive_frame(values, MAX_VALUES);
+		if (function_code == '0') {
+			// Corrupted, drop the rest, the host sends it again:
+			discard();
+			reply = FRAME_NAK;
+		}
+	}
+	else {
+		// Text packet:
+		receive_byte();
+		receive_values(function_code, values);
+	}
 	
 	// Skip if not initialized:
 	if (!is_initialized) function_code = '0';
@@ -97,19 +115,13 @@ void menu(void) {
 	switch (function_code) {
 		// Move:
 		case 'G': {
-			float displacement[NUMBER_OF_AXES];
-			for (uint8_t i = 0; i < NUMBER_OF_AXES; i++)
-				displacement[i] = get_float();
-			move(displacement);
+			move(values);
 			break;
 		}
 			
 		// Feed:
 		case 'F': {
-			float feed[NUMBER_OF_AXES];
-			for (uint8_t i = 0; i < NUMBER_OF_AXES; i++)
-				feed[i] = get_float();			
-			set_feed(feed);	
+			set_feed(values);	
 			break;
 		}
 		
@@ -123,11 +135,25 @@ void menu(void) {
 		
 		// Wait:
 		case 'W': {
-			float time_s = get_float();
-			wait(time_s);
+			wait(values[0]);
 			break;
 		}
 	}
 	// Flush data that remains in the buffer:
 	flush();
 }
+
+static void receive_values(char function_code, float values[]) {
+	uint8_t count = 0;
+	switch (function_code) {
+		case 'G':
+		case 'F':
+			count = NUMBER_OF_AXES;
+			break;
+		case 'W':
+			count = 1;
+			break;
+	}
+	for (uint8_t i = 0; i < count; i++)
+		values[i] = get_float();
+}
@@ -0,0 +1,458 @@
+import json
+import math
+import os
+import numpy as np
+from Visualization import ArmModel
+
+
+# Triangles split in four at the midpoints of the edges until no edge is longer than the size [mm]:
+def subdivide(triangles, size):
+    triangles = np.asarray(triangles, dtype=float).reshape(-1, 3, 3)
+    done = []
+    while len(triangles):
+        edges = np.linalg.norm(triangles - np.roll(triangles, 1, axis=1), axis=2).max(axis=1)
+        done.append(triangles[edges <= size])
+        big = triangles[edges > size]
+        a, b, c = big[:, 0], big[:, 1], big[:, 2]
+        ab, bc, ca = (a + b) / 2, (b + c) / 2, (c + a) / 2
+        triangles = np.concatenate([np.stack([a, ab, ca], axis=1),
+                                    np.stack([ab, b, bc], axis=1),
+                                    np.stack([ca, bc, c], axis=1),
+                                    np.stack([ab, bc, ca], axis=1)])
+    return np.concatenate(done)
+
+
+# Range of cos(x) for x in [low, high] [rad]:
+def cos_range(low, high):
+    values = (math.cos(low), math.cos(high))
+    top = 1.0 if math.floor(high / (2 * math.pi)) >= math.ceil(low / (2 * math.pi)) else max(values)
+    bottom = -1.0 if math.floor((high - math.pi) / (2 * math.pi)) >= math.ceil((low - math.pi) / (2 * math.pi)) \
+        else min(values)
+    return bottom, top
+
+
+# Range of the length of offset + turned rotated by an angle in [low, high] [rad], 2D vectors:
+def turned_range(offset, turned, low, high):
+    a = math.hypot(*offset)
+    b = math.hypot(*turned)
+    if a == 0.0 or b == 0.0:
+        return a + b, a + b
+    phase = math.atan2(turned[1], turned[0]) - math.atan2(offset[1], offset[0])
+    bottom, top = cos_range(low + phase, high + phase)
+    return math.sqrt(max(a * a + b * b + 2 * a * b * bottom, 0.0)), math.sqrt(a * a + b * b + 2 * a * b * top)
+
+
+class SphereTree:
+    # Bounding volume hierarchy of a mesh: a binary tree of bounding spheres in arrays,
+    # node 0 is the root, a leaf bounds one triangle. Spheres don't change when the link
+    # turns, so a posed tree only needs its centres moved. Each node keeps a vertex of its
+    # triangles too, one close enough to something proves a collision without the leaves.
+
+    def __init__(self, triangles):
+        triangles = np.asarray(triangles, dtype=float).reshape(-1, 3, 3)
+        centroids = triangles.mean(axis=1)
+        centers = []
+        radii = []
+        points = []             # The vertex nearest to the centre
+        children = []           # (left, right), (-1, -1) for leaves
+
+        # Nodes are numbered in the order they are split, parents first:
+        stack = [(np.arange(len(triangles)), -1, 0)]
+        while stack:
+            indices, parent, side = stack.pop()
+            node = len(centers)
+            if parent >= 0:
+                children[parent][side] = node
+            vertices = triangles[indices].reshape(-1, 3)
+            low = vertices.min(axis=0)
+            high = vertices.max(axis=0)
+            center = (low + high) / 2
+            distances = ((vertices - center) ** 2).sum(axis=1)
+            centers.append(center)
+            radii.append(np.sqrt(distances.max()))
+            points.append(vertices[np.argmin(distances)])
+            children.append([-1, -1])
+            if len(indices) > 1:
+                # Median split along the longest side of the centroids:
+                middles = centroids[indices]
+                axis = np.argmax(middles.max(axis=0) - middles.min(axis=0))
+                order = indices[np.argsort(middles[:, axis], kind="stable")]
+                half = len(order) // 2
+                stack.append((order[half:], node, 1))
+                stack.append((order[:half], node, 0))
+
+        self.centers = np.array(centers).reshape(-1, 3)
+        self.points = np.array(points).reshape(-1, 3)
+        self.radii = np.array(radii)
+        children = np.array(children, dtype=np.int64).reshape(-1, 2)
+        self.left = children[:, 0]
+        self.right = children[:, 1]
+        self.leaf = self.left < 0
+
+    def __len__(self):
+        return len(self.centers)
+
+
+class CollisionChecker:
+    # Self-collision and obstacle checks of joint moves, from the STL parts
+    # placed like in ArmModel and user-defined obstacle boxes (world frame, fixed).
+    # Big triangles of the decimated parts are split, so the leaf spheres stay small.
+    # A move is swept in joint space: a piece of it is checked at its middle pose with
+    # the spheres grown by half of the travel of the arm in the piece, so nothing
+    # in between is missed, colliding pieces are halved down to STEP.
+    # Leaves bound single triangles, the check is conservative by up to the leaf size,
+    # the margin and STEP / 2. All poses are checked at once: root spheres cull
+    # the poses (broad phase), then pairs of nodes overlapping in a pose are split down to the leaves.
+
+    PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "obstacles.json")
+
+    TRIANGLES = 100         # Level of detail, triangles of each part
+    LEAF_SIZE = 10.0        # Max edge of the triangles in the leaves [mm]
+    STEP = 4.0              # Max travel of the arm in a checked piece of a move [mm]
+    COARSE = 64.0           # Travel of the pieces checked first [mm]
+    MARGIN = 1.0            # Min distance kept [mm]
+    CHUNK = 1 << 16         # Poses checked at once
+
+    # Pairs of links that can touch, neighbours always do at the joint:
+    PAIRS = ((ArmModel.FOREARM, ArmModel.BASE),
+             (ArmModel.TOOL, ArmModel.BASE),
+             (ArmModel.TOOL, ArmModel.ARM))
+
+    def __init__(self, scara, path=PATH, triangles=TRIANGLES, step=STEP, margin=MARGIN):
+        self.scara = scara
+        self.path = path
+        self.step = step
+        self.margin = margin
+        self.model = ArmModel(scara, triangles=triangles)
+        self.obstacles = {}         # name -> ((min X, Y, Z), (max X, Y, Z)) [mm]
+        self.trees = None           # link -> SphereTree
+        self.key = None
+
+        # Statistics:
+        self.builds = 0
+        self.poses = 0
+        self.tests = 0              # Sphere tests
+        self.paths = 0              # check_path() calls
+        self.culled = 0             # Paths cleared by the broad phase
+
+    # Parameters the checks depend on:
+    def parameters(self):
+        scara = self.scara
+        return (scara.l1, scara.l2, scara.basement_height, scara.current_tool["x_offset"],
+                self.step, self.margin, self.model.triangles, self.LEAF_SIZE,
+                tuple(sorted((name, tuple(low), tuple(high)) for name, (low, high) in self.obstacles.items())))
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as file:
+            obstacles = json.load(file)
+        self.obstacles = {name: (tuple(box["min"]), tuple(box["max"])) for name, box in obstacles.items()}
+
+    def write(self):
+        if self.path is None:
+            return
+        obstacles = {name: {"min": list(low), "max": list(high)} for name, (low, high) in self.obstacles.items()}
+        # Replaced at once, never left half written:
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(obstacles, file, indent=4)
+        os.replace(temporary, self.path)
+
+    def add_obstacle(self, name, low, high):
+        low = tuple(float(value) for value in low)
+        high = tuple(float(value) for value in high)
+        self.obstacles[name] = (tuple(map(min, low, high)), tuple(map(max, low, high)))
+        self.write()
+
+    def remove_obstacle(self, name):
+        if self.obstacles.pop(name, None) is not None:
+            self.write()
+
+    # Sphere trees of the links and the radius of the arm about A1 and A2, built once:
+    def build(self):
+        key = self.parameters()[:-1]
+        if key == self.key:
+            return self.trees
+        self.key = key
+        self.model.meshes = None
+        scara = self.scara
+        self.trees = {}
+        reach = {}
+        for link, mesh in self.model.link_meshes().items():
+            if len(mesh):
+                self.trees[link] = SphereTree(subdivide(mesh, self.LEAF_SIZE))
+                vertices = mesh.reshape(-1, 3)
+                reach[link] = np.hypot(vertices[:, 0], vertices[:, 1]).max()
+        arm = reach.get(ArmModel.ARM, 0.0)
+        forearm = reach.get(ArmModel.FOREARM, 0.0)
+        tool = reach.get(ArmModel.TOOL, 0.0)
+        self.radius_a2 = max(forearm, scara.l2 + tool)
+        self.radius_a1 = max(arm, scara.l1 + self.radius_a2)
+        self.builds = self.builds + 1
+        return self.trees
+
+    # Bound of the travel of any point of the arm between the joint positions (M x 4) [mm]:
+    def travel(self, starts, ends):
+        names = self.scara.axes_names
+        delta = np.abs(ends - starts)
+        return (delta[:, names.index("Z")]
+                + np.radians(delta[:, names.index("A1")]) * self.radius_a1
+                + np.radians(delta[:, names.index("A2")]) * self.radius_a2)
+
+    # Segments split to pieces of at most the travel,
+    # returns: starts, ends (N x 4) and N segment indices:
+    def split(self, starts, ends, travel):
+        counts = np.maximum(np.ceil(self.travel(starts, ends) / travel), 1).astype(np.int64)
+        segments = np.repeat(np.arange(len(starts)), counts)
+        offsets = np.cumsum(counts) - counts
+        piece = np.arange(len(segments)) - offsets[segments]
+        delta = (ends - starts)[segments] / counts[segments, None]
+        first = starts[segments] + piece[:, None] * delta
+        return first, first + delta, segments
+
+    # Segments (start -> end joint positions, M x 4 in axes_names order) colliding,
+    # with a collision found: {segment: message}.
+    # Pieces of at most COARSE travel are checked at their middle with the spheres grown
+    # by half of their travel, so the whole piece is covered; colliding pieces are halved
+    # down to STEP:
+    def check_segments(self, starts, ends):
+        names = self.scara.axes_names
+        starts = np.asarray(starts, dtype=float).reshape(-1, len(names))
+        ends = np.asarray(ends, dtype=float).reshape(-1, len(names))
+        if not len(starts):
+            return {}
+        self.build()
+        starts, ends, segments = self.split(starts, ends, self.COARSE)
+        found = {}
+        while len(segments):
+            travel = self.travel(starts, ends)
+            middles = (starts + ends) / 2
+            hit = np.zeros(len(middles), dtype=bool)
+            sure = np.zeros(len(middles), dtype=bool)
+            messages = np.empty(len(middles), dtype=object)
+            for first in range(0, len(middles), self.CHUNK):
+                last = first + self.CHUNK
+                hit[first:last], sure[first:last], messages[first:last] = self.find(
+                    middles[first:last], self.margin + travel[first:last] / 2)
+            # A collision at the middle is one of the segment, at any level:
+            final = np.flatnonzero(sure | (hit & (travel <= self.step)))
+            for i in final:
+                found.setdefault(int(segments[i]), messages[i])
+            index = np.flatnonzero(hit & ~sure & (travel > self.step))
+            index = index[~np.isin(segments[index], list(found))]
+            middles = middles[index]
+            starts, ends = np.concatenate([starts[index], middles]), np.concatenate([middles, ends[index]])
+            segments = np.concatenate([segments[index], segments[index]])
+        return found
+
+    # Root sphere of the link in the arm frame (turned by A1, at the height of Z):
+    # (offset, turned, height, radius), the centre is offset + turned rotated by A2 [mm],
+    # the base doesn't turn nor move with Z, it's (centre, 0, height, radius) and moving False:
+    def root(self, link):
+        scara = self.scara
+        tree = self.build()[link]
+        x, y, z = tree.centers[0].tolist()
+        if link == ArmModel.BASE:
+            return (x, y), (0.0, 0.0), z, float(tree.radii[0]), False
+        height = scara.basement_height + z
+        if link == ArmModel.ARM:
+            return (x, y), (0.0, 0.0), height, float(tree.radii[0]), True
+        if link == ArmModel.FOREARM:
+            return (scara.l1, 0.0), (x, y), height, float(tree.radii[0]), True
+        return (scara.l1, 0.0), (scara.l2 + x, y), height, float(tree.radii[0]), True
+
+    # Broad phase of a path (N x 4 joint positions): True if the root spheres of the pairs
+    # and the obstacle boxes stay apart by more than the margin and STEP / 2 (what
+    # check_segments() tells apart) anywhere on it. From the ranges of Z and A2 along the path:
+    # in the arm frame only A2 turns the forearm and the tool, so the distance between
+    # their centres is exact, the base and the obstacles are bounded by the distance
+    # from the A1 axis and the height. No poses are placed, most moves end here:
+    def is_clear(self, path):
+        trees = self.build()
+        names = self.scara.axes_names
+        low = path.min(axis=0).tolist()
+        high = path.max(axis=0).tolist()
+        z_low = low[names.index("Z")]
+        z_high = high[names.index("Z")]
+        a2_low = math.radians(low[names.index("A2")])
+        a2_high = math.radians(high[names.index("A2")])
+        clearance = self.margin + self.step / 2
+
+        # link -> (offset, turned, height, radius, moving), (min, max) distance from the A1 axis,
+        # (min, max) height:
+        roots = {}
+        for link in trees:
+            offset, turned, height, radius, moving = self.root(link)
+            heights = (height + z_low, height + z_high) if moving else (height, height)
+            roots[link] = (offset, turned, height, radius, moving,
+                           turned_range(offset, turned, a2_low, a2_high), heights)
+
+        for low, high in self.obstacles.values():
+            # Distance of the box from the A1 axis:
+            near = math.hypot(min(max(0.0, low[0]), high[0]), min(max(0.0, low[1]), high[1]))
+            far = math.hypot(max(abs(low[0]), abs(high[0])), max(abs(low[1]), abs(high[1])))
+            for link, (_, _, _, radius, _, (inner, outer), (bottom, top)) in roots.items():
+                apart = max(near - outer, inner - far, 0.0)
+                above = max(low[2] - top, bottom - high[2], 0.0)
+                if apart * apart + above * above <= (radius + clearance) ** 2:
+                    return False
+
+        for link_a, link_b in self.PAIRS:
+            if link_a not in roots or link_b not in roots:
+                continue
+            offset_a, turned_a, height_a, radius_a, moving_a, range_a, heights_a = roots[link_a]
+            offset_b, turned_b, height_b, radius_b, moving_b, range_b, heights_b = roots[link_b]
+            reach = radius_a + radius_b + clearance
+            if moving_a and moving_b:
+                # Both turn with A2 in the arm frame:
+                distance, _ = turned_range((offset_a[0] - offset_b[0], offset_a[1] - offset_b[1]),
+                                           (turned_a[0] - turned_b[0], turned_a[1] - turned_b[1]),
+                                           a2_low, a2_high)
+                above = height_a - height_b
+                if distance * distance + above * above <= reach * reach:
+                    return False
+            else:
+                apart = max(range_a[0] - range_b[1], range_b[0] - range_a[1], 0.0)
+                above = max(heights_a[0] - heights_b[1], heights_b[0] - heights_a[1], 0.0)
+                if apart * apart + above * above <= reach * reach:
+                    return False
+        return True
+
+    # Moves through the joint positions (N x 4, the first is the start),
+    # returns: message of the first collision, None if the path is clear:
+    def check_path(self, path):
+        path = np.asarray(path, dtype=float).reshape(-1, len(self.scara.axes_names))
+        self.paths = self.paths + 1
+        if self.is_clear(path):
+            self.culled = self.culled + 1
+            return None
+        found = self.check_segments(path[:-1], path[1:])
+        if not found:
+            return None
+        return found[min(found)]
+
+    # Colliding poses (N x 4): {pose: message}:
+    def check_poses(self, poses):
+        hit, _, messages = self.find(poses, np.full(len(poses), self.margin))
+        return {int(pose): messages[pose] for pose in np.flatnonzero(hit)}
+
+    # Poses (N x 4) colliding with the spheres grown by the margins (N) [mm],
+    # returns: N hits, N sure hits (a vertex within the margin) and N messages:
+    def find(self, poses, margins):
+        trees = self.build()
+        self.poses = self.poses + len(poses)
+        frames = {link: (np.cos(angles), np.sin(angles), origins)
+                  for link, (angles, origins) in self.model.link_poses(poses).items()}
+        hit = np.zeros(len(poses), dtype=bool)
+        sure = np.zeros(len(poses), dtype=bool)
+        messages = np.empty(len(poses), dtype=object)
+
+        def add(found, message):
+            found_hit, found_sure = found
+            # Named by the sure hit, if there is one:
+            messages[(found_hit & ~hit) | (found_sure & ~sure)] = message
+            hit[found_hit] = True
+            sure[found_sure] = True
+
+        # Poses with a sure hit are done:
+        for name, (low, high) in sorted(self.obstacles.items()):
+            for link, tree in trees.items():
+                add(self.tree_box(tree, frames[link], np.flatnonzero(~sure), np.array(low), np.array(high), margins),
+                    "collision of {} with obstacle {}".format(link, name))
+        for link_a, link_b in self.PAIRS:
+            if link_a not in trees or link_b not in trees:
+                continue
+            add(self.tree_tree(trees[link_a], frames[link_a], trees[link_b], frames[link_b],
+                               np.flatnonzero(~sure), margins),
+                "collision of {} with {}".format(link_a, link_b))
+        return hit, sure, messages
+
+    # Points (K x 3, link frame) of the nodes in the posed link [mm]:
+    @staticmethod
+    def place(points, frame, poses, nodes):
+        cos, sin, origins = frame
+        cos = cos[poses]
+        sin = sin[poses]
+        local = points[nodes]
+        world = np.empty_like(local)
+        world[:, 0] = cos * local[:, 0] - sin * local[:, 1]
+        world[:, 1] = sin * local[:, 0] + cos * local[:, 1]
+        world[:, 2] = local[:, 2]
+        return world + origins[poses]
+
+    # Poses where the link overlaps the box, and where it surely does:
+    def tree_box(self, tree, frame, poses, low, high, margins):
+        nodes = np.zeros(len(poses), dtype=np.int64)
+        hit = np.zeros(len(margins), dtype=bool)
+        sure = np.zeros(len(margins), dtype=bool)
+        while len(poses):
+            centers = self.place(tree.centers, frame, poses, nodes)
+            distance = centers - np.clip(centers, low, high)
+            reach = tree.radii[nodes] + margins[poses]
+            overlap = (distance ** 2).sum(axis=1) <= reach * reach
+            self.tests = self.tests + len(poses)
+            poses = poses[overlap]
+            nodes = nodes[overlap]
+
+            # Spheres smaller than their growth can't clear the piece, it's halved instead,
+            # a vertex at the box is a collision:
+            points = self.place(tree.points, frame, poses, nodes)
+            distance = (points - np.clip(points, low, high)) ** 2
+            distance = distance.sum(axis=1)
+            touch = distance <= margins[poses] ** 2
+            leaf = tree.leaf[nodes] | (tree.radii[nodes] <= margins[poses] - self.margin) | touch
+            hit[poses[leaf]] = True
+            sure[poses[distance <= self.margin ** 2]] = True
+            # One hit is enough for a pose:
+            keep = ~hit[poses]
+            poses = np.repeat(poses[keep], 2)
+            nodes = np.column_stack([tree.left[nodes[keep]], tree.right[nodes[keep]]]).ravel()
+        return hit, sure
+
+    # Poses where the links overlap, and where they surely do, the bigger sphere of a pair is split:
+    def tree_tree(self, tree_a, frame_a, tree_b, frame_b, poses, margins):
+        nodes_a = np.zeros(len(poses), dtype=np.int64)
+        nodes_b = np.zeros(len(poses), dtype=np.int64)
+        hit = np.zeros(len(margins), dtype=bool)
+        sure = np.zeros(len(margins), dtype=bool)
+        while len(poses):
+            distance = self.place(tree_a.centers, frame_a, poses, nodes_a) - \
+                self.place(tree_b.centers, frame_b, poses, nodes_b)
+            reach = tree_a.radii[nodes_a] + tree_b.radii[nodes_b] + margins[poses]
+            overlap = (distance ** 2).sum(axis=1) <= reach * reach
+            self.tests = self.tests + len(poses)
+            poses = poses[overlap]
+            nodes_a = nodes_a[overlap]
+            nodes_b = nodes_b[overlap]
+
+            growth = margins[poses] - self.margin
+            leaf_a = tree_a.leaf[nodes_a] | (tree_a.radii[nodes_a] <= growth)
+            leaf_b = tree_b.leaf[nodes_b] | (tree_b.radii[nodes_b] <= growth)
+            distance = self.place(tree_a.points, frame_a, poses, nodes_a) - \
+                self.place(tree_b.points, frame_b, poses, nodes_b)
+            distance = (distance ** 2).sum(axis=1)
+            hit[poses[(leaf_a & leaf_b) | (distance <= margins[poses] ** 2)]] = True
+            sure[poses[distance <= self.margin ** 2]] = True
+            keep = ~hit[poses]
+            poses = poses[keep]
+            nodes_a = nodes_a[keep]
+            nodes_b = nodes_b[keep]
+            leaf_a = leaf_a[keep]
+            leaf_b = leaf_b[keep]
+
+            split_a = ~leaf_a & (leaf_b | (tree_a.radii[nodes_a] >= tree_b.radii[nodes_b]))
+            children_a = np.where(split_a[:, None],
+                                  np.column_stack([tree_a.left[nodes_a], tree_a.right[nodes_a]]),
+                                  nodes_a[:, None])
+            children_b = np.where(split_a[:, None],
+                                  nodes_b[:, None],
+                                  np.column_stack([tree_b.left[nodes_b], tree_b.right[nodes_b]]))
+            poses = np.repeat(poses, 2)
+            nodes_a = children_a.ravel()
+            nodes_b = children_b.ravel()
+        return hit, sure
+
+    def report(self):
+        return "Collision checks: {} poses, {} sphere tests, {} builds, {} of {} paths cleared by the broad phase".format(
+            self.poses, self.tests, self.builds, self.culled, self.paths)
@@ -1,5 +1,16 @@
+import threading
+import time
+from collections import deque
 import serial
 import serial.tools.list_ports as list_ports
+from Protocol import encode, ProtocolError, TEXT, BINARY, ACK, NAK
+from Notifier import ChangeNotifier
+from Trace import tracer, SERIAL
+from Diagnostics import LinkMonitor
+
+
+class BufferFull(Exception):
+    pass
 
 
 class Communication:
@@ -14,10 +25,101 @@ class Communication:
                                 bytesize=serial.EIGHTBITS,
                                 timeout=TIMEOUT)
 
-    connected = False
-    ready = False
+    # Buffer defaults:
+    CAPACITY = 256
+    BLOCK_TIMEOUT = 1.0
+
+    # What to do if the buffer is full:
+    BLOCK = 'block'                 # Wait for the free space, then raise BufferFull
+    REJECT = 'reject'               # Raise BufferFull
+    DROP_OLDEST = 'drop_oldest'     # Drop the oldest feed or wait packet, raise BufferFull if there is none
+
+    # Moves are never dropped, the planned position already includes them:
+    MOTION_OPCODES = ('G', 'T')
+
+    _connected = False
+    _ready = False
+
+    # Protocols:
+    TEXT = TEXT                     # Values as text, each ended with '\r'
+    BINARY = BINARY                 # Binary frame with CRC, see Protocol.py
+
+    # Packets sent, but not acknowledged yet.
+    # 1 - stop-and-wait, every packet waits for '1' of the previous one
+    # N - pipelined, the controller acknowledges each packet with '1' in order,
+    #     the acks carry no sequence number, a lost or extra '1' isn't detected
+    WINDOW = 1
+    MAX_WINDOW = 16
+
+    # A binary frame rejected by the controller (NAK) is sent again, at most RESENDS times in a row.
+    # If packets were sent after it, they may already be executed, the order is lost:
+    # the link faults (error) and sends nothing until reconnected or cleared.
+    RESENDS = 3
+
+    # Packets the controller can take at once, the window is limited to it.
+    # The firmware's menu() flushes the USART input after each packet (AVR/USART.c),
+    # so anything sent during a command is lost: 1. Only controllers that queue
+    # packets (Emulator, VirtualController with slots > 1) allow more:
+    SLOTS = 1
+    # The controller executes 'T' packets (velocity profiles of MotionPlanner),
+    # AVR/main.c doesn't, only the Emulator does:
+    PROFILES = False
+
+    # notifier - ChangeNotifier of the ready and connected flags and packets in flight:
+    def __init__(self, capacity=CAPACITY, when_full=REJECT, protocol=TEXT, window=WINDOW, notifier=None,
+                 slots=SLOTS, profiles=PROFILES):
+        self.notifier = ChangeNotifier() if notifier is None else notifier
+        self.protocol = protocol
+        self.slots = slots
+        self.profiles = profiles
+        self.window = min(max(int(window), 1), self.MAX_WINDOW, slots)
+        self.buffer = deque()           # (packet, tag, enqueued) to send
+        self.in_flight = deque()        # (packet, tag, enqueued, sent, bytes) sent
+        self.completed = deque()        # Tags of acknowledged packets
+        self.capacity = capacity
+        self.when_full = when_full
+        self.buffer_changed = threading.Condition()
+        self.error = None               # ProtocolError of a fault, the position is lost
+        self.retries = 0                # NAKs of the oldest packet in flight
 
-    buffer = []
+        # Serial I/O threads:
+        self.io_stop = threading.Event()
+        self.reader = None
+        self.writer = None
+
+        # Statistics:
+        self.high_water = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+        self.resent = 0
+        # Where the time of each packet goes:
+        self.monitor = LinkMonitor()
+
+    @property
+    def connected(self):
+        return self._connected
+
+    @connected.setter
+    def connected(self, connected):
+        if connected != self._connected:
+            self._connected = connected
+            self.notifier.publish(ChangeNotifier.CONNECTED)
+
+    @property
+    def ready(self):
+        return self._ready
+
+    @ready.setter
+    def ready(self, ready):
+        if ready != self._ready:
+            self._ready = ready
+            self.notifier.publish(ChangeNotifier.READY)
+
+    # After packets in flight or the window changed:
+    def update_ready(self):
+        self.ready = self.error is None and len(self.in_flight) < self.window
+        self.notifier.publish(ChangeNotifier.IN_FLIGHT)
 
     def serial_open(self, port=None):
         try:
@@ -25,8 +127,15 @@ class Communication:
             self.serial_port.open()
             if self.serial_port.isOpen():
                 self.connected = True
+                # Nothing is in flight after reconnection:
+                self.in_flight.clear()
+                self.error = None
+                self.retries = 0
                 self.ready = True
+                self.notifier.publish(ChangeNotifier.IN_FLIGHT)
                 self.serial_port.flush()
+                # Drop ready signal sent before the connection:
+                self.serial_port.reset_input_buffer()
                 return True
             else:
                 raise
@@ -39,54 +148,255 @@ class Communication:
         if not self.connected:
             return False
 
-        if not self.ready:
-            # If there is data to receive:
-            if self.serial_port.in_waiting:
-                ack = self.serial_port.read(1).decode(self.ENCODING)
-                # If '1' received port is ready
-                if ack is '1':
-                    self.ready = True
-            # self.serial_port.reset_input_buffer()
+        # If there is data to receive:
+        if self.serial_port.in_waiting:
+            self.receive(self.serial_port.read(self.serial_port.in_waiting))
+        return self.ready
+
+    def receive(self, data):
+        with self.buffer_changed:
+            # Each '1' acknowledges the oldest packet in flight, NAK rejects it:
+            for byte in data:
+                if not self.in_flight:
+                    break
+                if byte == ACK:
+                    packet, tag, enqueued, sent, size = self.in_flight.popleft()
+                    self.completed.append(tag)
+                    self.monitor.acknowledged(enqueued, sent, size, self.serial_port.baudrate)
+                    self.retries = 0
+                    tracer.debug(SERIAL, "ack %s", packet)
+                elif byte == NAK:
+                    self.rejected_packet()
+            self.update_ready()
+            # Wake up the writer and waiting callers:
+            self.buffer_changed.notify_all()
+
+    # Call with buffer_changed held,
+    # the controller rejected the oldest packet in flight, it's sent again before the buffer:
+    def rejected_packet(self):
+        packet, tag, enqueued, _, _ = self.in_flight.popleft()
+        self.retries = self.retries + 1
+        if self.in_flight:
+            self.fault("packet {} rejected, {} packets sent after it".format(packet, len(self.in_flight)))
+        elif self.retries > self.RESENDS:
+            self.fault("packet {} rejected {} times".format(packet, self.retries))
+        else:
+            tracer.warning(SERIAL, "packet %s rejected, sent again", packet)
+            self.buffer.appendleft((packet, tag, enqueued))
+            self.resent = self.resent + 1
+
+    # Call with buffer_changed held, nothing is sent until clear_error():
+    def fault(self, message):
+        self.error = ProtocolError(message)
+        tracer.fault(SERIAL, "link fault: %s, %d packets not sent", message, len(self.buffer))
+        self.buffer.clear()
+        self.in_flight.clear()
+        self.update_ready()
+
+    def clear_error(self):
+        with self.buffer_changed:
+            self.error = None
+            self.retries = 0
+            self.update_ready()
+            self.buffer_changed.notify_all()
 
     def connection_check(self):
         if self.serial_port.isOpen():
             self.connected = True
         else:
+            if self.connected:
+                tracer.fault(SERIAL, "connection lost, %d packets in flight", len(self.in_flight))
             self.connected = False
 
-    def to_buffer(self, packet):
+    # tag - returned in completed, when the packet is acknowledged,
+    # bytes-like packet is already encoded (compiled program):
+    def to_buffer(self, packet, tag=None, timeout=BLOCK_TIMEOUT):
         # If packet is not a list:
-        if not isinstance(packet, list):
+        if not isinstance(packet, (list, bytes, memoryview)):
             packet = [packet]
-        self.buffer.append(packet)
-        print(self.buffer)
+        if packet[0] == 'T' and not self.profiles:
+            raise ProtocolError("The controller doesn't execute 'T' packets")
+
+        with self.buffer_changed:
+            if self.is_buffer_full():
+                if self.when_full == self.DROP_OLDEST:
+                    self.drop_oldest()
+                elif self.when_full == self.BLOCK:
+                    if not self.wait_for_space(timeout):
+                        self.reject()
+                else:
+                    self.reject()
+
+            self.buffer.append((packet, tag, self.monitor.enqueued(len(self.buffer))))
+            if len(self.buffer) > self.high_water:
+                self.high_water = len(self.buffer)
+            # Wake up the writer:
+            self.buffer_changed.notify_all()
+
+    # Encoded packets are parts of a program, they aren't dropped either:
+    def is_droppable(self, packet):
+        return isinstance(packet, list) and packet[0] not in self.MOTION_OPCODES
+
+    def drop_oldest(self):
+        for index, (packet, _, _) in enumerate(self.buffer):
+            if self.is_droppable(packet):
+                del self.buffer[index]
+                self.dropped = self.dropped + 1
+                return
+        self.reject()
+
+    # Call with buffer_changed held, returns False on timeout.
+    # Without the I/O threads nothing else drains the buffer, so it's sent from here:
+    def wait_for_space(self, timeout):
+        if self.is_io_running():
+            return self.buffer_changed.wait_for(lambda: not self.is_buffer_full(), timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.is_buffer_full():
+            if not self.connected:
+                return False
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            self.ready_check()
+            self.send()
+            time.sleep(0.001)
+        return True
+
+    def reject(self):
+        self.rejected = self.rejected + 1
+        raise BufferFull("Buffer full ({} packets)".format(self.capacity))
 
     def is_buffer_empty(self):
-        return not len(self.buffer)
+        return not self.buffer
+
+    def is_buffer_full(self):
+        return len(self.buffer) >= self.capacity
+
+    # Nothing to send and everything acknowledged:
+    def is_idle(self):
+        return not self.buffer and not self.in_flight
+
+    # Packets queued or in flight:
+    def outstanding(self):
+        return len(self.buffer) + len(self.in_flight)
+
+    def reset_statistics(self):
+        self.high_water = len(self.buffer)
+        self.rejected = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+        self.resent = 0
+        self.monitor.reset()
 
     def send(self):
         if not self.connected:
             return
-        if not self.ready:
-            return
 
-        # Check if there is something to send in the buffer
-        if not len(self.buffer):
-            # Nothing to send
+        while self.ready:
+            with self.buffer_changed:
+                # Check if there is something to send in the buffer
+                if not self.buffer:
+                    # Nothing to send
+                    return
+
+                packet, tag, enqueued = self.buffer.popleft()
+                data = packet if isinstance(packet, (bytes, memoryview)) else encode(packet, self.protocol)
+                sent = self.monitor.sent(len(self.buffer))
+                self.in_flight.append((packet, tag, enqueued, sent, len(data)))
+                # Busy if the window is full:
+                self.update_ready()
+                self.buffer_changed.notify_all()
+            tracer.debug(SERIAL, "packet %s", packet)
+
+            # Send packet in a single write:
+            self.serial_port.write(data)
+            self.bytes_sent = self.bytes_sent + len(data)
+
+    # Limited to the controller's slots:
+    def set_window(self, window):
+        window = min(max(int(window), 1), self.MAX_WINDOW, self.slots)
+        with self.buffer_changed:
+            self.window = window
+            self.update_ready()
+
+    # Wait until everything is sent and acknowledged,
+    # returns False on timeout:
+    def wait_idle(self, timeout=None):
+        if self.is_io_running():
+            with self.buffer_changed:
+                # A lost port is never idle:
+                self.buffer_changed.wait_for(lambda: self.is_idle() or not self.connected, timeout)
+                return self.is_idle()
+
+        # No I/O threads, poll the port:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.is_idle():
+            if not self.connected:
+                return False
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            self.ready_check()
+            self.send()
+            time.sleep(0.001)
+        return True
+
+    # Serial I/O threads,
+    # acks are handled and packets sent as soon as possible,
+    # instead of calling ready_check() and send() periodically:
+    def start_io(self):
+        if self.is_io_running():
             return
+        self.io_stop.clear()
+        self.reader = threading.Thread(target=self.read_loop, name="serial-reader", daemon=True)
+        self.writer = threading.Thread(target=self.write_loop, name="serial-writer", daemon=True)
+        self.reader.start()
+        self.writer.start()
+
+    def stop_io(self, timeout=None):
+        self.io_stop.set()
+        with self.buffer_changed:
+            self.buffer_changed.notify_all()
+        for thread in (self.reader, self.writer):
+            if thread is not None:
+                thread.join(timeout)
+        self.reader = None
+        self.writer = None
+
+    def is_io_running(self):
+        return self.reader is not None and self.reader.is_alive()
 
-        packet = self.buffer[0]
-        self.buffer.pop(0)
-        print("Packet: ")
-        print(packet)
+    def read_loop(self):
+        while not self.io_stop.is_set():
+            if not self.connected:
+                self.io_stop.wait(self.TIMEOUT)
+                continue
+            try:
+                # Blocks until a byte comes or TIMEOUT:
+                data = self.serial_port.read(1)
+                if data and self.serial_port.in_waiting:
+                    data = data + self.serial_port.read(self.serial_port.in_waiting)
+            except Exception:
+                # Port closed or lost, wake up waiting callers:
+                with self.buffer_changed:
+                    self.connected = False
+                    self.buffer_changed.notify_all()
+                continue
+            if data:
+                self.receive(data)
 
-        # Send packet:
-        for value in packet:
-            value = str(value) + '\r'
-            self.serial_port.write(value.encode(self.ENCODING))
+    def write_loop(self):
+        def can_send():
+            return self.io_stop.is_set() or (self.connected and self.ready and self.buffer)
 
-        # Busy...:
-        self.ready = False
+        while not self.io_stop.is_set():
+            with self.buffer_changed:
+                self.buffer_changed.wait_for(can_send, self.TIMEOUT)
+            try:
+                self.send()
+            except Exception:
+                # Port closed or lost, wake up waiting callers:
+                with self.buffer_changed:
+                    self.connected = False
+                    self.buffer_changed.notify_all()
 
     @staticmethod
     def get_devices():
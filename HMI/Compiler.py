@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import numpy as np
+from Protocol import encode
+
+
+"""
+Compiled program, <key>.* in the cache directory:
+<key>.bin   - encoded packets, one after another, sent as they are
+<key>.npy   - index, one record per packet (INDEX_DTYPE)
+<key>.json  - scara state after the program and points saved by P=
+The key is SHA-256 of the program file and everything its packets depend on:
+machine parameters, tool, start state, point table, protocol and runner stages.
+"""
+
+VERSION = 1
+
+INDEX_DTYPE = np.dtype([("offset", "<u8"),          # Packet in .bin
+                        ("size", "<u2"),
+                        ("line", "<i4"),
+                        ("has_displacement", "u1"),
+                        ("Z", "<f8"),               # Displacement of the packet
+                        ("A1", "<f8"),
+                        ("A2", "<f8"),
+                        ("A3", "<f8")])
+
+
+class CompiledProgram:
+    # Memory-mapped compiled program.
+
+    CHUNK = 1024            # Index records read at once
+
+    def __init__(self, path):
+        self.path = path
+        self.index = np.load(path + ".npy", mmap_mode="r")
+        if len(self.index):
+            self.data = np.memmap(path + ".bin", dtype=np.uint8, mode="r")
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+        with open(path + ".json", "r") as file:
+            self.metadata = json.load(file)
+
+    def __len__(self):
+        return len(self.index)
+
+    # Lazy (line, data, displacement) of the packets,
+    # data is a view into the mapped file, displacement the index record of a move
+    # (its fields by axis name, like a dict), None for other packets:
+    def packets(self):
+        data = memoryview(self.data)
+        for start in range(0, len(self.index), self.CHUNK):
+            chunk = self.index[start:start + self.CHUNK]
+            for record, offset, size, line, is_move in zip(chunk,
+                                                           chunk["offset"].tolist(),
+                                                           chunk["size"].tolist(),
+                                                           chunk["line"].tolist(),
+                                                           chunk["has_displacement"].tolist()):
+                yield line, data[offset:offset + size], record if is_move else None
+
+
+class ProgramCache:
+    # Compiles programs once, later runs stream packets from the mapped files.
+
+    DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+    CHUNK = 1024            # Index records written at once
+
+    def __init__(self, scara, directory=DIRECTORY):
+        self.scara = scara
+        self.directory = directory
+
+        # Statistics:
+        self.hits = 0
+        self.misses = 0
+
+    # Everything the packets depend on, besides the program:
+    def parameters(self, runner):
+        scara = self.scara
+        stages = []
+        for stage in (runner.optimizer, runner.planner):
+            if stage is not None:
+                stages.append([type(stage).__name__, stage.parameters()])
+        return {"version": VERSION,
+                "l1": scara.l1,
+                "l2": scara.l2,
+                "reduction": scara.reduction,
+                "min_range": scara.min_range,
+                "max_range": scara.max_range,
+                "tool": scara.current_tool,
+                "feeds": [scara.min_feed, scara.max_feed, scara.z_max_feed],
+                "linear": [scara.linear_tolerance, scara.linear_resolution],
+                "elbow": scara.elbow,
+                "collision": scara.collision.parameters(),
+                "start": self.state(rounded=True),
+                "points": {str(number): scara.points.get(number) for number in scara.points.numbers()},
+                "protocol": scara.communication.protocol,
+                "stages": stages}
+
+    def key(self, path, runner):
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for data in iter(lambda: file.read(1 << 20), b""):
+                digest.update(data)
+        digest.update(json.dumps(self.parameters(runner), sort_keys=True).encode())
+        return digest.hexdigest()
+
+    # Planning state of the scara:
+    def state(self, rounded=False):
+        scara = self.scara
+
+        def values(position):
+            if rounded:
+                # Positions after a run differ in the last bits:
+                return {name: round(value, 6) for name, value in position.items()}
+            return dict(position)
+
+        return {"target_position": values(scara.target_position),
+                "rounding_error": values(scara.rounding_error),
+                "is_absolute": scara.is_absolute,
+                "is_linear": scara.is_linear,
+                "feed": scara.feed}
+
+    def restore(self, state):
+        scara = self.scara
+        scara.target_position.update(state["target_position"])
+        scara.rounding_error.update(state["rounding_error"])
+        scara.is_absolute = state["is_absolute"]
+        scara.is_linear = state["is_linear"]
+        scara.feed = state["feed"]
+
+    # Lazy (line, packet, displacement) of the runner's program: from the compiled program if cached,
+    # otherwise converted while it runs and compiled on the way, like ProgramRunner.generate() (with its None).
+    # The scara is left in the state after the program either way:
+    def packets(self, runner):
+        path = os.path.join(self.directory, self.key(runner.path, runner))
+        if os.path.exists(path + ".json"):
+            self.hits = self.hits + 1
+            program = CompiledProgram(path)
+            self.apply(program)
+            return program.packets()
+        self.misses = self.misses + 1
+        return self.record(runner, path)
+
+    # runner.generate() written to the cache as the packets pass,
+    # index records go through a CHUNK buffer to <key>.idx, which becomes the .npy at the end,
+    # the entry is complete only if the whole program is converted:
+    def record(self, runner, path):
+        scara = self.scara
+        saved_points = dict(scara.points.points)
+        os.makedirs(self.directory, exist_ok=True)
+        chunk = np.zeros(self.CHUNK, dtype=INDEX_DTYPE)
+        used = 0
+        count = 0
+        size = 0
+        complete = False
+        try:
+            with open(path + ".bin", "wb") as file, open(path + ".idx", "wb") as index:
+                for item in runner.generate():
+                    if item is None:
+                        # Not converted yet:
+                        yield None
+                        continue
+                    line, packet, displacement = item
+                    encoded = encode(packet, scara.communication.protocol)
+                    if displacement:
+                        chunk[used] = (size, len(encoded), line, 1,
+                                       displacement["Z"], displacement["A1"], displacement["A2"], displacement["A3"])
+                    else:
+                        chunk[used] = (size, len(encoded), line, 0, 0.0, 0.0, 0.0, 0.0)
+                    used = used + 1
+                    if used == self.CHUNK:
+                        chunk.tofile(index)
+                        count = count + used
+                        used = 0
+                    file.write(encoded)
+                    size = size + len(encoded)
+                    yield line, packet, displacement
+                chunk[:used].tofile(index)
+                count = count + used
+            end = self.state()
+            taught = {str(number): point for number, point in scara.points.points.items()
+                      if saved_points.get(number) != point}
+
+            if count:
+                records = np.lib.format.open_memmap(path + ".npy", mode="w+", dtype=INDEX_DTYPE, shape=(count,))
+                records[:] = np.memmap(path + ".idx", dtype=INDEX_DTYPE, mode="r")
+                records.flush()
+                del records
+            else:
+                np.save(path + ".npy", chunk[:0])
+            # Written last, marks a complete entry:
+            temporary = path + ".json.tmp"
+            with open(temporary, "w") as file:
+                json.dump({"source": os.path.abspath(runner.path),
+                           "packets": count,
+                           "end": end,
+                           "points": taught}, file, indent=1)
+            os.replace(temporary, path + ".json")
+            complete = True
+        finally:
+            names = [path + ".idx"] if complete else [path + ".idx", path + ".bin", path + ".npy"]
+            # The index buffer, everything if stopped or failed:
+            for name in names:
+                if os.path.exists(name):
+                    os.remove(name)
+
+    # Planning state and taught points as if the program was converted:
+    def apply(self, program):
+        metadata = program.metadata
+        self.restore(metadata["end"])
+        for number, point in metadata["points"].items():
+            self.scara.points.points[int(number)] = point
+        if metadata["points"]:
+            self.scara.points.cache.clear()
+            self.scara.points.changed = True
@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+from collections import deque
+from Communication import Communication
+from Protocol import Decoder, TEXT, BINARY, ACK, NAK, REJECTED
+
+
+class VirtualController:
+    # Stand-in for the AVR controller with the pyserial port interface.
+    # Understands text packets and binary frames.
+    # Received packets wait in a queue of `slots` places,
+    # each executed packet is acknowledged with '1' (one credit for the host),
+    # a rejected frame is answered with NAK in its place, like menu() in AVR/main.c.
+
+    BITS_PER_BYTE = 10      # 8N1: start + 8 data + stop
+
+    def __init__(self, baudrate=Communication.BAUDRATE, slots=Communication.MAX_WINDOW):
+        self.baudrate = baudrate
+        self.slots = slots
+        self.port = None
+        self.is_open = True
+        self.timeout = Communication.TIMEOUT
+        self.received = threading.Condition()
+
+        self.decoder = Decoder()
+        self.queue = deque()        # Received, not executed packets
+        self.output = bytearray()
+        self.log = []               # Executed packets
+
+        # Statistics:
+        self.writes = 0
+        self.bytes_received = 0
+        self.overflows = 0          # Packets received with no free slot
+
+    # Serial port interface:
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        with self.received:
+            self.received.notify_all()
+
+    def isOpen(self):
+        return self.is_open
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.output.clear()
+
+    @property
+    def in_waiting(self):
+        self.run()
+        return len(self.output)
+
+    def read(self, size=1):
+        self.run()
+        if not self.output:
+            # Block like a serial port, until a packet comes or timeout:
+            with self.received:
+                self.received.wait_for(lambda: self.queue or not self.is_open, self.timeout)
+            self.run()
+        data = bytes(self.output[:size])
+        del self.output[:size]
+        return data
+
+    def write(self, data):
+        self.writes = self.writes + 1
+        self.bytes_received = self.bytes_received + len(data)
+        with self.received:
+            for packet in self.decoder.feed(data):
+                if len(self.queue) >= self.slots:
+                    self.overflows = self.overflows + 1
+                    continue
+                self.queue.append(packet)
+            self.received.notify_all()
+        return len(data)
+
+    # Controller side:
+    def run(self):
+        with self.received:
+            while self.queue:
+                self.execute(self.queue.popleft())
+
+    def execute(self, packet):
+        if packet[0] == REJECTED:
+            # Nothing executed, the host sends it again:
+            self.output.append(NAK)
+            return
+        self.log.append(packet)
+        # Ready for the next packet:
+        self.output.append(ACK)
+
+    def link_time(self):
+        return self.bytes_received * self.BITS_PER_BYTE / self.baudrate
+
+
+def benchmark(packets, protocol=TEXT, window=Communication.WINDOW):
+    controller = VirtualController()
+    communication = Communication(capacity=len(packets) + 1, protocol=protocol, window=window,
+                                  slots=controller.slots)
+    communication.serial_port = controller
+    communication.connected = True
+    communication.ready = True
+
+    for packet in packets:
+        communication.to_buffer(packet)
+
+    start = time.perf_counter()
+    while not communication.is_idle():
+        communication.ready_check()
+        communication.send()
+    elapsed = time.perf_counter() - start
+
+    return {"protocol": protocol,
+            "window": window,
+            "packets": len(controller.log),
+            "bytes": controller.bytes_received,
+            "writes": controller.writes,
+            "host_time": elapsed,
+            "link_time": controller.link_time(),
+            "discarded": controller.decoder.discarded,
+            "rejected": controller.decoder.rejected,
+            "overflows": controller.overflows}
+
+
+if __name__ == "__main__":
+    moves = []
+    for i in range(5000):
+        if i % 50 == 0:
+            moves.append(['F', round(random.uniform(5, 90), 1), 6.2, 10.1, 1.4])
+        moves.append(['G'] + [round(random.uniform(-500, 500), 1) for _ in range(3)] + [0.0])
+        if i % 100 == 0:
+            moves.append(['W', 0.5])
+
+    for protocol, window in ((TEXT, 1), (BINARY, 1), (BINARY, 8)):
+        result = benchmark(moves, protocol, window)
+        print("{protocol:>6}, window {window}: {packets} packets, {bytes} B, {writes} writes, "
+              "host {host_time:.3f} s, link {link_time:.2f} s".format(**result))
@@ -0,0 +1,203 @@
+import bisect
+import csv
+import json
+import threading
+import time
+from collections import deque
+
+
+# Bin edges growing by the factor from low to at least high:
+def log_edges(low, high, factor=2.0):
+    edges = [low]
+    while edges[-1] < high:
+        edges.append(edges[-1] * factor)
+    return edges
+
+
+class RollingHistogram:
+    # Values of the last samples only, in bins between the edges,
+    # values below the first edge go to the first bin, above the last one to the last bin.
+
+    def __init__(self, edges, size):
+        self.edges = list(edges)
+        self.counts = [0] * (len(self.edges) + 1)
+        self.samples = deque()          # (bin, value)
+        self.size = size
+        self.total = 0.0
+
+    def add(self, value):
+        index = bisect.bisect_right(self.edges, value)
+        self.samples.append((index, value))
+        self.counts[index] = self.counts[index] + 1
+        self.total = self.total + value
+        if len(self.samples) > self.size:
+            index, value = self.samples.popleft()
+            self.counts[index] = self.counts[index] - 1
+            self.total = self.total - value
+
+    def clear(self):
+        self.counts = [0] * len(self.counts)
+        self.samples.clear()
+        self.total = 0.0
+
+    def count(self):
+        return len(self.samples)
+
+    def mean(self):
+        return self.total / len(self.samples) if self.samples else 0.0
+
+    # Value of the quantile (0..1) of the samples:
+    def quantile(self, quantile):
+        if not self.samples:
+            return 0.0
+        values = sorted(value for _, value in self.samples)
+        return values[min(int(quantile * len(values)), len(values) - 1)]
+
+    # (low, high, count) of the bins, None - no limit:
+    def bins(self):
+        lows = [None] + self.edges
+        highs = self.edges + [None]
+        return list(zip(lows, highs, self.counts))
+
+    def summary(self):
+        return {"count": self.count(),
+                "mean": self.mean(),
+                "p50": self.quantile(0.5),
+                "p95": self.quantile(0.95),
+                "max": self.quantile(1.0),
+                "bins": self.bins()}
+
+
+class LinkMonitor:
+    # Timestamps of each packet: enqueued (to_buffer), sent (send) and acknowledged ('1'),
+    # split into where the time goes:
+    #   queue wait - enqueued -> sent, the host (conversion, window full),
+    #   transfer   - wire time of the packet's bytes at the baudrate, the link,
+    #   execute    - the controller, from the packet's arrival or the previous ack,
+    #                whichever is later, to its ack (it executes packets in order).
+    # Histograms and rates cover the last SAMPLES packets (RATE_WINDOW [s] for rates).
+    # Called by Communication under its buffer lock, read by the GUI thread.
+
+    SAMPLES = 2000
+    RATE_WINDOW = 5.0
+    BITS_PER_BYTE = 10              # 8N1: start, 8 data, stop bits
+
+    QUEUE_WAIT = "queue_wait"
+    TRANSFER = "transfer"
+    EXECUTE = "execute"
+    DEPTH = "queue_depth"
+    HISTOGRAMS = (QUEUE_WAIT, TRANSFER, EXECUTE, DEPTH)
+
+    # Timestamps [s], depth - packets queued at the ack:
+    CSV_COLUMNS = ("enqueued", "sent", "acknowledged", "bytes", "depth", QUEUE_WAIT, TRANSFER, EXECUTE)
+
+    def __init__(self, samples=SAMPLES, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        times = log_edges(1e-5, 100.0)                  # 10 us .. 164 s
+        self.histograms = {self.QUEUE_WAIT: RollingHistogram(times, samples),
+                           self.TRANSFER: RollingHistogram(times, samples),
+                           self.EXECUTE: RollingHistogram(times, samples),
+                           self.DEPTH: RollingHistogram([1, 2, 4, 8, 16, 32, 64, 128, 256], samples)}
+        self.records = deque(maxlen=samples)            # CSV_COLUMNS of acknowledged packets
+        self.acks = deque()                             # (acknowledged, bytes) within RATE_WINDOW
+        self.last_ack = 0.0
+        self.depth = 0
+
+        # Statistics:
+        self.packets = 0
+        self.bytes = 0
+
+    # Packet put in the buffer after depth packets, returns: the timestamp:
+    def enqueued(self, depth):
+        with self.lock:
+            self.depth = depth + 1
+            self.histograms[self.DEPTH].add(depth)
+        return self.clock()
+
+    # Packet taken from the buffer, depth packets left, returns: the timestamp:
+    def sent(self, depth):
+        with self.lock:
+            self.depth = depth
+        return self.clock()
+
+    # Timestamps from enqueued() and sent(), size [B]:
+    def acknowledged(self, enqueued, sent, size, baudrate):
+        transfer = size * self.BITS_PER_BYTE / baudrate if baudrate else 0.0
+        wait = sent - enqueued
+        with self.lock:
+            now = self.clock()
+            execute = max(now - max(sent + transfer, self.last_ack), 0.0)
+            self.last_ack = now
+            self.histograms[self.QUEUE_WAIT].add(wait)
+            self.histograms[self.TRANSFER].add(transfer)
+            self.histograms[self.EXECUTE].add(execute)
+            self.records.append((enqueued, sent, now, size, self.depth, wait, transfer, execute))
+            self.acks.append((now, size))
+            while self.acks and now - self.acks[0][0] > self.RATE_WINDOW:
+                self.acks.popleft()
+            self.packets = self.packets + 1
+            self.bytes = self.bytes + size
+
+    # (packets/s, bytes/s) acknowledged within RATE_WINDOW:
+    def rates(self):
+        with self.lock:
+            now = self.clock()
+            acks = [(stamp, size) for stamp, size in self.acks if now - stamp <= self.RATE_WINDOW]
+        if not acks:
+            return 0.0, 0.0
+        span = max(now - acks[0][0], 1e-3) if len(acks) > 1 else self.RATE_WINDOW
+        return len(acks) / span, sum(size for _, size in acks) / span
+
+    def reset(self):
+        with self.lock:
+            for histogram in self.histograms.values():
+                histogram.clear()
+            self.records.clear()
+            self.acks.clear()
+            self.packets = 0
+            self.bytes = 0
+
+    def snapshot(self):
+        packets_rate, bytes_rate = self.rates()
+        with self.lock:
+            return {"packets": self.packets,
+                    "bytes": self.bytes,
+                    "packets_per_s": packets_rate,
+                    "bytes_per_s": bytes_rate,
+                    "queue_depth": self.depth,
+                    "histograms": {name: histogram.summary() for name, histogram in self.histograms.items()}}
+
+    # Summary and histograms:
+    def export_json(self, path):
+        with open(path, "w") as file:
+            json.dump(self.snapshot(), file, indent=1)
+
+    # Timestamps of the last packets, one row each:
+    def export_csv(self, path):
+        with self.lock:
+            records = list(self.records)
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(self.CSV_COLUMNS)
+            writer.writerows(records)
+
+    # CSV if the path ends with .csv, JSON otherwise:
+    def export(self, path):
+        if path.lower().endswith(".csv"):
+            self.export_csv(path)
+        else:
+            self.export_json(path)
+
+    def report(self):
+        snapshot = self.snapshot()
+        lines = ["Packets: {}, {} B, {:.1f} packets/s, {:.0f} B/s, queue depth {}".format(snapshot["packets"],
+                                                                                         snapshot["bytes"],
+                                                                                         snapshot["packets_per_s"],
+                                                                                         snapshot["bytes_per_s"],
+                                                                                         snapshot["queue_depth"])]
+        for name in (self.QUEUE_WAIT, self.TRANSFER, self.EXECUTE):
+            summary = snapshot["histograms"][name]
+            lines.append("{}: mean {:.2f} ms, p50 {:.2f} ms, p95 {:.2f} ms, max {:.2f} ms".format(
+                name, summary["mean"] * 1000, summary["p50"] * 1000, summary["p95"] * 1000, summary["max"] * 1000))
+        return "\n".join(lines)
@@ -0,0 +1,270 @@
+import argparse
+import os
+import select
+import threading
+import time
+import tty
+from collections import deque
+from Protocol import Decoder, ACK, NAK, REJECTED
+from Firmware import Firmware
+
+
+class Clock:
+    # speed - 1.0 real time, 10.0 ten times faster, 0 - no waiting at all
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.now = 0.0          # Emulated time [s]
+
+    def sleep(self, seconds):
+        self.now = self.now + seconds
+        if self.speed > 0:
+            time.sleep(seconds / self.speed)
+
+
+class Emulator:
+    # Controller on a pseudo-terminal, open its `port` like a serial port.
+    # slots - 1 behaves like menu(): bytes received during a command are flushed,
+    #         N > 1 models a controller that queues N packets (pipelined window).
+
+    BITS_PER_BYTE = 10          # 8N1: start + 8 data + stop
+    POLL = 0.1
+
+    def __init__(self, baudrate=38400, speed=1.0, slots=1, boot_ack=True, log_path=None):
+        self.baudrate = baudrate
+        self.clock = Clock(speed)
+        self.slots = slots
+        self.boot_ack = boot_ack
+        self.log_path = log_path
+
+        self.firmware = Firmware()
+        self.decoder = Decoder()
+        self.queue = deque()
+        self.log = []               # (time, packet, duration)
+
+        # Statistics:
+        self.bytes_received = 0
+        self.flushed = 0            # Bytes dropped by flush()
+        self.overflows = 0          # Packets received with no free slot
+        self.hangs = 0              # Waits that would hang the firmware
+        self.rejected = 0           # Corrupted frames answered with NAK
+
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.log_file = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def open(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        if self.log_path:
+            self.log_file = open(self.log_path, 'w')
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.loop, name="emulator", daemon=True)
+        self.thread.start()
+        return self.port
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = None
+        self.slave = None
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def loop(self):
+        if self.boot_ack:
+            # First menu() call:
+            os.write(self.master, bytes([ACK]))
+
+        while not self.stop_event.is_set():
+            if not self.queue:
+                self.receive(self.POLL)
+                continue
+
+            packet = self.queue.popleft()
+            if packet[0] == REJECTED:
+                # Corrupted frame, nothing executed:
+                self.rejected = self.rejected + 1
+                reply = NAK
+            else:
+                duration = self.firmware.execute(packet)
+                self.record(packet, duration)
+                self.clock.sleep(duration)
+                reply = ACK
+
+            if self.slots == 1:
+                self.flush()
+            else:
+                self.receive(0)
+            # Send ready signal:
+            os.write(self.master, bytes([reply]))
+
+    # Read data that came within timeout, models its transfer time:
+    def receive(self, timeout):
+        data = self.read(timeout)
+        if not data:
+            return
+        self.bytes_received = self.bytes_received + len(data)
+        self.clock.sleep(len(data) * self.BITS_PER_BYTE / self.baudrate)
+        for packet in self.decoder.feed(data):
+            if len(self.queue) >= self.slots:
+                self.overflows = self.overflows + 1
+                continue
+            self.queue.append(packet)
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self.master], [], [], timeout)
+        if not ready:
+            return b''
+        try:
+            return os.read(self.master, 4096)
+        except OSError:
+            return b''
+
+    # flush() in menu(), drops what came during the command:
+    def flush(self):
+        data = self.read(0)
+        while data:
+            self.flushed = self.flushed + len(data)
+            data = self.read(0)
+        self.decoder = Decoder()
+
+    def record(self, packet, duration):
+        if packet[0] == 'W' and self.firmware.wait_steps(packet[1]) > self.firmware.MAX_WAIT_STEPS:
+            self.hangs = self.hangs + 1
+        entry = (self.clock.now, packet, duration)
+        self.log.append(entry)
+        if self.log_file is not None:
+            self.log_file.write("{:.6f}\t{:.6f}\t{}\n".format(entry[0], duration, ' '.join(str(v) for v in packet)))
+
+
+def run_program(path, emulator, window=1, protocol='text', timeout=None, planner=None, optimizer=None, cache=False,
+                processes=0, diagnostics=None):
+    # Runs the program through Scara, ProgramRunner and Communication
+    # without the GUI, returns the number of executed lines.
+    # diagnostics - CSV or JSON file of the packet timing, see Diagnostics.py.
+    # Raises TimeoutError if the program doesn't end within timeout [s]:
+    from SCARA import Scara
+    from Runner import ProgramRunner
+    from Compiler import ProgramCache
+    from Parallel import ParallelConverter
+
+    scara = Scara()
+    communication = scara.communication
+    communication.protocol = protocol
+    # The emulator queues that many packets:
+    communication.slots = emulator.slots
+    # Firmware model runs velocity profiles too:
+    communication.profiles = True
+    communication.set_window(window)
+    if not communication.serial_open(port=emulator.port):
+        raise IOError("Can't open " + emulator.port)
+    communication.start_io()
+
+    # Skip homing, start from the home position:
+    scara.current_position.update({'Z': scara.min_range['Z'],
+                                   'A1': scara.max_range['A1'],
+                                   'A2': scara.min_range['A2'],
+                                   'A3': 0.0})
+    scara.target_position.update(scara.current_position)
+    scara.homed = True
+
+    converter = ParallelConverter(scara, processes) if processes else None
+    runner = ProgramRunner(scara, planner=planner, optimizer=optimizer,
+                           cache=ProgramCache(scara) if cache else None, converter=converter)
+    runner.load(path)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        runner.start()
+        while runner.running:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("Program not finished in {} s, line {}".format(timeout, runner.line))
+            runner.step()
+            time.sleep(0.001)
+    finally:
+        runner.stop()
+        if diagnostics is not None:
+            communication.monitor.export(diagnostics)
+        communication.stop_io()
+        communication.serial_port.close()
+        if converter is not None:
+            converter.close()
+    if runner.error is not None:
+        raise runner.error
+    return runner.line
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SCARA controller emulator")
+    parser.add_argument('--baudrate', type=int, default=38400)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="1 - real time, 10 - ten times faster, 0 - no waiting")
+    parser.add_argument('--slots', type=int, default=1,
+                        help="packets the controller queues, 1 - like the firmware")
+    parser.add_argument('--log', default=None, help="command log file")
+    parser.add_argument('--program', default=None, help="run the program and exit")
+    parser.add_argument('--protocol', default='text', choices=['text', 'binary'])
+    parser.add_argument('--timeout', type=float, default=None, help="program time limit [s]")
+    parser.add_argument('--plan', action='store_true', help="plan velocity profiles ('T' packets)")
+    parser.add_argument('--optimize', action='store_true', help="remove redundant packets")
+    parser.add_argument('--cache', action='store_true', help="run the compiled program, compile if needed")
+    parser.add_argument('--processes', type=int, default=0, help="convert large programs on N processes")
+    parser.add_argument('--diagnostics', default=None, help="packet timing file, .csv or .json")
+    parser.add_argument('--trace', default='info', choices=['debug', 'info', 'warning', 'error'],
+                        help="trace level, the last events are dumped to HMI/trace.log after a fault")
+    parser.add_argument('--trace-file', default=None, help="binary trace file, read with Trace.py")
+    args = parser.parse_args()
+
+    import Trace
+    Trace.tracer.set_level(getattr(Trace, args.trace.upper()))
+    if args.trace_file is not None:
+        Trace.tracer.open_sink(args.trace_file)
+
+    with Emulator(args.baudrate, args.speed, args.slots, log_path=args.log) as emulator:
+        if args.program is None:
+            print("Emulator on " + emulator.port)
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+        else:
+            from Planner import MotionPlanner
+            from Optimizer import PacketOptimizer
+            planner = MotionPlanner(emit_profiles=True) if args.plan else None
+            optimizer = PacketOptimizer() if args.optimize else None
+            start = time.monotonic()
+            line = run_program(args.program, emulator, args.slots, args.protocol, args.timeout, planner, optimizer,
+                               args.cache, args.processes, args.diagnostics)
+            print("Lines: {}, commands: {}, emulated time: {:.2f} s, wall time: {:.2f} s, "
+                  "flushed: {} B, overflows: {}, hangs: {}, rejected: {}".format(line,
+                                                                                 len(emulator.log),
+                                                                                 emulator.clock.now,
+                                                                                 time.monotonic() - start,
+                                                                                 emulator.flushed,
+                                                                                 emulator.overflows,
+                                                                                 emulator.hangs,
+                                                                                 emulator.rejected))
+            if optimizer is not None:
+                print(optimizer.report())
+            if planner is not None:
+                print(planner.report())
+            if args.trace_file is not None:
+                Trace.tracer.close_sink()
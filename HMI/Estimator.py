@@ -0,0 +1,328 @@
+import argparse
+import time
+import numpy as np
+from Communication import Communication
+from Firmware import Firmware
+from GCode import parse_file, parse_lines, interpret, GCodeError
+from Protocol import TEXT, BINARY, HEADER_SIZE, CRC_SIZE, VALUE_SIZE
+
+
+# Lengths of str(value) for values rounded to 0.01, like encode_text():
+def text_lengths(values):
+    values = np.asarray(values, dtype=float)
+    magnitude = np.abs(values)
+    digits = np.floor(np.log10(np.maximum(magnitude, 1.0))).astype(int) + 1
+    decimals = np.where(np.round(magnitude * 100).astype(np.int64) % 10, 2, 1)
+    return np.signbit(values) + digits + 1 + decimals
+
+
+# round(value, 1) of each value: value * 10 is the rounded product and its error
+# (exact, 8 * value and 2 * value are), the error decides the halves of the product:
+def round_tenths(values):
+    values = np.asarray(values, dtype=float)
+    eight = values * 8.0
+    two = values * 2.0
+    product = eight + two
+    virtual = product - eight
+    error = (eight - (product - virtual)) + (two - virtual)
+    # Half to even if the product is exact:
+    tenths = np.rint(product)
+    half = np.abs(product - tenths) == 0.5
+    tenths = np.where(half & (error > 0), np.floor(product) + 1.0, tenths)
+    tenths = np.where(half & (error < 0), np.floor(product), tenths)
+    # -0.0 of small negative values, like round():
+    return np.copysign(tenths / 10.0, values)
+
+
+class CycleTimeEstimator:
+    # Program time without running it.
+    # Blocks are interpreted by GCode.interpret() and converted like Scara.convert() (reductions, A21 superposition,
+    # 0.1 rounding carried to the next packet), packets are timed like the firmware
+    # (prepare_simultanuous(), wait()) plus stop-and-wait serial transfer.
+    # Positions of the scara are not changed.
+
+    BITS_PER_BYTE = 10          # 8N1: start + 8 data + stop
+    ACK_SIZE = 1                # '1' after each packet
+
+    # Packet kinds:
+    FEED = 0
+    MOVE = 1
+    WAIT = 2
+
+    def __init__(self, scara, baudrate=Communication.BAUDRATE, protocol=TEXT):
+        self.scara = scara
+        self.baudrate = baudrate
+        self.protocol = protocol
+
+    def estimate_file(self, path):
+        return self.estimate(parse_file(path))
+
+    def estimate_text(self, text):
+        return self.estimate(parse_lines(text.splitlines()))
+
+    # Returns a dict with the total time [s] and times of the blocks:
+    def estimate(self, blocks):
+        blocks = list(blocks)
+        packets = self.convert(blocks)
+        kinds = np.array(packets["kinds"], dtype=np.int8)
+        block_index = np.array(packets["blocks"], dtype=np.int64)
+        is_feed = kinds == self.FEED
+        is_move = kinds == self.MOVE
+        is_wait = kinds == self.WAIT
+
+        execution = np.zeros(len(kinds))
+        size = np.zeros(len(kinds))
+        count = len(self.scara.axes_names)
+        feeds = np.array([packet[1:] for packet in packets["feeds"]], dtype=float).reshape(-1, count)
+        waits = np.array([packet[1] for packet in packets["waits"]], dtype=float)
+
+        size[is_feed] = self.packet_sizes(feeds)
+
+        # Waits, loops of 0.1 s, float rounding noise ignored like Firmware.wait_steps():
+        execution[is_wait] = np.ceil(np.round(waits / Firmware.WAIT_STEP, 6)) * Firmware.WAIT_STEP
+        size[is_wait] = self.packet_sizes(waits[:, None])
+
+        # Moves:
+        if is_move.any():
+            values = self.move_values(packets["displacements"])
+            execution[is_move] = self.move_times(values, np.cumsum(is_feed)[is_move], feeds)
+            size[is_move] = self.packet_sizes(values)
+
+        transfer = (size + self.ACK_SIZE) * self.BITS_PER_BYTE / self.baudrate
+        times = np.bincount(block_index, weights=execution + transfer, minlength=len(blocks))
+
+        return {"total": float(times.sum()),
+                "lines": np.array([block.line for block in blocks], dtype=np.int64),
+                "times": times,
+                "moves": float(execution[is_move].sum()),
+                "waits": float(execution[is_wait].sum()),
+                "transfer": float(transfer.sum()),
+                "packets": len(kinds),
+                "rejected": packets["rejected"]}
+
+    # Bytes of packets with the values (rows), without the opcode:
+    def packet_sizes(self, values):
+        if self.protocol == BINARY:
+            return np.full(len(values), HEADER_SIZE + VALUE_SIZE * values.shape[1] + CRC_SIZE)
+        # Opcode, values and '\r' after each:
+        return 2 + (text_lengths(values) + 1).sum(axis=1)
+
+    # Motor values of 'G' packets from the joint displacements:
+    def move_values(self, displacements):
+        scara = self.scara
+        names = scara.axes_names
+        displacement = np.array(displacements, dtype=float)
+
+        # Add A1:A2 superposition:
+        steps = displacement.copy()
+        steps[:, 2] = displacement[:, 2] * scara.reduction['A21'] + displacement[:, 1]
+        steps = steps * np.array([scara.reduction[name] for name in names])
+
+        # Rounding carried to the next packet like move_packet(): the values of the packets
+        # add up to the rounded sums of the steps, each one is the sum less the values before it, rounded:
+        steps[0] = steps[0] + [scara.rounding_error[name] for name in names]
+        sums = np.cumsum(steps, axis=0)
+        before = np.vstack([np.zeros((1, len(names))), round_tenths(sums[:-1])])
+        return round_tenths(sums - before)
+
+    # prepare_simultanuous(), all motors arrive with the slowest one [s]:
+    @staticmethod
+    def move_times(values, feed_index, feeds):
+        # Firmware.steps_per_us() of the motor speeds [rpm] set by the feeds, the default before the first one:
+        rpm = np.vstack([np.full((1, Firmware.NUMBER_OF_STEPPERS), float(Firmware.DEFAULT_SPEED)),
+                         feeds[:, :Firmware.NUMBER_OF_STEPPERS]])
+        speeds = np.where(rpm < 0, 0.0,
+                          np.minimum(rpm, Firmware.MAX_SPEED) * 360.0 / 60.0 / (1000000.0 * Firmware.DEG_PER_STEP))
+        speeds = speeds[feed_index]
+
+        steps = np.trunc(np.abs(values[:, :Firmware.NUMBER_OF_STEPPERS]) / Firmware.DEG_PER_STEP)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            times = np.where(speeds > 0, steps / speeds, 0.0)
+        return times.max(axis=1) / 1000000.0
+
+    # Packets of the blocks like Scara.convert(), moves as joint displacements:
+    def convert(self, blocks):
+        scara = self.scara
+        names = scara.axes_names
+        target = [scara.target_position[name] for name in names]
+        min_range = [scara.min_range[name] for name in names]
+        max_range = [scara.max_range[name] for name in names]
+        is_absolute = scara.is_absolute
+        is_linear = scara.is_linear
+        table = scara.points
+        saved = {}              # Points saved by P= in the program
+
+        packets = {"kinds": [], "blocks": [], "feeds": [], "waits": [], "displacements": [], "rejected": 0}
+        kinds = packets["kinds"]
+        block_index = packets["blocks"]
+        displacements = packets["displacements"]
+
+        def in_range(position, displacement):
+            for value, step, low, high in zip(position, displacement, min_range, max_range):
+                if value + step > high or value + step < low:
+                    return False
+            return True
+
+        # Returns the new target:
+        def add_move(k, position, displacement):
+            kinds.append(self.MOVE)
+            block_index.append(k)
+            displacements.append(displacement)
+            return [value + step for value, step in zip(position, displacement)]
+
+        # Inverse kinematics of blocks with X and Y at once, both elbows:
+        both = [k for k, block in enumerate(blocks) if 'X' in block and 'Y' in block]
+        xy = np.array([[blocks[k].get('X'), blocks[k].get('Y')] for k in both], dtype=float).reshape(-1, 2)
+        solutions = {k: [] for k in both}
+        elbows = (scara.elbow,) if scara.elbow else (scara.ELBOW_POSITIVE, scara.ELBOW_NEGATIVE)
+        for elbow in elbows:
+            angles, _ = scara.inverse_kinematics_batch(xy, elbow)
+            reachable = scara.workspace.is_reachable_batch(xy, elbow)
+            for k, a, r in zip(both, angles.tolist(), reachable):
+                if r:
+                    solutions[k].append(tuple(a))
+        feed = scara.feed
+
+        for k, block in enumerate(blocks):
+            motion = interpret(block, is_absolute, is_linear)
+            is_absolute = motion.is_absolute
+            is_linear = motion.is_linear
+
+            if motion.feed is not None:
+                packet, feed = self.feed_packet(motion.feed, feed)
+                if packet:
+                    kinds.append(self.FEED)
+                    block_index.append(k)
+                    packets["feeds"].append(packet)
+
+            # Points saved by the program are not written to the table:
+            if motion.save is not None:
+                position = dict(zip(names, target))
+                saved[motion.save] = table.solve(table.point(position))
+
+            point = None
+            if motion.recall is not None:
+                number = motion.recall
+                if number in saved:
+                    point = saved[number]
+                elif number in table:
+                    point = table.recall(number)
+                else:
+                    raise GCodeError(block.line, "point {} not defined".format(number))
+                if point is None:
+                    raise GCodeError(block.line, "point {} out of range".format(number))
+
+            # Motion programming, the same float operations as convert() and move_packet():
+            displacement = motion.displacement(names, target)
+            is_motion_programmed = bool(motion.joints)
+
+            if motion.xy is not None:
+                if motion.is_absolute_xy():
+                    end = motion.end()
+                    candidates = solutions[k]
+                else:
+                    end = motion.end(scara.forward_kinematics({'A1': target[1], 'A2': target[2]}))
+                    candidates = [] if is_linear else scara.inverse_kinematics_solutions(end)
+                solution = None
+                if not is_linear:
+                    solution = scara.fastest_solution(candidates, dict(zip(names, target)), feed)
+                    solution = (solution['A1'], solution['A2']) if solution else None
+
+                if is_linear:
+                    segments = scara.linear_segments([end['X'], end['Y']], target[1:3])
+                    if segments is None:
+                        packets["rejected"] = packets["rejected"] + 1
+                    else:
+                        # Other axes move proportionally:
+                        done = 0.0
+                        for (a1, a2), fraction in zip(segments[0].tolist(), segments[1].tolist()):
+                            segment = [value * (fraction - done) for value in displacement]
+                            segment[1] = a1 - target[1]
+                            segment[2] = a2 - target[2]
+                            done = fraction
+                            if not in_range(target, segment):
+                                packets["rejected"] = packets["rejected"] + 1
+                                break
+                            target = add_move(k, target, segment)
+                    is_motion_programmed = False
+                elif solution is not None:
+                    displacement[1] = solution[0] - target[1]
+                    displacement[2] = solution[1] - target[2]
+                    is_motion_programmed = True
+                else:
+                    packets["rejected"] = packets["rejected"] + 1
+                    is_motion_programmed = False
+
+            if is_motion_programmed:
+                if in_range(target, displacement):
+                    target = add_move(k, target, displacement)
+                else:
+                    packets["rejected"] = packets["rejected"] + 1
+
+            if point is not None:
+                displacement = [point["position"][name] - value for name, value in zip(names, target)]
+                if in_range(target, displacement):
+                    target = add_move(k, target, displacement)
+                else:
+                    packets["rejected"] = packets["rejected"] + 1
+
+            if motion.wait is not None:
+                packet = scara.wait_packet(motion.wait)
+                if packet:
+                    kinds.append(self.WAIT)
+                    block_index.append(k)
+                    packets["waits"].append(packet)
+
+        return packets
+
+    # Scara.feed_packet() without setting the feed of the scara (it notifies the GUI),
+    # returns: (packet, the new feed):
+    def feed_packet(self, feed, current):
+        scara = self.scara
+        if not feed:
+            return None, current
+        if feed > scara.max_feed:
+            feed = scara.max_feed
+        if feed < scara.min_feed:
+            feed = scara.max_feed
+        speeds = scara.axis_feeds(feed)
+        return ['F'] + [round(speeds[name], 1) for name in scara.axes_names], feed
+
+
+def format_time(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return "{}:{:02d}:{:05.2f}".format(hours, minutes, seconds)
+
+
+if __name__ == "__main__":
+    from SCARA import Scara
+
+    parser = argparse.ArgumentParser(description="SCARA program cycle time")
+    parser.add_argument('program')
+    parser.add_argument('--baudrate', type=int, default=Communication.BAUDRATE)
+    parser.add_argument('--protocol', default=TEXT, choices=[TEXT, BINARY])
+    parser.add_argument('--slowest', type=int, default=0, help="print the slowest blocks")
+    args = parser.parse_args()
+
+    # From the home position:
+    scara = Scara()
+    scara.target_position.update({'Z': scara.min_range['Z'],
+                                  'A1': scara.max_range['A1'],
+                                  'A2': scara.min_range['A2'],
+                                  'A3': 0.0})
+
+    start = time.perf_counter()
+    result = CycleTimeEstimator(scara, args.baudrate, args.protocol).estimate_file(args.program)
+    elapsed = time.perf_counter() - start
+
+    print("Cycle time: {} (moves {:.2f} s, waits {:.2f} s, transfer {:.2f} s)".format(format_time(result["total"]),
+                                                                                      result["moves"],
+                                                                                      result["waits"],
+                                                                                      result["transfer"]))
+    print("Blocks: {}, packets: {}, out of range: {}, estimated in {:.3f} s".format(len(result["lines"]),
+                                                                                    result["packets"],
+                                                                                    result["rejected"],
+                                                                                    elapsed))
+    for k in np.argsort(result["times"])[::-1][:args.slowest]:
+        print("Line {}: {:.3f} s".format(result["lines"][k], result["times"][k]))
@@ -0,0 +1,88 @@
+import math
+import numpy as np
+
+
+# Time of a trapezoidal velocity profile [s],
+# length [deg], speeds [deg/s], acceleration [deg/s^2], arrays or floats:
+def trapezoid_time(length, entry, cruise, exit, acceleration):
+    length, entry, cruise, exit = np.broadcast_arrays(*[np.asarray(value, dtype=float)
+                                                        for value in (length, entry, cruise, exit)])
+    acceleration = np.asarray(acceleration, dtype=float)
+    accelerate = (cruise * cruise - entry * entry) / (2 * acceleration)
+    decelerate = (cruise * cruise - exit * exit) / (2 * acceleration)
+    # Triangle profile if cruise speed is not reached:
+    triangle = accelerate + decelerate > length
+    peak = np.where(triangle,
+                    np.sqrt(np.maximum(acceleration * length + (entry * entry + exit * exit) / 2, 0.0)),
+                    cruise)
+    accelerate = np.where(triangle, (peak * peak - entry * entry) / (2 * acceleration), accelerate)
+    decelerate = np.where(triangle, (peak * peak - exit * exit) / (2 * acceleration), decelerate)
+    plateau = np.maximum(length - accelerate - decelerate, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        time = (peak - entry) / acceleration + (peak - exit) / acceleration + \
+            np.where(peak > 0, plateau / peak, 0.0)
+    return time
+
+
+class Firmware:
+    # Timing model of AVR/main.c and AVR/Stepper.c
+
+    NUMBER_OF_AXES = 4          # Values in 'G' and 'F' packets
+    # 'T' packet: 4 displacements [deg], entry, cruise, exit speed [deg/s]
+    # and acceleration [deg/s^2] of the longest axis, see Planner.py
+    NUMBER_OF_STEPPERS = 3      # Z, ARM, FOREARM
+    STEPPING = 4                # 1/4 step
+    DEG_PER_STEP = 1.8 / STEPPING
+    DEFAULT_SPEED = 50          # [rpm]
+    MAX_SPEED = 1200            # [rpm]
+    WAIT_STEP = 0.1             # wait() loops _delay_ms(100)
+    MAX_WAIT_STEPS = 255        # uint8_t loop counter in wait()
+
+    def __init__(self):
+        self.speeds = [self.steps_per_us(self.DEFAULT_SPEED)] * self.NUMBER_OF_STEPPERS
+
+    # rpm -> deg/s:
+    @classmethod
+    def degrees_per_second(cls, rpm):
+        return min(max(rpm, 0.0), cls.MAX_SPEED) * 360.0 / 60.0
+
+    # set_speed(), rpm -> steps/us:
+    @classmethod
+    def steps_per_us(cls, rpm):
+        if rpm < 0:
+            return 0.0
+        rpm = min(rpm, cls.MAX_SPEED)
+        return rpm * 360.0 / 60.0 / (1000000.0 * cls.DEG_PER_STEP)
+
+    def set_feed(self, feed):
+        for i in range(self.NUMBER_OF_STEPPERS):
+            self.speeds[i] = self.steps_per_us(feed[i])
+
+    # prepare_simultanuous(), all motors arrive with the slowest one [s]:
+    def move_time(self, angles):
+        longest_time = 0.0
+        for i in range(self.NUMBER_OF_STEPPERS):
+            steps = int(abs(angles[i]) / self.DEG_PER_STEP)
+            if self.speeds[i]:
+                longest_time = max(longest_time, steps / self.speeds[i])
+        return longest_time / 1000000.0
+
+    # Loops of wait(), float rounding noise ignored:
+    @classmethod
+    def wait_steps(cls, time_s):
+        return math.ceil(round(time_s / cls.WAIT_STEP, 6))
+
+    # Returns execution time [s] of the packet:
+    def execute(self, packet):
+        function_code = packet[0]
+        values = packet[1:]
+        if function_code == 'G':
+            return self.move_time(values)
+        if function_code == 'F':
+            self.set_feed(values)
+        if function_code == 'W':
+            return self.wait_steps(values[0]) * self.WAIT_STEP
+        if function_code == 'T':
+            longest = max(abs(value) for value in values[:self.NUMBER_OF_STEPPERS])
+            return float(trapezoid_time(longest, *values[self.NUMBER_OF_AXES:self.NUMBER_OF_AXES + 4]))
+        return 0.0
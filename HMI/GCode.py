@@ -0,0 +1,246 @@
+import re
+
+
+"""
+Supported words:
+G54 Px                  # Select zero point
+G0/G1                   # Joint / Linear XY motion
+F                       # Feed [mm/min]
+G90/G91                 # Absolute / Incremental mode
+P=x                     # Save point
+X, Y, Z, A1=, A2=, A3=  # Motion target point
+P(x)                    # Move to point x
+M                       # Gripper
+G4.x                    # Wait x seconds
+N                       # Line number (ignored)
+;                       # Comment till the end of line
+"""
+
+# Modal groups:
+NON_MODAL = "non_modal"
+MOTION = "motion"
+DISTANCE = "distance"
+COORDINATE_SYSTEM = "coordinate_system"
+FEED = "feed"
+AXIS = "axis"
+POINT = "point"
+GRIPPER = "gripper"
+PARAMETER = "parameter"
+LINE_NUMBER = "line_number"
+
+G_GROUPS = {0: MOTION,
+            1: MOTION,
+            54: COORDINATE_SYSTEM,
+            90: DISTANCE,
+            91: DISTANCE}
+
+WORD_GROUPS = {"G4.": NON_MODAL,
+               "F": FEED,
+               "X": AXIS,
+               "Y": AXIS,
+               "Z": AXIS,
+               "A1": AXIS,
+               "A2": AXIS,
+               "A3": AXIS,
+               "P=": POINT,
+               "P(": POINT,
+               "P": PARAMETER,
+               "M": GRIPPER,
+               "N": LINE_NUMBER}
+
+# Groups that can be programmed only once in a block:
+EXCLUSIVE_GROUPS = (NON_MODAL, MOTION, DISTANCE, COORDINATE_SYSTEM, FEED, POINT, GRIPPER)
+
+_NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)"
+_WORD = r"(G4\.|A[1-3]=|P=|P\(|[A-Z])(" + _NUMBER + r")(\)?)"
+# Anything that is not a word ends up in the last group:
+_TOKEN_PATTERN = re.compile(_WORD + r"|(.+)")
+
+# Word as written -> (letter, group, key that must be unique in a block):
+_WORDS = {}
+for _letter, _group in WORD_GROUPS.items():
+    _written = _letter + "=" if _group == AXIS and _letter[0] == "A" else _letter
+    _key = _group if _group in EXCLUSIVE_GROUPS else _letter
+    _WORDS[_written] = (_letter, _group, _key)
+
+
+class GCodeError(ValueError):
+    def __init__(self, line, message):
+        self.line = line
+        self.message = message
+        ValueError.__init__(self, "Line {}: {}".format(line, message))
+
+
+class Block:
+    __slots__ = ("line", "words")
+
+    def __init__(self, line, words):
+        self.line = line        # Line number
+        self.words = words      # Tuple of (letter, value, group)
+
+    def __contains__(self, letter):
+        for word in self.words:
+            if word[0] == letter:
+                return True
+        return False
+
+    def __repr__(self):
+        return "Block({}, {})".format(self.line, self.words)
+
+    def get(self, letter, default=None):
+        for word in self.words:
+            if word[0] == letter:
+                return word[1]
+        return default
+
+    def modal(self, group, default=None):
+        for word in self.words:
+            if word[2] == group:
+                return word
+        return default
+
+    def has_g(self, code):
+        for word in self.words:
+            if word[0] == "G" and word[1] == code:
+                return True
+        return False
+
+
+class Motion:
+    # What a block programs under the modal state, the one interpretation of G90/G91,
+    # G0/G1, P=, P(, joint and XY words for Scara.convert(), CycleTimeEstimator
+    # and ProgramValidator, which differ only in what they do with the moves.
+    __slots__ = ("line", "is_absolute", "is_linear", "feed", "save", "recall", "joints", "xy", "wait")
+
+    def __init__(self, line, is_absolute, is_linear):
+        self.line = line
+        self.is_absolute = is_absolute     # Modal state after the block
+        self.is_linear = is_linear
+        self.feed = None        # F value
+        self.save = None        # Point number of P=
+        self.recall = None      # Point number of P(
+        self.joints = {}        # Programmed axes (Z, A1, A2, A3) -> value as written
+        self.xy = None          # X and/or Y as written, None if not programmed or both A1, A2 are
+        self.wait = None        # G4. time [s]
+
+    # Joint displacements in the order of names, target - joint position before the block
+    # (value - target if absolute, as in the original Scara.convert()):
+    def displacement(self, names, target):
+        joints = self.joints
+        if self.is_absolute:
+            return [joints[name] - value if name in joints else 0.0 for name, value in zip(names, target)]
+        return [joints.get(name, 0.0) for name in names]
+
+    # Joint position after the joint words:
+    def joint_target(self, names, target):
+        joints = self.joints
+        if self.is_absolute:
+            return [joints.get(name, value) for name, value in zip(names, target)]
+        return [value + joints[name] if name in joints else value for name, value in zip(names, target)]
+
+    # The XY end doesn't depend on the start:
+    def is_absolute_xy(self):
+        return self.is_absolute and len(self.xy) == 2
+
+    # XY end {'X', 'Y'} of the move, xy - XY of the target before the block
+    # (not needed if is_absolute_xy()):
+    def end(self, xy=None):
+        if self.is_absolute_xy():
+            return {'X': self.xy['X'], 'Y': self.xy['Y']}
+        end = dict(xy)
+        for name, value in self.xy.items():
+            end[name] = value if self.is_absolute else end[name] + value
+        return end
+
+
+JOINT_LETTERS = ("Z", "A1", "A2", "A3")
+
+
+# Motion of the block, is_absolute and is_linear - modal state before it:
+def interpret(block, is_absolute, is_linear):
+    words = {word[0]: word[1] for word in block.words}
+    for letter, value, _ in block.words:
+        if letter != "G":
+            continue
+        if value == 90:
+            is_absolute = True
+        elif value == 91:
+            is_absolute = False
+        elif value == 0:
+            is_linear = False
+        elif value == 1:
+            is_linear = True
+
+    motion = Motion(block.line, is_absolute, is_linear)
+    motion.feed = words.get("F")
+    if "P=" in words:
+        motion.save = int(words["P="])
+    if "P(" in words:
+        motion.recall = int(words["P("])
+    motion.joints = {letter: words[letter] for letter in JOINT_LETTERS if letter in words}
+    # If A1 and A2 are programmed, X and Y are skipped:
+    if ("A1" not in words or "A2" not in words) and ("X" in words or "Y" in words):
+        motion.xy = {letter: words[letter] for letter in ("X", "Y") if letter in words}
+    motion.wait = words.get("G4.")
+    return motion
+
+
+def parse_line(text, line=1):
+    if ";" in text:
+        text = text.split(";", 1)[0]
+    # Remove spaces, everything uppercase:
+    text = "".join(text.split()).upper()
+    if not text:
+        return Block(line, ())
+
+    words = []
+    keys = []
+    for written, value, bracket, rest in _TOKEN_PATTERN.findall(text):
+        if rest:
+            raise GCodeError(line, "unexpected '{}'".format(rest))
+        if (written == "P(") != bool(bracket):
+            raise GCodeError(line, "unbalanced bracket in '{}{}'".format(written, value))
+        value = float(value)
+
+        if written == "G":
+            group = G_GROUPS.get(value)
+            if group is None:
+                raise GCodeError(line, "unsupported G{:g}".format(value))
+            words.append(("G", value, group))
+            keys.append(group)
+            continue
+
+        try:
+            letter, group, key = _WORDS[written]
+        except KeyError:
+            raise GCodeError(line, "unsupported word '{}'".format(written))
+        words.append((letter, value, group))
+        keys.append(key)
+
+    if len(set(keys)) != len(keys):
+        _check_duplicates(keys, line)
+
+    return Block(line, tuple(words))
+
+
+def parse_lines(lines, start=1):
+    # Lazy, one block per non-empty line:
+    for line, text in enumerate(lines, start):
+        block = parse_line(text, line)
+        if block.words:
+            yield block
+
+
+def parse_file(path, start=1):
+    with open(path, "r") as file:
+        yield from parse_lines(file, start)
+
+
+def _check_duplicates(keys, line):
+    seen = set()
+    for key in keys:
+        if key in seen:
+            if key in EXCLUSIVE_GROUPS:
+                raise GCodeError(line, "more than one word of '{}' group".format(key))
+            raise GCodeError(line, "{} programmed twice".format(key))
+        seen.add(key)
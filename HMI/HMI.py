@@ -1,16 +1,29 @@
 from SCARA import Scara
+from Runner import ProgramRunner
+from Parallel import ParallelConverter
+from Compiler import ProgramCache
 from Widgets import *
+import time
 import tkinter as tk
 from tkinter import ttk
 
 
 class Application(tk.Tk):
+    # Widgets are refreshed at most 20 times per second:
+    REFRESH_INTERVAL = 0.05
+
     def __init__(self):
         tk.Tk.__init__(self)
         self.title("SCARA HMI")
         self.resizable(0, 0)
 
         self.scara = Scara()
+        # Acks and packets are handled by the serial I/O threads:
+        self.scara.communication.start_io()
+        # Large programs are converted and validated on all cores:
+        self.converter = ParallelConverter(self.scara)
+        # Programs run again stream their compiled packets:
+        self.runner = ProgramRunner(self.scara, cache=ProgramCache(self.scara), converter=self.converter)
 
         # Tabs:
         self.notebook = ttk.Notebook(self.master, padding=5)
@@ -45,7 +58,7 @@ class Application(tk.Tk):
             self.status_bar_manual = StatusBar(self.tabs[name], scara=self.scara)
             self.status_bar_manual.grid(column=0, row=0, columnspan=2, sticky='EW')
 
-            self.simulation_manual = Simulation(self.tabs[name])
+            self.simulation_manual = Simulation(self.tabs[name], scara=self.scara)
             self.simulation_manual.grid(column=0, row=1, sticky='W')
 
             self.control_frame = tk.Frame(self.tabs[name])
@@ -54,7 +67,7 @@ class Application(tk.Tk):
             self.control_frame.columnconfigure(1, weight=1)
             self.control_frame.rowconfigure(1, weight=1)
 
-            self.mdi = MDI(self.control_frame, scara=self.scara)
+            self.mdi = MDI(self.control_frame, scara=self.scara, app=self)
             self.mdi.grid(column=0, row=0, columnspan=2, sticky='NEW')
             self.bind("<Return>", self.mdi.start_mdi)
 
@@ -76,16 +89,22 @@ class Application(tk.Tk):
             name = self.tab_names[1]
 
             self.status_bar_auto = StatusBar(self.tabs[name], scara=self.scara)
-            self.status_bar_auto.grid(column=0, row=0, columnspan=2, sticky='EW')
+            self.status_bar_auto.grid(column=0, row=0, columnspan=3, sticky='EW')
 
-            self.simulation_manual = Simulation(self.tabs[name])
-            self.simulation_manual.grid(column=0, row=1, sticky='W')
+            self.simulation_auto = Simulation(self.tabs[name], scara=self.scara)
+            self.simulation_auto.grid(column=0, row=1, sticky='W')
+
+            self.toolpath = Toolpath(self.tabs[name], scara=self.scara)
+            self.toolpath.grid(column=1, row=1, sticky='W')
+
+            self.program_control = ProgramControl(self.tabs[name], runner=self.runner, app=self)
+            self.program_control.grid(column=2, row=1, sticky='NEW')
 
             self.position_frame_auto = PositionPanel(self.tabs[name],
                                                      self.scara,
                                                      self.step_size_frame.step_size,
                                                      read_only=True)
-            self.position_frame_auto.grid(column=0, row=2, columnspan=2, sticky='EW')
+            self.position_frame_auto.grid(column=0, row=2, columnspan=3, sticky='EW')
 
         # Settings tab:
         if True:
@@ -102,9 +121,11 @@ class Application(tk.Tk):
             self.content_frame.grid(column=1, row=0, sticky='nsew', padx=5)
 
             self.contents = {"Tool table": None,
-                             "Point table": None,
+                             "Point table": Points(self.content_frame, scara=self.scara, app=self),
+                             "Obstacles": Obstacles(self.content_frame, scara=self.scara, app=self),
                              "Machine": None,
                              "Connection": Connection(self.content_frame, scara=self.scara, app=self),
+                             "Diagnostics": Diagnostics(self.content_frame, scara=self.scara, app=self),
                              "Service mode": Service(self.content_frame, scara=self.scara, app=self),
                              "Help": None}
 
@@ -125,6 +146,30 @@ class Application(tk.Tk):
                                                            command=self.display_content)
                 self.menu_options[option].grid(column=0, row=i, padx=10, sticky='N')
 
+        # Widgets are updated only when the state changes:
+        notifier = self.scara.notifier
+        notifier.subscribe(notifier.CONNECTED, self.display_connected)
+        notifier.subscribe(notifier.READY, self.display_ready)
+        for panel in (self.position_frame_manual, self.position_frame_auto):
+            notifier.subscribe(notifier.POSITION, panel.display_pos)
+        for simulation in (self.simulation_manual, self.simulation_auto):
+            notifier.subscribe(notifier.POSITION, simulation.refresh)
+        for status_bar in (self.status_bar_manual, self.status_bar_auto):
+            notifier.subscribe(notifier.FEED, status_bar.refresh)
+            notifier.subscribe(notifier.IN_FLIGHT, status_bar.refresh)
+        # Show everything at the first refresh:
+        notifier.publish_all()
+        self.refreshed = 0.0
+
+        # Temporary files of the toolpath, the pool and the serial threads go with the window:
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+    def close(self):
+        self.toolpath.close()
+        self.converter.close()
+        self.scara.communication.stop_io(timeout=1.0)
+        self.destroy()
+
     def display_content(self):
         for content in self.contents.values():
             try:
@@ -136,37 +181,39 @@ class Application(tk.Tk):
         except AttributeError:
             pass
 
+    def display_connected(self):
+        self.connected_status.set(self.scara.communication.connected)
+
+    def display_ready(self):
+        self.ready_status.set(self.scara.communication.ready)
+
     def display(self):
-        # If connected update status:
-        if root.scara.communication.connected:
-            root.connected_status.activate()
-        else:
-            root.connected_status.deactivate()
+        # Apply finished movements:
+        if self.scara.homed:
+            self.scara.update_position()
 
-        if not root.scara.homed:
+        # Changes wait for the next refresh:
+        now = time.monotonic()
+        if now - self.refreshed < self.REFRESH_INTERVAL:
             return
+        self.refreshed = now
 
-        # If homed:
-
-        # If movement finished
-        # update ready status:
-        if root.scara.communication.ready:
-            root.ready_status.activate()
-            root.scara.update_position()
-        else:
-            root.ready_status.deactivate()
+        notifier = self.scara.notifier
+        if not self.scara.homed:
+            # Only the connection status until homed:
+            notifier.dispatch([notifier.CONNECTED])
+            return
 
-        # Update current position:
-        self.position_frame_manual.display_pos()
-        self.position_frame_auto.display_pos()
-        self.status_bar_manual.refresh()
-        self.status_bar_auto.refresh()
+        # If homed:
+        notifier.dispatch()
+        self.program_control.refresh()
+        # The line the controller has done, not the one converted or sent:
+        self.toolpath.show_line(self.scara.executed_line)
 
 
 def update():
     root.scara.communication.connection_check()
-    root.scara.communication.ready_check()
-    root.scara.communication.send()
+    root.runner.step()
     root.scara.homing_finished()
     root.display()
     # Run update() each 10 ms:
@@ -176,4 +223,7 @@ def update():
 if __name__ == "__main__":
     root = Application()
     update()
-    root.mainloop()
+    try:
+        root.mainloop()
+    except KeyboardInterrupt:
+        root.close()
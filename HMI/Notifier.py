@@ -0,0 +1,52 @@
+import threading
+
+
+class ChangeNotifier:
+    # Topics of the robot state changed since the last dispatch().
+    # publish() may be called from any thread (serial I/O),
+    # subscribers are called by dispatch() in the GUI thread,
+    # once for each changed topic, however many times it changed in between.
+
+    # Topics:
+    POSITION = "position"       # current_position, displacement, current_xy
+    FEED = "feed"
+    READY = "ready"
+    CONNECTED = "connected"
+    IN_FLIGHT = "in_flight"     # Packets in flight and the window
+    TOPICS = (POSITION, FEED, READY, CONNECTED, IN_FLIGHT)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = set()
+        self.subscribers = {}       # topic -> callbacks
+
+        # Statistics:
+        self.dispatched = 0
+
+    def publish(self, topic):
+        with self.lock:
+            self.changed.add(topic)
+
+    # Everything is shown again at the next dispatch():
+    def publish_all(self):
+        with self.lock:
+            self.changed.update(self.TOPICS)
+
+    def subscribe(self, topic, callback):
+        self.subscribers.setdefault(topic, []).append(callback)
+
+    # Call subscribers of the changed topics (of the given ones only),
+    # the others stay changed, returns: dispatched topics:
+    def dispatch(self, topics=None):
+        with self.lock:
+            if topics is None:
+                changed = self.changed
+                self.changed = set()
+            else:
+                changed = self.changed.intersection(topics)
+                self.changed.difference_update(changed)
+        for topic in changed:
+            for callback in self.subscribers.get(topic, ()):
+                callback()
+        self.dispatched = self.dispatched + len(changed)
+        return changed
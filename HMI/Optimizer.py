@@ -0,0 +1,195 @@
+import numpy as np
+from Firmware import Firmware
+from Protocol import encode, VALUE_LIMIT, SCALE
+
+
+class PacketOptimizer:
+    # Removes redundant packets from the outgoing stream:
+    # - 'F' equal to the feed already sent, or overwritten before any move,
+    # - 'G' with all values zero,
+    # - consecutive 'W' merged into one (up to the firmware's loop counter),
+    # - consecutive collinear 'G' merged while the path stays within tolerance.
+    # Each saved packet is a saved round trip with stop-and-wait.
+    # Tags are (line, displacement) like in ProgramRunner, merged tags keep
+    # the last line and the sum of displacements, so positions stay exact.
+
+    TOLERANCE = 0.1             # Max deviation of merged moves [motor deg]
+    MAX_VALUE = (VALUE_LIMIT - 1) / SCALE
+
+    def __init__(self, tolerance=TOLERANCE, merge_moves=True):
+        self.tolerance = tolerance
+        self.merge_moves = merge_moves
+
+        self.feed = None            # Last feed sent
+        self.pending_feed = None    # (packet, tag) not sent yet
+        self.move = None            # [values, tag, waypoints] of merged moves
+        self.wait = None            # [steps, tag] of merged waits
+        self.carry = None           # Displacement of dropped zero moves
+
+        # Statistics:
+        self.packets_in = 0
+        self.packets_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dropped_feeds = 0
+        self.dropped_moves = 0
+        self.merged_waits = 0
+        self.merged_moves = 0
+
+    # Settings that change the output:
+    def parameters(self):
+        return [self.tolerance, self.merge_moves]
+
+    def push(self, packet, tag=None):
+        self.packets_in = self.packets_in + 1
+        self.bytes_in = self.bytes_in + len(encode(packet))
+        function_code = packet[0]
+        released = []
+
+        if function_code == 'F':
+            if self.pending_feed is not None:
+                self.dropped_feeds = self.dropped_feeds + 1
+            self.pending_feed = (packet, tag)
+            return released
+
+        if function_code == 'G':
+            self.release_wait(released)
+            if not any(packet[1:]):
+                # Keep its displacement for the next move:
+                self.dropped_moves = self.dropped_moves + 1
+                self.carry = add_tags(self.carry, tag)
+                return released
+            if self.pending_feed is not None:
+                if self.pending_feed[0][1:] == self.feed:
+                    # The same feed, moves can still be merged:
+                    self.dropped_feeds = self.dropped_feeds + 1
+                    self.pending_feed = None
+                else:
+                    self.release_move(released)
+                    self.release_feed(released)
+            tag = add_tags(self.carry, tag)
+            self.carry = None
+            self.add_move(packet, tag, released)
+            return released
+
+        if function_code == 'W':
+            self.release_move(released)
+            steps = Firmware.wait_steps(packet[1])
+            if self.wait is not None and self.wait[0] + steps <= Firmware.MAX_WAIT_STEPS:
+                self.merged_waits = self.merged_waits + 1
+                self.wait[0] = self.wait[0] + steps
+                self.wait[1] = add_tags(self.wait[1], tag)
+                return released
+            self.release_wait(released)
+            self.wait = [steps, tag]
+            return released
+
+        # Other packets keep their place in the stream:
+        self.release_move(released)
+        self.release_wait(released)
+        self.output(released, packet, tag)
+        return released
+
+    # Release everything:
+    def flush(self):
+        released = []
+        self.release_move(released)
+        self.release_wait(released)
+        self.release_feed(released)
+        if self.carry is not None:
+            # No move left to carry it, send the zero move:
+            self.output(released, ['G', 0.0, 0.0, 0.0, 0.0], self.carry)
+            self.carry = None
+        return released
+
+    # Drop packets not released, the next feed is sent again:
+    def clear(self):
+        self.feed = None
+        self.pending_feed = None
+        self.move = None
+        self.wait = None
+        self.carry = None
+
+    def add_move(self, packet, tag, released):
+        values = np.array(packet[1:], dtype=float)
+        if self.move is not None and self.is_mergeable(values):
+            self.merged_moves = self.merged_moves + 1
+            self.move[2].append(self.move[0])
+            self.move[0] = self.move[0] + values
+            self.move[1] = add_tags(self.move[1], tag)
+            return
+        self.release_move(released)
+        self.move = [values, tag, []]
+
+    # Joined move passes the previous ends within tolerance:
+    def is_mergeable(self, values):
+        if not self.merge_moves:
+            return False
+        total, tag, waypoints = self.move
+        end = total + values
+        if np.abs(end).max() > self.MAX_VALUE:
+            return False
+        length = np.sqrt(end @ end)
+        if not length:
+            # Back to the start, the arm has to get there:
+            return False
+        for point in waypoints + [total]:
+            # Distance of the point from the line 0 -> end:
+            along = point @ end / length
+            if along < 0 or along > length:
+                return False
+            if point @ point - along * along > self.tolerance * self.tolerance:
+                return False
+        return True
+
+    def release_move(self, released):
+        if self.move is None:
+            return
+        values, tag, waypoints = self.move
+        self.move = None
+        self.output(released, ['G'] + [round(float(value), 1) for value in values], tag)
+
+    def release_wait(self, released):
+        if self.wait is None:
+            return
+        steps, tag = self.wait
+        self.wait = None
+        self.output(released, ['W', round(steps * Firmware.WAIT_STEP, 2)], tag)
+
+    def release_feed(self, released):
+        if self.pending_feed is None:
+            return
+        packet, tag = self.pending_feed
+        self.pending_feed = None
+        if packet[1:] == self.feed:
+            self.dropped_feeds = self.dropped_feeds + 1
+            return
+        self.feed = packet[1:]
+        self.output(released, packet, tag)
+
+    def output(self, released, packet, tag):
+        self.packets_out = self.packets_out + 1
+        self.bytes_out = self.bytes_out + len(encode(packet))
+        released.append((packet, tag))
+
+    def report(self):
+        return ("Packets: {} -> {}, round trips saved: {}, bytes saved: {} "
+                "(feeds: {}, zero moves: {}, merged waits: {}, merged moves: {})").format(
+            self.packets_in, self.packets_out, self.packets_in - self.packets_out,
+            self.bytes_in - self.bytes_out, self.dropped_feeds, self.dropped_moves,
+            self.merged_waits, self.merged_moves)
+
+
+# Tags (line, displacement) of joined packets:
+def add_tags(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    line, displacement = second
+    if first[1]:
+        total = dict(first[1])
+        for name, value in (displacement or {}).items():
+            total[name] = total.get(name, 0.0) + value
+        displacement = total
+    return line, displacement
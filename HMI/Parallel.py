@@ -0,0 +1,377 @@
+import multiprocessing
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from GCode import parse_file, parse_lines, GCodeError
+from SCARA import Scara
+from Validator import ProgramValidator
+
+
+"""
+Large programs are split into chunks of bytes, a line belongs to the chunk it begins in.
+Each chunk is converted (or validated) in a worker process from a guessed start state:
+the worker runs the lines just before its chunk (warm-up) from the program's start state,
+for absolute programs the modal state (mode, feed, positions) is the same after a few moves.
+Results come back in order, the state a chunk started from is compared with the end state
+of the previous chunk (positions up to TOLERANCE, they are reached by other arithmetic),
+a chunk started from a wrong state is done again from the right one.
+The pool is waited for in a feeder thread, packets() gives None until the next chunk is done,
+so the GUI thread never waits for it.
+Rounding of move packets carries over the whole program, so they are rounded here, in order,
+from the motor values of the workers, exactly like Scara.move_packet().
+"""
+
+# Scara settings the workers use:
+MACHINE = ("l1", "l2", "reduction", "min_range", "max_range", "current_tool",
+           "min_feed", "max_feed", "z_max_feed", "linear_tolerance", "linear_resolution", "elbow")
+
+
+# Positions of equal states differ in the last bits [mm, deg]:
+TOLERANCE = 1e-9
+
+
+# States (dicts, lists and values) equal, numbers up to the tolerance:
+def same_state(a, b, tolerance=TOLERANCE):
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same_state(a[key], b[key], tolerance) for key in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(same_state(x, y, tolerance) for x, y in zip(a, b))
+    if isinstance(a, float) or isinstance(b, float):
+        try:
+            return abs(a - b) <= tolerance
+        except TypeError:
+            return False
+    return a == b
+
+
+def machine(scara):
+    settings = {name: getattr(scara, name) for name in MACHINE}
+    settings["obstacles"] = dict(scara.collision.obstacles)
+    return settings
+
+
+# Modal state of the conversion:
+# Scara with the settings, points and planned state of the scara, not connected,
+# it writes no files, for work off the GUI thread:
+def detached(scara):
+    copy = Scara()
+    copy.points.path = None
+    copy.collision.path = None
+    # Positions are class attributes, shared by all instances:
+    for name in ("current_position", "displacement", "target_position", "rounding_error"):
+        setattr(copy, name, dict(getattr(scara, name)))
+    for name, value in machine(scara).items():
+        if name == "obstacles":
+            copy.collision.obstacles = value
+        else:
+            setattr(copy, name, dict(value) if isinstance(value, dict) else value)
+    restore_state(copy, conversion_state(scara))
+    copy.points.changed = False
+    return copy
+
+
+def conversion_state(scara):
+    return {"target_position": dict(scara.target_position),
+            "is_absolute": scara.is_absolute,
+            "is_linear": scara.is_linear,
+            "feed": scara.feed,
+            "points": dict(scara.points.points)}
+
+
+def restore_state(scara, state):
+    scara.target_position.update(state["target_position"])
+    scara.is_absolute = state["is_absolute"]
+    scara.is_linear = state["is_linear"]
+    scara.feed = state["feed"]
+    points = scara.points
+    if points.points != state["points"]:
+        points.points = dict(state["points"])
+        points.cache.clear()
+        points.changed = True
+
+
+# Lines beginning in [start, end) of the file [bytes]:
+def read_lines(path, start, end):
+    lines = []
+    with open(path, "rb") as file:
+        if start > 0:
+            file.seek(start - 1)
+            if file.read(1) != b"\n":
+                # Belongs to the previous chunk:
+                file.readline()
+        position = file.tell()
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            lines.append(line.decode())
+            position = position + len(line)
+    return lines
+
+
+_scara = None           # Scara of the worker process
+
+
+def _initialize():
+    global _scara
+    _scara = Scara()
+    # Points saved by P= and obstacles are written by the main process:
+    _scara.points.path = None
+    _scara.collision.path = None
+
+
+def _setup(settings):
+    for name, value in settings.items():
+        if name == "obstacles":
+            _scara.collision.obstacles = value
+        else:
+            setattr(_scara, name, value)
+    return _scara
+
+
+# Packets of the chunk, moves as motor values before rounding:
+def _convert_chunk(path, start, end, warmup, settings, state, exact):
+    scara = _setup(settings)
+    restore_state(scara, state)
+    if not exact:
+        # Guess the state at the chunk, errors are reported by the previous chunk:
+        for text in read_lines(path, warmup, start):
+            try:
+                for block in parse_lines([text]):
+                    scara.convert(block)
+            except GCodeError:
+                pass
+    entry = conversion_state(scara)
+
+    names = scara.axes_names
+    codes = []
+    lines = []
+    values = []
+    displacements = []
+    zero = [0.0] * len(names)
+    error = None
+    texts = read_lines(path, start, end)
+    # Motor values the moves are planned with, P() from the cached steps of the point:
+    steps = scara.move_steps = []
+    try:
+        for block in parse_lines(texts):
+            del steps[:]
+            packets = scara.convert(block)
+            moves = iter(steps)
+            for packet, displacement in packets:
+                codes.append(packet[0])
+                lines.append(block.line)
+                if displacement:
+                    values.append(next(moves))
+                    displacements.append([displacement[name] for name in names])
+                else:
+                    values.append((packet[1:] + zero)[:len(names)])
+                    displacements.append(zero)
+    except GCodeError as exception:
+        # Exceptions with arguments of their own don't pickle:
+        error = (exception.line, exception.message)
+    finally:
+        scara.move_steps = None
+
+    return {"count": len(texts),
+            "entry": entry,
+            "exit": conversion_state(scara),
+            "codes": "".join(codes),
+            "lines": np.array(lines, dtype=np.int64),
+            "values": np.array(values, dtype=float).reshape(-1, len(names)),
+            "displacements": np.array(displacements, dtype=float).reshape(-1, len(names)),
+            "error": error}
+
+
+def _validate_chunk(path, start, end, warmup, settings, points, state, exact):
+    scara = _setup(settings)
+    scara.points.points = points
+    scara.points.cache.clear()
+    validator = ProgramValidator(scara)
+    validator.state = state
+    if not exact:
+        validator.validate_lines(read_lines(path, warmup, start))
+    entry = validator.state
+
+    texts = read_lines(path, start, end)
+    violations = validator.validate_lines(texts)
+    return {"count": len(texts),
+            "entry": entry,
+            "exit": validator.state,
+            "violations": [(error.line, error.message) for error in violations]}
+
+
+class ParallelConverter:
+    # Converts and validates programs on a process pool, chunk by chunk.
+    # Programs of one chunk are done in this process.
+
+    CHUNK_SIZE = 1 << 22        # About 200k lines [bytes]
+    WARMUP = 1 << 16            # Run before each chunk to guess its start state [bytes]
+    QUEUED = 2                  # Results the feeder thread keeps ready
+    WAIT = 0.001                # Longest wait for a result before None is given [s]
+    # Workers don't inherit the GUI's threads and Tk state, and fork isn't available everywhere:
+    START_METHOD = "spawn"
+
+    def __init__(self, scara, processes=None, chunk_size=CHUNK_SIZE, warmup=WARMUP):
+        self.scara = scara
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.warmup = warmup
+        self.pool = None
+
+        # Statistics:
+        self.chunks = 0
+        self.reruns = 0             # Chunks started from a wrong state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    # (start, end, warm-up start) of the chunks [bytes]:
+    def split(self, path):
+        size = os.path.getsize(path)
+        return [(start, min(start + self.chunk_size, size), max(0, start - self.warmup))
+                for start in range(0, max(size, 1), self.chunk_size)]
+
+    # Results of function(path, start, end, warmup, *arguments, state, exact) in the order of chunks,
+    # a few chunks ahead, each one started from the end state of the previous one:
+    def results(self, path, function, state, *arguments):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.processes,
+                                            mp_context=multiprocessing.get_context(self.START_METHOD),
+                                            initializer=_initialize)
+        chunks = self.split(path)
+        following = iter(chunks)
+        pending = deque()
+        start_state = state
+        try:
+            for chunk in chunks:
+                while len(pending) < 2 * self.processes:
+                    ahead = next(following, None)
+                    if ahead is None:
+                        break
+                    pending.append(self.pool.submit(function, path, *ahead, *arguments, start_state, False))
+                result = pending.popleft().result()
+                self.chunks = self.chunks + 1
+                if not same_state(result["entry"], state):
+                    self.reruns = self.reruns + 1
+                    result = self.pool.submit(function, path, *chunk, *arguments, state, True).result()
+                state = result["exit"]
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+    # Lazy (line, packet, displacement) like ProgramRunner, None while the next chunk isn't done,
+    # the scara is left in the state after the program, like after Scara.convert() of each block:
+    def packets(self, path):
+        scara = self.scara
+        if os.path.getsize(path) <= self.chunk_size:
+            for block in parse_file(path):
+                for packet, displacement in scara.convert(block):
+                    yield block.line, packet, displacement
+            return
+
+        names = scara.axes_names
+        rounding_error = [scara.rounding_error[name] for name in names]
+        base = 0
+        for result in self.fed(self.results(path, _convert_chunk, conversion_state(scara), machine(scara))):
+            if result is None:
+                # Not done yet, the caller comes again:
+                yield None
+                continue
+            for code, line, row, moved in zip(result["codes"],
+                                              result["lines"].tolist(),
+                                              result["values"].tolist(),
+                                              result["displacements"].tolist()):
+                if code == 'G':
+                    packet = ['G']
+                    for i, step in enumerate(row):
+                        # Carry rounding to the next packet:
+                        step = step + rounding_error[i]
+                        value = round(step, 1)
+                        rounding_error[i] = step - value
+                        packet.append(value)
+                    yield base + line, packet, dict(zip(names, moved))
+                elif code == 'W':
+                    yield base + line, ['W', row[0]], None
+                else:
+                    yield base + line, [code] + row, None
+
+            restore_state(scara, result["exit"])
+            scara.rounding_error.update(zip(names, rounding_error))
+            if result["error"] is not None:
+                line, message = result["error"]
+                raise GCodeError(base + line, message)
+            base = base + result["count"]
+
+    # Items of the generator taken in a feeder thread, None while the next one isn't ready (after WAIT),
+    # exceptions of the generator are raised here. Closing this closes the generator:
+    def fed(self, items):
+        ready = queue.Queue(self.QUEUED)
+        stop = threading.Event()
+        finished = object()
+
+        def feed():
+            try:
+                for item in items:
+                    while not stop.is_set():
+                        try:
+                            ready.put(item, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if stop.is_set():
+                        return
+                ready.put(finished)
+            except Exception as error:
+                ready.put(error)
+            finally:
+                # Cancels the futures ahead:
+                items.close()
+
+        thread = threading.Thread(target=feed, name="chunk-feeder", daemon=True)
+        thread.start()
+        try:
+            while True:
+                try:
+                    item = ready.get(timeout=self.WAIT)
+                except queue.Empty:
+                    yield None
+                    continue
+                if item is finished:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    # ProgramValidator.validate_file() on the pool,
+    # scara - validate for another scara, e.g. a detached() copy:
+    def validate_file(self, path, scara=None):
+        scara = scara or self.scara
+        validator = ProgramValidator(scara)
+        if os.path.getsize(path) <= self.chunk_size:
+            return validator.validate_file(path)
+
+        violations = []
+        base = 0
+        for result in self.results(path, _validate_chunk, validator.initial_state(),
+                                   machine(scara), dict(scara.points.points)):
+            violations.extend(GCodeError(base + line, message) for line, message in result["violations"])
+            base = base + result["count"]
+        return violations
+
+    def report(self):
+        return "Chunks: {}, processes: {}, started again: {}".format(self.chunks, self.processes, self.reruns)
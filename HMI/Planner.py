@@ -0,0 +1,197 @@
+import math
+from collections import deque
+import numpy as np
+from Firmware import Firmware, trapezoid_time
+
+
+class PlannedMove:
+    __slots__ = ("packet", "tag", "length", "unit", "longest", "speed", "acceleration",
+                 "max_entry", "entry", "exit", "stop_after")
+
+    def __init__(self, packet, tag, rates, acceleration):
+        self.packet = packet
+        self.tag = tag
+
+        # Motor displacements of the steppers [deg]:
+        steps = np.array(packet[1:Firmware.NUMBER_OF_STEPPERS + 1], dtype=float)
+        self.length = float(np.sqrt(steps @ steps))
+        self.unit = steps / self.length if self.length else steps
+        self.longest = float(np.abs(steps).max()) if len(steps) else 0.0
+
+        # Nominal speed, like prepare_simultanuous(): the slowest axis sets the time:
+        times = [abs(step) / rate for step, rate in zip(steps, rates) if rate]
+        duration = max(times) if times else 0.0
+        self.speed = self.length / duration if duration else 0.0
+
+        # No axis exceeds the acceleration:
+        scale = float(np.abs(self.unit).max()) if self.length else 1.0
+        self.acceleration = acceleration / scale
+
+        self.max_entry = 0.0
+        self.entry = 0.0
+        self.exit = 0.0
+        self.stop_after = False
+
+    def time(self):
+        return float(trapezoid_time(self.length, self.entry, self.speed, self.exit, self.acceleration))
+
+    def stop_time(self):
+        return float(trapezoid_time(self.length, 0.0, self.speed, 0.0, self.acceleration))
+
+    # Speeds of the longest axis for the 'T' packet:
+    def profile(self):
+        if not self.length:
+            return [0.0, 0.0, 0.0, 0.0]
+        scale = self.longest / self.length
+        return [round(float(speed) * scale, 1) for speed in (self.entry, self.speed, self.exit, self.acceleration)]
+
+
+class MotionPlanner:
+    # Look-ahead over queued 'G' packets, plans trapezoidal velocity profiles
+    # with junction speeds, so the motion doesn't stop between packets.
+    # Speeds in motor [deg/s], acceleration [deg/s^2], junction deviation [deg].
+
+    LOOKAHEAD = 16
+    ACCELERATION = 3000.0
+    JUNCTION_DEVIATION = 1.0
+
+    def __init__(self, acceleration=ACCELERATION, junction_deviation=JUNCTION_DEVIATION,
+                 lookahead=LOOKAHEAD, emit_profiles=False):
+        self.acceleration = acceleration
+        self.junction_deviation = junction_deviation
+        self.lookahead = lookahead
+        # Replace 'G' with 'T' packets, only for controllers with Communication.profiles,
+        # the firmware doesn't parse them:
+        self.emit_profiles = emit_profiles
+
+        self.rates = [Firmware.degrees_per_second(Firmware.DEFAULT_SPEED)] * Firmware.NUMBER_OF_STEPPERS
+        self.queue = deque()            # (packet, tag, PlannedMove or None)
+        self.moves = 0                  # PlannedMoves in the queue
+        self.previous = None            # Last released move
+        self.exit_speed = 0.0           # Its exit speed
+
+        # Statistics:
+        self.planned_time = 0.0
+        self.stop_time = 0.0
+
+    # Settings that change the output:
+    def parameters(self):
+        return [self.acceleration, self.junction_deviation, self.lookahead, self.emit_profiles]
+
+    # Returns released (packet, tag) pairs:
+    def push(self, packet, tag=None):
+        function_code = packet[0]
+        move = None
+        if function_code == 'G':
+            move = PlannedMove(packet, tag, self.rates, self.acceleration)
+            if move.length:
+                self.moves = self.moves + 1
+            else:
+                move = None
+        elif function_code == 'F':
+            self.rates = [Firmware.degrees_per_second(rpm) for rpm in packet[1:Firmware.NUMBER_OF_STEPPERS + 1]]
+        else:
+            # Waits and gripper need the arm stopped:
+            self.stop_last()
+        self.queue.append((packet, tag, move))
+
+        released = []
+        while self.moves > self.lookahead:
+            self.plan()
+            released.extend(self.release_move())
+        return released
+
+    # Release everything, motion stops at the end:
+    def flush(self):
+        self.stop_last()
+        self.plan()
+        released = []
+        while self.queue:
+            released.extend(self.release_move())
+        self.clear()
+        return released
+
+    # Drop not released packets:
+    def clear(self):
+        self.queue.clear()
+        self.moves = 0
+        self.previous = None
+        self.exit_speed = 0.0
+
+    def stop_last(self):
+        for packet, tag, move in reversed(self.queue):
+            if move is not None:
+                move.stop_after = True
+                return
+        if self.previous is not None:
+            self.exit_speed = 0.0
+
+    def junction_speed(self, previous, move):
+        if previous is None or previous.stop_after:
+            return 0.0
+        # Junction deviation, like in grbl, in joint space:
+        cos_theta = -float(previous.unit @ move.unit)
+        if cos_theta > 0.999999:
+            # Reversal:
+            return 0.0
+        if cos_theta < -0.999999:
+            # Straight on:
+            return min(previous.speed, move.speed)
+        sin_half = math.sqrt(0.5 * (1.0 - cos_theta))
+        acceleration = min(previous.acceleration, move.acceleration)
+        speed = math.sqrt(acceleration * self.junction_deviation * sin_half / (1.0 - sin_half))
+        return min(speed, previous.speed, move.speed)
+
+    def plan(self):
+        moves = [move for packet, tag, move in self.queue if move is not None]
+        if not moves:
+            return
+
+        # Junction limits:
+        previous = self.previous
+        for move in moves:
+            move.max_entry = self.junction_speed(previous, move)
+            previous = move
+        moves[0].max_entry = min(moves[0].max_entry, self.exit_speed)
+
+        # Backward pass, the last move in the queue stops:
+        exit = 0.0
+        for move in reversed(moves):
+            if move.stop_after:
+                exit = 0.0
+            move.exit = exit
+            move.entry = min(move.max_entry, math.sqrt(exit * exit + 2 * move.acceleration * move.length))
+            exit = move.entry
+
+        # Forward pass:
+        entry = moves[0].entry
+        for move in moves:
+            move.entry = min(move.entry, entry)
+            move.exit = min(move.exit, math.sqrt(move.entry * move.entry + 2 * move.acceleration * move.length))
+            entry = move.exit
+
+    # Release packets up to the oldest move:
+    def release_move(self):
+        released = []
+        while self.queue:
+            packet, tag, move = self.queue.popleft()
+            if move is None:
+                released.append((packet, tag))
+                continue
+
+            self.moves = self.moves - 1
+            self.previous = move
+            self.exit_speed = move.exit
+            self.planned_time = self.planned_time + move.time()
+            self.stop_time = self.stop_time + move.stop_time()
+            if self.emit_profiles:
+                packet = ['T'] + packet[1:] + move.profile()
+            released.append((packet, tag))
+            break
+        return released
+
+    def report(self):
+        saved = self.stop_time - self.planned_time
+        percent = 100.0 * saved / self.stop_time if self.stop_time else 0.0
+        return "Planned motion time: {:.2f} s, with stops: {:.2f} s, saved: {:.2f} s ({:.1f} %)".format(
+            self.planned_time, self.stop_time, saved, percent)
@@ -0,0 +1,119 @@
+import json
+import os
+
+
+class PointTable:
+    # Taught points, saved with P=x and recalled with P(x).
+    # A point is kept as the tool position (X, Y, Z, A3) and the elbow,
+    # its joint angles and motor values are cached, so a recall skips the kinematics.
+    # The cache is dropped when arm parameters, ranges or the tool change.
+    # Changes are written by flush(), when the program ends or the operator saves,
+    # not by each P= converted ahead of the machine.
+
+    PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "points.json")
+
+    def __init__(self, scara, path=PATH):
+        self.scara = scara
+        self.path = path
+        self.points = {}        # number -> {"X", "Y", "Z", "A3", "elbow"}
+        self.cache = {}         # number -> {"position": joints, "steps": motor values} or None
+        self.key = None
+        self.changed = False    # Not written yet
+
+    # Parameters the cache depends on:
+    def parameters(self):
+        scara = self.scara
+        return (scara.workspace.parameters(),
+                tuple(sorted(scara.reduction.items())),
+                tuple(sorted(scara.min_range.items())),
+                tuple(sorted(scara.max_range.items())))
+
+    def __contains__(self, number):
+        return number in self.points
+
+    def __len__(self):
+        return len(self.points)
+
+    def numbers(self):
+        return sorted(self.points)
+
+    def get(self, number):
+        return self.points.get(number)
+
+    # Save joint position (target_position by default) as the point:
+    def save(self, number, position=None):
+        if position is None:
+            position = self.scara.target_position
+        self.points[number] = self.point(position)
+        self.cache.pop(number, None)
+        self.changed = True
+
+    # Point of the joint position:
+    def point(self, position):
+        xy = self.scara.forward_kinematics(position)
+        return {"X": xy["X"],
+                "Y": xy["Y"],
+                "Z": position["Z"],
+                "A3": position["A3"],
+                "elbow": 1 if position["A2"] >= 0 else -1}
+
+    def delete(self, number):
+        if self.points.pop(number, None) is not None:
+            self.cache.pop(number, None)
+            self.changed = True
+
+    # Cached {"position", "steps"} of the point,
+    # None if not defined or out of range:
+    def recall(self, number):
+        key = self.parameters()
+        if key != self.key:
+            self.key = key
+            self.cache.clear()
+        try:
+            return self.cache[number]
+        except KeyError:
+            entry = self.solve(self.points.get(number))
+            self.cache[number] = entry
+            return entry
+
+    # Range-checked joints and motor values of the point, None if out of range:
+    def solve(self, point):
+        scara = self.scara
+        if point is None:
+            return None
+        if not scara.workspace.is_reachable(point["X"], point["Y"], point["elbow"]):
+            return None
+        angles, _ = scara.inverse_kinematics_batch([[point["X"], point["Y"]]], point["elbow"])
+        position = {"Z": point["Z"],
+                    "A1": float(angles[0, 0]),
+                    "A2": float(angles[0, 1]),
+                    "A3": point["A3"]}
+        for name in scara.axes_names:
+            if position[name] > scara.max_range[name] or position[name] < scara.min_range[name]:
+                return None
+        return {"position": position, "steps": scara.motor_values(position)}
+
+    def load(self):
+        try:
+            with open(self.path, "r") as file:
+                points = json.load(file)
+        except FileNotFoundError:
+            points = {}
+        self.points = {int(number): point for number, point in points.items()}
+        self.cache.clear()
+        self.changed = False
+
+    # Write the changes, if any:
+    def flush(self):
+        if self.changed:
+            self.write()
+
+    # Write a copy first, so the table survives an interrupted write:
+    def write(self):
+        self.changed = False
+        if self.path is None:
+            return
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump({str(number): self.points[number] for number in sorted(self.points)}, file, indent=1)
+        os.replace(temporary, self.path)
@@ -0,0 +1,169 @@
+import struct
+from binascii import crc_hqx
+
+
+"""
+Text packet:
+<opcode>\r<value>\r<value>\r...
+
+Binary frame:
+SYNC | opcode | length | value ... | CRC
+1 B  | 1 B    | 1 B    | int24 LE  | uint16 LE
+length - number of payload bytes (3 per value)
+value  - fixed point, value * SCALE
+CRC    - CRC-16/CCITT-FALSE over opcode, length and payload
+
+Replies of the controller, one per packet, in order:
+ACK - executed, ready for the next packet
+NAK - binary frame rejected (CRC or length error), nothing executed,
+      the rest of the received data is dropped, the host sends the packet again
+"""
+
+TEXT = 'text'
+BINARY = 'binary'
+
+ENCODING = 'UTF-8'
+SYNC = 0xA5
+SCALE = 100             # 0.01 resolution
+HEADER_SIZE = 3
+CRC_SIZE = 2
+VALUE_SIZE = 3
+VALUE_LIMIT = 1 << (8 * VALUE_SIZE - 1)
+MAX_VALUES = 8
+
+ACK = ord('1')
+NAK = 0x15
+REJECTED = '0'          # Opcode of a rejected frame, receive_frame() in AVR/USART.c
+
+# Number of values that follow each opcode:
+VALUE_COUNTS = {'G': 4,     # Move
+                'F': 4,     # Feed
+                'W': 1,     # Wait
+                'M': 0,     # Gripper
+                'T': 8}     # Move with a velocity profile
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def crc16(data):
+    return crc_hqx(data, 0xFFFF)
+
+
+def encode(packet, protocol=TEXT):
+    if protocol == BINARY:
+        return encode_frame(packet)
+    return encode_text(packet)
+
+
+def encode_text(packet):
+    return "".join([str(value) + '\r' for value in packet]).encode(ENCODING)
+
+
+def encode_frame(packet):
+    opcode = packet[0]
+    values = packet[1:]
+    if len(values) > MAX_VALUES:
+        raise ProtocolError("Too many values: {}".format(len(values)))
+
+    body = bytearray(opcode.encode(ENCODING))
+    body.append(len(values) * VALUE_SIZE)
+    for value in values:
+        value = int(round(value * SCALE))
+        if not -VALUE_LIMIT <= value < VALUE_LIMIT:
+            raise ProtocolError("Value out of range: {}".format(value / SCALE))
+        body += value.to_bytes(VALUE_SIZE, 'little', signed=True)
+    return bytes([SYNC]) + bytes(body) + struct.pack('<H', crc16(body))
+
+
+def decode_frame(frame):
+    frame = bytes(frame)
+    if len(frame) < HEADER_SIZE + CRC_SIZE or frame[0] != SYNC:
+        raise ProtocolError("Not a frame")
+    length = frame[2]
+    if length % VALUE_SIZE or len(frame) != HEADER_SIZE + length + CRC_SIZE:
+        raise ProtocolError("Wrong frame length")
+    body = frame[1:HEADER_SIZE + length]
+    crc, = struct.unpack_from('<H', frame, HEADER_SIZE + length)
+    if crc != crc16(body):
+        raise ProtocolError("CRC mismatch")
+
+    values = [int.from_bytes(body[i:i + VALUE_SIZE], 'little', signed=True) / SCALE
+              for i in range(2, len(body), VALUE_SIZE)]
+    return [body[0:1].decode(ENCODING)] + values
+
+
+def atof(text):
+    # Like atof() in the firmware, 0.0 if not a number:
+    try:
+        return float(text)
+    except ValueError:
+        return 0.0
+
+
+class Decoder:
+    # Splits a byte stream (text or binary) into packets, as the firmware does.
+
+    def __init__(self):
+        self.data = bytearray()
+        self.discarded = 0      # Bytes dropped while resynchronizing
+        self.rejected = 0       # Frames rejected
+
+    def feed(self, data):
+        self.data += data
+        packets = []
+        while self.data:
+            if self.data[0] == SYNC:
+                packet = self.next_frame()
+            else:
+                packet = self.next_text()
+            if packet is None:
+                break
+            if packet:
+                packets.append(packet)
+        return packets
+
+    # Returns None if incomplete, [REJECTED] if corrupted.
+    # Like receive_frame(), a wrong length is rejected without waiting for the values:
+    def next_frame(self):
+        if len(self.data) < HEADER_SIZE:
+            return None
+        length = self.data[2]
+        if length % VALUE_SIZE or length // VALUE_SIZE > MAX_VALUES:
+            return self.reject()
+        size = HEADER_SIZE + length + CRC_SIZE
+        if len(self.data) < size:
+            return None
+        try:
+            packet = decode_frame(self.data[:size])
+        except ProtocolError:
+            return self.reject()
+        del self.data[:size]
+        return packet
+
+    # The firmware drops what it received after a rejected frame and answers NAK:
+    def reject(self):
+        self.rejected = self.rejected + 1
+        self.discarded = self.discarded + len(self.data)
+        self.data.clear()
+        return [REJECTED]
+
+    def next_text(self):
+        if len(self.data) < 2:
+            return None
+        opcode = chr(self.data[0])
+        if opcode not in VALUE_COUNTS or self.data[1] != ord('\r'):
+            # Resynchronize on the next byte:
+            self.discarded = self.discarded + 1
+            del self.data[0]
+            return []
+
+        count = VALUE_COUNTS[opcode]
+        fields = self.data.split(b'\r', count + 1)
+        # Last value is not terminated yet:
+        if len(fields) < count + 2:
+            return None
+        values = [atof(value) for value in fields[1:count + 1]]
+        del self.data[:sum(len(field) + 1 for field in fields[:count + 1])]
+        return [opcode] + values
@@ -0,0 +1,169 @@
+from collections import deque
+from GCode import parse_file, GCodeError
+from Protocol import ProtocolError
+from Trace import tracer, GCODE
+
+
+class ProgramRunner:
+    # Number of packets converted ahead of the controller:
+    LOOKAHEAD = 32
+    # Packets queued in Communication on top of its window,
+    # so the next one can be sent as soon as the ack comes:
+    QUEUED = 4
+
+    # optimizer - optional PacketOptimizer, removes redundant packets,
+    # planner - optional MotionPlanner, plans junction speeds of the packets,
+    # cache - optional ProgramCache, runs compiled packets instead of converting, compiles on the first run,
+    # converter - optional ParallelConverter, converts large programs on a process pool:
+    def __init__(self, scara, lookahead=LOOKAHEAD, planner=None, optimizer=None, cache=None, converter=None):
+        self.scara = scara
+        self.lookahead = lookahead
+        self.planner = planner
+        self.optimizer = optimizer
+        self.cache = cache
+        self.converter = converter
+
+        self.path = None
+        self.running = False
+        self.error = None
+        self.line = 0               # Line of the last dispatched block, scara.executed_line - acknowledged
+
+        self.packets = None         # Lazy (line, packet, displacement) generator
+        self.prepared = deque()     # Converted, not dispatched packets
+        self.exhausted = False
+
+    def load(self, path):
+        self.stop()
+        self.path = path
+        self.error = None
+        self.line = 0
+        self.scara.executed_line = 0
+
+    def start(self):
+        if self.running or self.path is None:
+            return False
+        if not self.scara.homed:
+            return False
+        if not self.scara.is_ready():
+            return False
+
+        self.error = None
+        self.line = 0
+        self.scara.executed_line = 0
+        if self.planner is not None and self.planner.emit_profiles and not self.scara.communication.profiles:
+            self.error = ProtocolError("The controller doesn't execute 'T' packets, plan without profiles")
+            return False
+        if self.cache is None:
+            self.packets = self.generate()
+        else:
+            # Compiled while it runs if not cached yet:
+            try:
+                self.packets = self.cache.packets(self)
+            except OSError as error:
+                self.error = error
+                tracer.fault(GCODE, "program not cached: %s", error)
+                return False
+        self.prepared.clear()
+        self.exhausted = False
+        self.running = True
+        self.fill()
+        return True
+
+    def stop(self):
+        if self.packets is not None:
+            # Closes the program file:
+            self.packets.close()
+            self.packets = None
+        # Forget positions of moves that will not be sent:
+        self.prepared.clear()
+        for stage in (self.optimizer, self.planner):
+            if stage is not None:
+                stage.clear()
+        self.scara.reset_target()
+        # Points saved by P= of the program:
+        self.scara.points.flush()
+        self.exhausted = True
+        self.running = False
+
+    def is_finished(self):
+        return self.exhausted and not self.prepared
+
+    # (line, packet, displacement) of the program's blocks, None - not converted yet:
+    def convert(self):
+        if self.converter is not None:
+            yield from self.converter.packets(self.path)
+            return
+        for block in parse_file(self.path):
+            for packet, displacement in self.scara.convert(block):
+                yield block.line, packet, displacement
+
+    def generate(self):
+        stages = [stage for stage in (self.optimizer, self.planner) if stage is not None]
+        if not stages:
+            yield from self.convert()
+            return
+
+        # Packets go through the stages, which may hold them back,
+        # so line and displacement travel in the tag:
+        for item in self.convert():
+            if item is None:
+                # Not converted yet:
+                yield None
+                continue
+            line, packet, displacement = item
+            items = [(packet, (line, displacement))]
+            for stage in stages:
+                items = [item for packet, tag in items for item in stage.push(packet, tag)]
+            for packet, (line, displacement) in items:
+                yield line, packet, displacement
+
+        # Flush the stages in order:
+        items = []
+        for stage in stages:
+            items = [item for packet, tag in items for item in stage.push(packet, tag)] + stage.flush()
+        for packet, (line, displacement) in items:
+            yield line, packet, displacement
+
+    # Convert packets until the lookahead is full:
+    def fill(self):
+        while not self.exhausted and len(self.prepared) < self.lookahead:
+            try:
+                item = next(self.packets)
+            except StopIteration:
+                self.exhausted = True
+            except (GCodeError, OSError) as error:
+                self.error = error
+                tracer.fault(GCODE, "program stopped: %s", error)
+                self.prepared.clear()
+                self.exhausted = True
+            else:
+                if item is None:
+                    # Converted on the pool, not ready yet, the next step takes it:
+                    break
+                self.prepared.append(item)
+
+    # Call when the controller may have acknowledged:
+    def step(self):
+        if not self.running:
+            return
+
+        # Apply finished moves:
+        self.scara.update_position()
+
+        communication = self.scara.communication
+        if communication.error is not None:
+            # Link fault, the rest isn't sent:
+            self.error = communication.error
+            self.stop()
+            return
+
+        if self.is_finished():
+            if self.scara.is_ready():
+                self.stop()
+            return
+
+        # Fill free places in the controller's window and the queue:
+        while self.prepared and communication.outstanding() < communication.window + self.QUEUED:
+            self.line, packet, displacement = self.prepared.popleft()
+            self.scara.dispatch(packet, displacement, self.line)
+        self.fill()
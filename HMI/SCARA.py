@@ -1,5 +1,12 @@
 import math
+import numpy as np
 from Communication import *
+from GCode import parse_lines, interpret, GCodeError
+from Workspace import ReachabilityMap
+from Points import PointTable
+from Collision import CollisionChecker
+from Notifier import ChangeNotifier
+from Trace import tracer, GCODE, MOTION
 
 
 """
@@ -21,15 +28,30 @@ class Scara:
     G91 = False         # is_absolute = False
     is_absolute = G90   # Absolute as default
 
+    # Elbow configuration of XY moves:
+    ELBOW_FASTEST = 0       # Solution reached in the shortest time
+    ELBOW_POSITIVE = 1      # A2 >= 0
+    ELBOW_NEGATIVE = -1     # A2 <= 0
+    elbow = ELBOW_FASTEST
+
+    # Joint or linear interpolation of XY moves:
+    G0 = False          # is_linear = False
+    G1 = True           # is_linear = True
+    is_linear = G0      # Joint as default
+    linear_tolerance = 0.05     # Max distance from the line [mm]
+    linear_resolution = 0.5     # Line sampling step [mm]
+
     # Positions:
     current_position = dict.fromkeys(axes_names, 0.0)
     displacement = dict.fromkeys(axes_names, 0.0)
     target_position = dict.fromkeys(axes_names, 0.0)
+    rounding_error = dict.fromkeys(axes_names, 0.0)     # Not sent part of packets
     current_xy = dict.fromkeys(coordinates_names, 0.0)
+    executed_line = 0   # Program line of the last acknowledged packet
 
     # Feed [mm/min]:
     default_feed = 200
-    feed = 0
+    _feed = 0
     min_feed = 100
     max_feed = 10000
     z_max_feed = 3500
@@ -60,51 +82,88 @@ class Scara:
     service_mode = False
 
     def __init__(self):
-        self.communication = Communication()
+        # Changes of positions, feed and connection for the GUI:
+        self.notifier = ChangeNotifier()
+        self.communication = Communication(notifier=self.notifier)
+        self.workspace = ReachabilityMap(self)
+        self.points = PointTable(self)
+        self.points.load()
+        self.collision = CollisionChecker(self)
+        self.collision.load()
+        # Motor values of planned moves before rounding are appended to it, if a list:
+        self.move_steps = None
         self.current_xy = self.forward_kinematics(self.current_position)
 
+    @property
+    def feed(self):
+        return self._feed
+
+    @feed.setter
+    def feed(self, feed):
+        if feed != self._feed:
+            self._feed = feed
+            self.notifier.publish(ChangeNotifier.FEED)
+
     def is_in_range(self, displacement):
         for name in self.axes_names:
-            target = self.current_position[name] + displacement[name]
+            target = self.target_position[name] + displacement[name]
             if target > self.max_range[name] or target < self.min_range[name]:
                 return False
         return True
 
+    # Joint positions (N x 4) the move passes from target_position must be clear
+    # of the arm itself and the obstacles, raises GCodeError:
+    def check_collision(self, line, path):
+        if self.collision is None:
+            return
+        start = [self.target_position[name] for name in self.axes_names]
+        message = self.collision.check_path(np.vstack([start, path]))
+        if message:
+            raise GCodeError(line, message)
+
     def is_ready(self):
         if not self.communication.ready:
             return False
-        elif not self.communication.is_buffer_empty():
+        elif not self.communication.is_idle():
             return False
         else:
             return True
 
-    def wait_until_ready(self):
-        while not self.communication.ready_check():
-            pass
+    # Returns False on timeout:
+    def wait_until_ready(self, timeout=None):
+        return self.communication.wait_idle(timeout)
 
     def home(self):
         self.homed = False
+        # Homing finds the position lost by a link fault:
+        self.communication.clear_error()
 
         # Set default feed:
         self.set_feed(self.default_feed)
 
         # Move Z 10 mm up:
         self.current_position['Z'] = 0
+        self.target_position.update(self.current_position)
         displacement = dict.fromkeys(self.axes_names, 0.0)
         displacement['Z'] = 5
-        self.move(displacement)
+        # Positions are set below, don't track homing moves:
+        self.dispatch(self.move_packet(displacement))
 
         # Move Z down:
         self.current_position['Z'] = self.max_range['Z']
+        self.target_position.update(self.current_position)
         displacement = dict.fromkeys(self.axes_names, 0.0)
         displacement['Z'] = -self.max_range['Z']
-        self.move(displacement)
+        self.dispatch(self.move_packet(displacement))
 
         self.displacement = dict.fromkeys(self.axes_names, 0.0)
         self.current_position['Z'] = self.min_range['Z']
         self.current_position['A1'] = self.max_range['A1']
         self.current_position['A2'] = self.min_range['A2']
         self.current_position['A3'] = 0.0
+        self.target_position.update(self.current_position)
+        self.current_xy = self.forward_kinematics(self.current_position)
+        self.notifier.publish(ChangeNotifier.POSITION)
 
         self.homing_started = True
 
@@ -113,13 +172,34 @@ class Scara:
             return
         if not self.is_ready():
             return
-        print("Homed")
+        tracer.info(MOTION, "homed")
         self.homing_started = False
         self.homed = True
 
+    # set_feed(), wait() and move() raise BufferFull
+    # if the packet can't be queued:
     def set_feed(self, feed=0.0):
+        packet = self.feed_packet(feed)
+        if packet:
+            self.dispatch(packet)
+
+    def wait(self, time=0.0):
+        packet = self.wait_packet(time)
+        if packet:
+            self.dispatch(packet)
+
+    def move(self, displacement):
+        packet = self.move_packet(displacement)
+        if packet:
+            try:
+                self.dispatch(packet, displacement)
+            except BufferFull:
+                self.reset_target()
+                raise
+
+    def feed_packet(self, feed=0.0):
         if not feed:
-            return
+            return None
 
         if feed > self.max_feed:
             feed = self.max_feed
@@ -127,95 +207,311 @@ class Scara:
             feed = self.max_feed
         self.feed = feed
 
-        # Send task:
         packet = ['F']
-        feed = {}
+        feed = self.axis_feeds(self.feed)
         for name in self.axes_names:
-            feed[name] = self.feed
-            if name is 'Z' and self.feed > self.z_max_feed:
-                feed[name] = self.z_max_feed
-            feed[name] = feed[name] * self.reduction[name] / 360  # 1rev/360deg
-            if name is 'A2':
-                feed[name] = feed[name] * self.reduction['A21']
             packet.append(round(feed[name], 1))
-        self.communication.to_buffer(packet)
+        return packet
 
-    def wait(self, time=0.0):
+    # Motor speeds [rpm] of the feed [mm/min]:
+    def axis_feeds(self, feed):
+        feeds = {}
+        for name in self.axes_names:
+            feeds[name] = feed
+            if name == 'Z' and feed > self.z_max_feed:
+                feeds[name] = self.z_max_feed
+            feeds[name] = feeds[name] * self.reduction[name] / 360  # 1rev/360deg
+            if name == 'A2':
+                feeds[name] = feeds[name] * self.reduction['A21']
+        return feeds
+
+    def wait_packet(self, time=0.0):
         if not time:
-            return
+            return None
         time = abs(round(time, 2))
-        packet = ['W', time]
-        self.communication.to_buffer(packet)
+        return ['W', time]
 
-    def move(self, displacement):
+    # steps - motor values of the displacement, if known:
+    def move_packet(self, displacement, steps=None):
         # Check if in range:
         if not self.is_in_range(displacement):
-            print("Out of range!")
-            return
+            tracer.warning(MOTION, "out of range: %s", displacement)
+            return None
 
-        # Save displacement:
-        self.displacement.update(displacement)
+        # Planned position after this move:
+        for name in self.axes_names:
+            self.target_position[name] = self.target_position[name] + displacement[name]
 
-        # Send task:
         packet = ['G']
+        steps = self.motor_values(displacement) if steps is None else dict(steps)
+        if self.move_steps is not None:
+            self.move_steps.append([steps[name] for name in self.axes_names])
+        for name in self.axes_names:
+            # Carry rounding to the next packet, so it doesn't add up:
+            steps[name] = steps[name] + self.rounding_error[name]
+            value = round(steps[name], 1)
+            self.rounding_error[name] = steps[name] - value
+            packet.append(value)
+        return packet
+
+    # Joint angles -> motor angles [deg]:
+    def motor_values(self, joints):
+        steps = dict(joints)
         # Add A1:A2 superposition:
-        displacement['A2'] = displacement['A2'] * self.reduction['A21'] + displacement['A1']
+        steps['A2'] = steps['A2'] * self.reduction['A21'] + steps['A1']
         for name in self.axes_names:
-            displacement[name] = displacement[name] * self.reduction[name]
-            packet.append(round(displacement[name], 1))
-        self.communication.to_buffer(packet)
+            steps[name] = steps[name] * self.reduction[name]
+        return steps
+
+    # Packets of a straight XY line, other axes move proportionally,
+    # all segments are checked before anything is planned, none if any is out of range:
+    def linear_packets(self, xy, displacement, line=0):
+        segments = self.linear_segments([xy["X"], xy["Y"]])
+        if segments is None:
+            tracer.warning(MOTION, "line %d out of range: %s", line, xy)
+            return []
+
+        angles, fractions = segments
+        moves = []
+        path = []
+        position = dict(self.target_position)
+        done = 0.0
+        for (a1, a2), fraction in zip(angles, fractions):
+            segment = {}
+            for name in self.axes_names:
+                segment[name] = displacement[name] * float(fraction - done)
+            segment['A1'] = float(a1) - position['A1']
+            segment['A2'] = float(a2) - position['A2']
+            done = fraction
+
+            # Same sums as is_in_range() and move_packet():
+            for name in self.axes_names:
+                target = position[name] + segment[name]
+                if target > self.max_range[name] or target < self.min_range[name]:
+                    tracer.warning(MOTION, "line %d out of range: %s", line, segment)
+                    return []
+                position[name] = target
+            moves.append(segment)
+            path.append([position[name] for name in self.axes_names])
+        self.check_collision(line, np.array(path))
+
+        return [(self.move_packet(segment), segment) for segment in moves]
+
+    # line - program line of the packet, None for manual moves,
+    # displacement - dict or a record of a compiled program, by axis name:
+    def dispatch(self, packet, displacement=None, line=None):
+        if displacement is not None and len(displacement):
+            displacement = {name: float(displacement[name]) for name in self.axes_names}
+        else:
+            displacement = None
+        # Line and displacement come back with the controller's acknowledgement:
+        self.communication.to_buffer(packet, (line, displacement))
+        # Save displacement until the move is finished:
+        if displacement:
+            for name in self.axes_names:
+                self.displacement[name] = self.displacement[name] + displacement[name]
+            self.notifier.publish(ChangeNotifier.POSITION)
+
+    # Drop planned, not dispatched moves:
+    def reset_target(self):
+        for name in self.axes_names:
+            self.target_position[name] = self.current_position[name] + self.displacement[name]
 
+    # Apply displacements of acknowledged moves:
     def update_position(self):
-        for name in self.axes_names:
-            self.current_position[name] = self.current_position[name] + self.displacement[name]
-            self.displacement[name] = 0.0
+        if self.communication.error is not None and self.homed:
+            # Moves were lost, the position is unknown until homed again:
+            tracer.fault(MOTION, "position lost: %s", self.communication.error)
+            self.homed = False
+            self.displacement = dict.fromkeys(self.axes_names, 0.0)
+            self.reset_target()
+            self.notifier.publish(ChangeNotifier.POSITION)
+        completed = self.communication.completed
+        if not completed:
+            return
+        while completed:
+            line, displacement = completed.popleft()
+            if line is not None:
+                self.executed_line = line
+            if not displacement:
+                continue
+            for name in self.axes_names:
+                self.current_position[name] = self.current_position[name] + displacement[name]
+                self.displacement[name] = self.displacement[name] - displacement[name]
+        if self.communication.is_idle():
+            self.displacement.update(dict.fromkeys(self.axes_names, 0.0))
         self.current_xy = self.forward_kinematics(self.current_position)
+        self.notifier.publish(ChangeNotifier.POSITION)
 
     # Calculate absolute xy position
     # from angles A1 and A2 absolute values:
     def forward_kinematics(self, position):
         try:
-            a1 = math.radians(position["A1"])
-            a2 = math.radians(position["A2"])
+            angles = [[position["A1"], position["A2"]]]
         except KeyError:
             return {}
-        l1 = self.l1
-        l2 = self.l2 + self.current_tool["x_offset"]
+        xy = self.forward_kinematics_batch(angles)[0]
 
-        x = l1 * math.cos(a1) + l2 * math.cos(a1 + a2)
-        y = l1 * math.sin(a1) + l2 * math.sin(a1 + a2)
+        return {"X": float(xy[0]), "Y": float(xy[1])}
 
-        return {"X": x, "Y": y}
+    def inverse_kinematics(self, xy, elbow=1):
+        angles, reachable = self.inverse_kinematics_batch([[xy["X"], xy["Y"]]], elbow)
+        if not reachable[0]:
+            return {}
 
-    def inverse_kinematics(self, xy):
+        return {"A1": float(angles[0, 0]), "A2": float(angles[0, 1])}
+
+    # IK solutions of the allowed elbows within joint ranges,
+    # returns: list of (A1, A2):
+    def inverse_kinematics_solutions(self, xy):
+        elbows = (self.elbow,) if self.elbow else (self.ELBOW_POSITIVE, self.ELBOW_NEGATIVE)
+        solutions = []
+        for elbow in elbows:
+            if self.workspace.is_reachable(xy["X"], xy["Y"], elbow):
+                angles = self.inverse_kinematics(xy, elbow)
+                solutions.append((angles["A1"], angles["A2"]))
+        return solutions
+
+    # Solution reached from position (target_position as default) in the shortest time
+    # with the motor feeds, A2 motor moves with A1 too (superposition),
+    # returns: {"A1", "A2"} or {} if there is no solution:
+    def fastest_solution(self, solutions, position=None, feed=None):
+        if position is None:
+            position = self.target_position
+        if feed is None:
+            feed = self.feed
+        # Before any F, all motors run with the same default speed:
+        feeds = self.axis_feeds(feed) if feed else dict.fromkeys(self.axes_names, 1.0)
+
+        best = {}
+        best_time = None
+        for a1, a2 in solutions:
+            steps = self.motor_values({"Z": 0.0, "A1": a1 - position["A1"], "A2": a2 - position["A2"], "A3": 0.0})
+            time = max(abs(steps["A1"]) / feeds["A1"], abs(steps["A2"]) / feeds["A2"])
+            if best_time is None or time < best_time:
+                best = {"A1": a1, "A2": a2}
+                best_time = time
+        return best
+
+    # Batch kinematics,
+    # angles: N x 2 array of A1, A2 [deg],
+    # returns: N x 2 array of X, Y [mm]:
+    def forward_kinematics_batch(self, angles):
+        angles = np.radians(np.asarray(angles, dtype=float).reshape(-1, 2))
+        a1 = angles[:, 0]
+        a12 = a1 + angles[:, 1]
         l1 = self.l1
-        l2 = self.l2
-        x = xy["X"]
-        y = xy["Y"]
+        l2 = self.l2 + self.current_tool["x_offset"]
+
+        xy = np.empty_like(angles)
+        xy[:, 0] = l1 * np.cos(a1) + l2 * np.cos(a12)
+        xy[:, 1] = l1 * np.sin(a1) + l2 * np.sin(a12)
+        return xy
+
+    # xy: N x 2 array of X, Y [mm],
+    # elbow: 1 - A2 >= 0, -1 - A2 <= 0,
+    # returns: N x 2 array of A1, A2 [deg] (NaN if unreachable)
+    # and N mask of reachable points:
+    def inverse_kinematics_batch(self, xy, elbow=1):
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        x = xy[:, 0]
+        y = xy[:, 1]
+        l1 = self.l1
+        l2 = self.l2 + self.current_tool["x_offset"]
 
+        cos_th2 = (x*x + y*y - l1*l1 - l2*l2) / (2*l1*l2)
+        reachable = np.abs(cos_th2) <= 1.0
+        cos_th2 = np.where(reachable, cos_th2, np.nan)
+        sin_th2 = elbow * np.sqrt(1 - cos_th2 * cos_th2)
+        cos_th1_nominator = x*(l1 + l2*cos_th2) + y*l2*sin_th2
+        sin_th1_nominator = y*(l1 + l2*cos_th2) - x*l2*sin_th2
+
+        angles = np.empty_like(xy)
+        angles[:, 0] = np.degrees(np.arctan2(sin_th1_nominator, cos_th1_nominator))
+        angles[:, 1] = elbow * np.degrees(np.arccos(cos_th2))
+        return angles, reachable
+
+    # Joint targets for a straight line from start (A1, A2), target_position as default, to end_xy,
+    # returns: M x 2 array of A1, A2 [deg] at segment ends
+    # and M path fractions [0..1] of segment ends,
+    # or None if the line leaves the workspace or joint ranges:
+    def linear_segments(self, end_xy, start=None):
+        if start is None:
+            start = [self.target_position['A1'], self.target_position['A2']]
+        start = np.array(start, dtype=float)
+        start_xy = self.forward_kinematics_batch(start)[0]
+        end_xy = np.asarray(end_xy, dtype=float)
+        if not self.workspace.is_reachable(end_xy[0], end_xy[1], 1 if start[1] >= 0 else -1):
+            return None
+        line = end_xy - start_xy
+        length = np.hypot(line[0], line[1])
+        if length <= self.linear_tolerance:
+            angles, reachable = self.inverse_kinematics_batch(end_xy, 1 if start[1] >= 0 else -1)
+            if not reachable[0]:
+                return None
+            return angles, np.ones(1)
+
+        # Sample the line, stay in the elbow configuration of the start:
+        count = int(np.ceil(length / self.linear_resolution))
+        t = np.linspace(0.0, 1.0, count + 1)
+        xy = start_xy + t[:, None] * line
+        angles, reachable = self.inverse_kinematics_batch(xy, 1 if start[1] >= 0 else -1)
+        if not reachable[1:].all():
+            return None
+        angles[0] = start
+        angles = np.degrees(np.unwrap(np.radians(angles), axis=0))
+        for i, name in enumerate(("A1", "A2")):
+            if (angles[:, i] > self.max_range[name]).any() or (angles[:, i] < self.min_range[name]).any():
+                return None
+
+        # Split segments at the farthest point until all are close enough
+        # to the line (joints move linearly within a segment):
+        normal = np.array([-line[1], line[0]]) / length
+        keep = np.zeros(count + 1, dtype=bool)
+        keep[[0, count]] = True
+        segments = [(0, count)]
+        while segments:
+            i, j = segments.pop()
+            if j - i < 2:
+                continue
+            inner = np.arange(i + 1, j)
+            fraction = (t[inner] - t[i]) / (t[j] - t[i])
+            path = self.forward_kinematics_batch(angles[i] + fraction[:, None] * (angles[j] - angles[i]))
+            error = np.abs((path - start_xy) @ normal)
+            k = error.argmax()
+            if error[k] > self.linear_tolerance:
+                keep[inner[k]] = True
+                segments.append((i, inner[k]))
+                segments.append((inner[k], j))
+
+        return angles[keep][1:], t[keep][1:]
+
+    def g_code(self, text):
         try:
-            cos_th2 = (x*x + y*y - l1*l1 - l2*l2) / (2*l1*l2)
-            sin_th2 = math.sqrt(1 - cos_th2 * cos_th2)
-            cos_th1_nominator = x*(l1 + l2*cos_th2) + y*l2*sin_th2
-            sin_th1_nominator = y*(l1 + l2*cos_th2) + x*l2*sin_th2
-            # denominator = (l1 + l2*cos_th2)*(l1 + l2*cos_th2) + (l2*sin_th2)*(l2*sin_th2)
-
-            th1 = math.degrees(math.atan2(sin_th1_nominator, cos_th1_nominator))
-            th2 = math.degrees(math.acos((x*x + y*y - l1*l1 - l2*l2) / (2*l1*l2)))
-        except ValueError:
-            return {}
+            for block in parse_lines(text.splitlines()):
+                self.execute(block)
+        finally:
+            # Points saved by P=:
+            self.points.flush()
 
-        return {"A1": th1, "A2": th2}
+    def execute(self, block):
+        try:
+            for packet, displacement in self.convert(block):
+                self.dispatch(packet, displacement)
+        except BufferFull:
+            self.reset_target()
+            raise
 
-    def g_code(self, line):
-        # Remove spaces, everything uppercase:
-        line = line.replace(" ", "").upper()
-        print(line)
+    # Convert block to the list of (packet, displacement) pairs:
+    def convert(self, block):
+        tracer.debug(GCODE, "%s", block)
+        packets = []
 
         """
         The order of actions:
         G54                     # G54 Px - Select zero point
         F                       # F - Change feed
+        G0/G1                   # G0 - Joint, G1 - Linear XY motion
         G90/G91                 # G90 - Absolute mode, G91 - Increment mode
         P=                      # P=x - Save point
         X, Y, Z, A1=, A2=, A3=  # Motion target point
@@ -224,69 +520,78 @@ class Scara:
         G4.                     # G4.x - Wait x seconds
         """
 
-        if 'F' in line:
-            feed = get_value(line, 'F')
-            self.set_feed(feed)
+        motion = interpret(block, self.is_absolute, self.is_linear)
 
-        if 'G90' in line:
-            self.is_absolute = self.G90
+        if motion.feed is not None:
+            packet = self.feed_packet(motion.feed)
+            if packet:
+                packets.append((packet, None))
 
-        if 'G91' in line:
-            self.is_absolute = self.G91
+        self.is_absolute = motion.is_absolute
+        self.is_linear = motion.is_linear
 
-        if 'P(' in line:
-            pass
+        if motion.save is not None:
+            self.points.save(motion.save)
 
-        # Motion programming:
-        displacement = dict().fromkeys(self.axes_names, 0.0)
-        is_motion_programmed = False
+        # Taught point, checked before anything is planned:
+        point = None
+        if motion.recall is not None:
+            number = motion.recall
+            if number not in self.points:
+                raise GCodeError(block.line, "point {} not defined".format(number))
+            point = self.points.recall(number)
+            if point is None:
+                raise GCodeError(block.line, "point {} out of range".format(number))
 
-        for name in self.axes_names:
-            if name in line:
-                value = get_value(line, name)
-                if self.is_absolute:
-                    value = value - self.current_position[name]
-                displacement[name] = value
-                is_motion_programmed = True
+        # Motion programming:
+        names = self.axes_names
+        displacement = dict(zip(names, motion.displacement(names, [self.target_position[name] for name in names])))
+        is_motion_programmed = bool(motion.joints)
 
         # If A1 or A2 programmed, skip X and Y:
-        if 'A1=' not in line or 'A2=' not in line:
-            if 'X' in line or 'Y' in line:
-                xy = self.forward_kinematics(self.current_position)
-                for name in xy:
-                    if name in line:
-                        value = get_value(line, name)
-                        if not self.is_absolute:
-                            value = value + xy[name]
-                        xy[name] = value
-                target = self.inverse_kinematics(xy)
-                for name in target:
-                    displacement[name] = target[name] - self.current_position[name]
-                is_motion_programmed = True
+        if motion.xy is not None:
+            xy = motion.end(self.forward_kinematics(self.target_position))
+            if self.is_linear:
+                packets.extend(self.linear_packets(xy, displacement, block.line))
+                is_motion_programmed = False
+            else:
+                target = self.fastest_solution(self.inverse_kinematics_solutions(xy))
+                if target:
+                    for name in target:
+                        displacement[name] = target[name] - self.target_position[name]
+                    is_motion_programmed = True
+                else:
+                    tracer.warning(MOTION, "line %d out of range: %s", block.line, xy)
+                    is_motion_programmed = False
 
         if is_motion_programmed:
-            print(displacement)
-            self.move(displacement)
-
-        if 'M' in line:
+            tracer.debug(MOTION, "move %s", displacement)
+            if self.is_in_range(displacement):
+                self.check_collision(block.line, [[self.target_position[name] + displacement[name]
+                                                   for name in self.axes_names]])
+            packet = self.move_packet(displacement)
+            if packet:
+                packets.append((packet, displacement))
+
+        # Move to the point, joints and motor values from the cache
+        # (motor_values() is linear, the move's are the difference to the target's):
+        if point is not None:
+            displacement = {}
+            for name in self.axes_names:
+                displacement[name] = point["position"][name] - self.target_position[name]
+            self.check_collision(block.line, [[point["position"][name] for name in self.axes_names]])
+            target_steps = self.motor_values(self.target_position)
+            steps = {name: point["steps"][name] - target_steps[name] for name in self.axes_names}
+            packet = self.move_packet(displacement, steps)
+            if packet:
+                packets.append((packet, displacement))
+
+        if 'M' in block:
             pass
 
-        if 'G4.' in line:
-            time = get_value(line, 'G4.')
-            self.wait(time)
-
-
-def get_value(line, word):
-    i = line.index(word) + len(word)
-    value = ""
-
-    # line[i].isalpha() means that the next word begins:
-    while not line[i].isalpha():
-        if line[i].isnumeric() or line[i] is "-" or line[i] is ".":
-            value = value + line[i]
-        i = i + 1
-        if i >= len(line):
-            # End of line, break loop:
-            break
+        if motion.wait is not None:
+            packet = self.wait_packet(motion.wait)
+            if packet:
+                packets.append((packet, None))
 
-    return float(value)
+        return packets
@@ -0,0 +1,203 @@
+import argparse
+import time
+import numpy as np
+
+
+class PointSequencer:
+    # Visiting order of points with the shortest motion time.
+    # Time between two joint positions is the firmware's: all motors arrive with the slowest one,
+    # so it is the Chebyshev distance of motor angles divided by the motor speeds
+    # (reductions, A21 superposition, z_max_feed).
+    # Nearest neighbour tour, improved by 2-opt, elbows are chosen on the way.
+
+    MAX_PASSES = 50
+    TIME_LIMIT = 10.0       # 2-opt time limit [s]
+    NEIGHBOURS = 10         # 2-opt candidates of each point
+
+    def __init__(self, scara, feed=None, max_passes=MAX_PASSES, time_limit=TIME_LIMIT):
+        self.scara = scara
+        self.feed = feed or scara.feed or scara.default_feed
+        self.max_passes = max_passes
+        self.time_limit = time_limit
+
+    # Motor angles [deg] / motor speeds [deg/s] of N x 3 joints (Z, A1, A2):
+    def scaled(self, joints):
+        scara = self.scara
+        joints = np.asarray(joints, dtype=float).reshape(-1, 3)
+        feeds = scara.axis_feeds(self.feed)
+        motor = np.empty_like(joints)
+        motor[:, 0] = joints[:, 0] * scara.reduction['Z']
+        motor[:, 1] = joints[:, 1] * scara.reduction['A1']
+        # Add A1:A2 superposition:
+        motor[:, 2] = (joints[:, 2] * scara.reduction['A21'] + joints[:, 1]) * scara.reduction['A2']
+        speeds = np.array([feeds['Z'], feeds['A1'], feeds['A2']]) * 360.0 / 60.0
+        return motor / speeds
+
+    # Joint configurations of N x 3 points (X, Y, Z),
+    # returns: K x 3 joints (Z, A1, A2) and their K point indices:
+    def configurations(self, points):
+        scara = self.scara
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        z_in_range = (points[:, 2] >= scara.min_range['Z']) & (points[:, 2] <= scara.max_range['Z'])
+        elbows = (scara.elbow,) if scara.elbow else (scara.ELBOW_POSITIVE, scara.ELBOW_NEGATIVE)
+
+        joints = []
+        indices = []
+        for elbow in elbows:
+            angles, _ = scara.inverse_kinematics_batch(points[:, :2], elbow)
+            reachable = np.flatnonzero(scara.workspace.is_reachable_batch(points[:, :2], elbow) & z_in_range)
+            joints.append(np.column_stack([points[reachable, 2], angles[reachable]]))
+            indices.append(reachable)
+        return np.concatenate(joints), np.concatenate(indices)
+
+    # Returns a dict with the order of points, their joints and times [s]:
+    def sequence(self, points):
+        scara = self.scara
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        joints, indices = self.configurations(points)
+        reachable = np.unique(indices)
+        unreachable = np.setdiff1d(np.arange(len(points)), reachable)
+
+        start = [scara.target_position['Z'], scara.target_position['A1'], scara.target_position['A2']]
+        states = self.nearest_neighbour(self.scaled(start)[0], self.scaled(joints), indices, len(points))
+        path = np.vstack([self.scaled(start), self.scaled(joints[states])])
+        initial_time = self.path_time(path)
+        tour = self.two_opt(path)
+
+        order = states[tour[1:] - 1]
+        return {"order": indices[order],
+                "joints": joints[order],
+                "time": self.path_time(path[tour]),
+                "nearest_neighbour_time": initial_time,
+                "unreachable": unreachable}
+
+    @staticmethod
+    def path_time(path):
+        return float(np.abs(np.diff(path, axis=0)).max(axis=1).sum())
+
+    # Greedy tour over configurations, one per point:
+    @staticmethod
+    def nearest_neighbour(start, scaled, indices, count):
+        visited = np.zeros(count, dtype=bool)
+        available = np.ones(len(scaled), dtype=bool)
+        states = []
+        current = start
+        for _ in range(len(np.unique(indices))):
+            distance = np.abs(scaled - current).max(axis=1)
+            distance[~available] = np.inf
+            state = int(distance.argmin())
+            states.append(state)
+            visited[indices[state]] = True
+            available &= ~visited[indices]
+            current = scaled[state]
+        return np.array(states, dtype=np.intp)
+
+    # Open path from the fixed start, reverses segments while it gets shorter,
+    # only towards the nearest neighbours of each point (fast for thousands of points),
+    # returns: order of the path rows:
+    def two_opt(self, path):
+        count = len(path)
+        tour = np.arange(count)
+        if count < 4:
+            return tour
+        deadline = time.monotonic() + self.time_limit
+        neighbours = self.nearest(path, min(self.NEIGHBOURS, count - 1))
+        position = np.arange(count)
+
+        def distance(a, b):
+            return np.abs(path[a] - path[b]).max(axis=-1)
+
+        for _ in range(self.max_passes):
+            improved = False
+            for i in range(1, count - 1):
+                # Reverse tour[i..j], new edges (a, c) and (b, e),
+                # c near a or e near b:
+                a = tour[i - 1]
+                b = tour[i]
+                j = np.concatenate([position[neighbours[a]], position[neighbours[b]] - 1])
+                j = j[j > i]
+                if not len(j):
+                    continue
+                c = tour[j]
+                has_next = j < count - 1
+                e = tour[np.minimum(j + 1, count - 1)]
+                gain = distance(a, b) - distance(a, c) + np.where(has_next, distance(c, e) - distance(b, e), 0.0)
+                k = int(gain.argmax())
+                if gain[k] > 1e-9:
+                    end = j[k]
+                    tour[i:end + 1] = tour[i:end + 1][::-1].copy()
+                    position[tour[i:end + 1]] = np.arange(i, end + 1)
+                    improved = True
+            if not improved or time.monotonic() > deadline:
+                break
+        return tour
+
+    # K nearest path rows of each row (Chebyshev distance), in chunks to save memory:
+    @staticmethod
+    def nearest(path, k, chunk=256):
+        neighbours = np.empty((len(path), k), dtype=np.intp)
+        for start in range(0, len(path), chunk):
+            rows = np.arange(start, min(start + chunk, len(path)))
+            distance = np.abs(path[rows, None, :] - path[None, :, :]).max(axis=2)
+            distance[np.arange(len(rows)), rows] = np.inf
+            # Start is never moved:
+            distance[:, 0] = np.inf
+            neighbours[rows] = np.argpartition(distance, k - 1, axis=1)[:, :k]
+        return neighbours
+
+    # G-code of the sequence for Scara.g_code(), joint targets keep the planned elbows,
+    # numbers in fixed point ({:g} gives "1e-05", which isn't a G-code number),
+    # the dwell is rounded to the 0.01 s of the 'W' packet, shorter ones are left out:
+    def program(self, result, dwell=0.0):
+        dwell = round(max(dwell, 0.0), 2)
+        lines = ["G90", "G0", "F{:.3f}".format(self.feed)]
+        for point, (z, a1, a2) in zip(result["order"], result["joints"]):
+            lines.append("Z{:.3f} A1={:.4f} A2={:.4f} ; point {}".format(z, a1, a2, point))
+            if dwell:
+                lines.append("G4.{:.2f}".format(dwell))
+        return "\n".join(lines) + "\n"
+
+
+def load_points(path):
+    # X, Y, Z in each line, separated by commas or spaces:
+    points = []
+    with open(path, "r") as file:
+        for line in file:
+            values = line.replace(",", " ").split()
+            if values:
+                points.append([float(value) for value in values[:3]])
+    return np.array(points, dtype=float).reshape(-1, 3)
+
+
+if __name__ == "__main__":
+    from SCARA import Scara
+
+    parser = argparse.ArgumentParser(description="SCARA point visiting order")
+    parser.add_argument('points', help="file with X Y Z of each point")
+    parser.add_argument('program', help="output G-code file")
+    parser.add_argument('--feed', type=float, default=None, help="[mm/min]")
+    parser.add_argument('--dwell', type=float, default=0.0, help="wait at each point [s]")
+    args = parser.parse_args()
+
+    # From the home position:
+    scara = Scara()
+    scara.target_position.update({'Z': scara.min_range['Z'],
+                                  'A1': scara.max_range['A1'],
+                                  'A2': scara.min_range['A2'],
+                                  'A3': 0.0})
+
+    points = load_points(args.points)
+    sequencer = PointSequencer(scara, args.feed)
+    start = time.perf_counter()
+    result = sequencer.sequence(points)
+    elapsed = time.perf_counter() - start
+    with open(args.program, "w") as file:
+        file.write(sequencer.program(result, args.dwell))
+
+    # In the given order:
+    joints, indices = sequencer.configurations(points)
+    given = sequencer.scaled(joints[np.unique(indices, return_index=True)[1]])
+    home = sequencer.scaled([scara.target_position['Z'], scara.target_position['A1'], scara.target_position['A2']])
+    print("Points: {}, unreachable: {}".format(len(points), len(result["unreachable"])))
+    print("Motion time: {:.2f} s, nearest neighbour: {:.2f} s, given order: {:.2f} s, sequenced in {:.2f} s".format(
+        result["time"], result["nearest_neighbour_time"], sequencer.path_time(np.vstack([home, given])), elapsed))
@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+from itertools import islice
+import numpy as np
+from GCode import parse_line, GCodeError
+from Validator import ProgramValidator
+
+
+# Points closer along the path than the tolerance [mm] to the previous one kept
+# are dropped, ends of the segments longer than it stay, so the path keeps
+# its shape within the tolerance and at most length / tolerance + 1 points:
+def simplify(points, tolerance):
+    if len(points) < 3:
+        return points
+    lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    distance = np.floor(np.concatenate([[0.0], np.cumsum(lengths)]) / tolerance)
+    keep = np.empty(len(points), dtype=bool)
+    keep[0] = True
+    keep[1:] = distance[1:] != distance[:-1]
+    keep[-1] = True
+    return points[keep]
+
+
+# Simplified to at most count points, the tolerance is doubled until it fits,
+# returns: points and the tolerance used:
+def downsample(points, tolerance, count):
+    points = simplify(points, tolerance)
+    while len(points) > count:
+        tolerance = tolerance * 2
+        points = simplify(points, tolerance)
+    return points, tolerance
+
+
+class ToolpathPreview:
+    # XY path of a program, through the modal state simulation of ProgramValidator
+    # and batch forward kinematics, moves are drawn as straight lines between their ends.
+    # Loaded step by step, memory doesn't grow with the program: the path is written
+    # to temporary files (memory-mapped when loaded), kept in memory are an overview
+    # and bounding boxes of blocks of points only.
+
+    BLOCK = 4096            # Points of a block
+    LINES = 2000            # Program lines read in one step
+    BLOCKS = 64             # Blocks refined in one step
+    MAX_POINTS = 20000      # Points to draw
+
+    def __init__(self, scara, path, pixels):
+        self.scara = scara
+        self.path = path
+        self.validator = ProgramValidator(scara)
+
+        # Whole workspace in the given pixels:
+        reach = scara.l1 + scara.l2 + scara.current_tool["x_offset"]
+        self.extent = (-reach, -reach, reach, reach)
+        self.overview_tolerance = 2 * reach / pixels
+        self.overview = np.zeros((0, 2), dtype=np.float32)
+
+        self.directory = tempfile.mkdtemp(prefix="toolpath")
+        self.xy_file = open(os.path.join(self.directory, "xy.bin"), "wb")
+        self.lines_file = open(os.path.join(self.directory, "lines.bin"), "wb")
+        self.xy = None              # N x 2 [mm], when loaded
+        self.lines = None           # N lines of the points
+        self.count = 0
+        self.boxes = []             # (min X, min Y, max X, max Y) of blocks, with the next block's first point
+        self.pending = np.zeros((0, 2), dtype=np.float32)  # Points of blocks without a box
+
+        self.file = open(path, "r")
+        self.line = 0
+        self.done = False
+
+        # From the planned position:
+        start = [[scara.target_position['A1'], scara.target_position['A2']]]
+        self.add(scara.forward_kinematics_batch(start), np.zeros(1, dtype=np.int32))
+
+    # Load the next lines, returns False when everything is loaded:
+    def step(self):
+        if self.done:
+            return False
+        texts = list(islice(self.file, self.LINES))
+        blocks = []
+        for text in texts:
+            self.line = self.line + 1
+            # Errors are listed by the validation:
+            try:
+                block = parse_line(text, self.line)
+            except GCodeError:
+                continue
+            if block.words:
+                blocks.append(block)
+        targets, lines, _, _ = self.validator.simulate(blocks)
+        if len(targets):
+            self.add(self.scara.forward_kinematics_batch(targets[:, 1:3]), lines)
+        if len(texts) < self.LINES:
+            self.finish()
+        return not self.done
+
+    def add(self, points, lines):
+        points = np.asarray(points, dtype=np.float32)
+        self.xy_file.write(points.tobytes())
+        self.lines_file.write(np.asarray(lines, dtype=np.int32).tobytes())
+        self.count = self.count + len(points)
+
+        self.pending = np.concatenate([self.pending, points])
+        while len(self.pending) > self.BLOCK:
+            self.add_box(self.pending[:self.BLOCK + 1])
+            self.pending = self.pending[self.BLOCK:]
+
+        self.overview, self.overview_tolerance = downsample(np.concatenate([self.overview, points]),
+                                                            self.overview_tolerance, self.MAX_POINTS)
+
+    def add_box(self, points):
+        self.boxes.append(np.concatenate([points.min(axis=0), points.max(axis=0)]))
+
+    def finish(self):
+        self.done = True
+        self.file.close()
+        self.add_box(self.pending)
+        self.pending = None
+        self.xy_file.close()
+        self.lines_file.close()
+        self.xy = np.memmap(self.xy_file.name, dtype=np.float32, mode="r").reshape(-1, 2)
+        self.lines = np.memmap(self.lines_file.name, dtype=np.int32, mode="r")
+        self.boxes = np.array(self.boxes, dtype=np.float32).reshape(-1, 4)
+
+    # Points within the box (x0, y0, x1, y1) [mm] simplified to the tolerance,
+    # blocks out of the box by their ends only (the segment between them stays out too),
+    # yields None after each step, the points at the end:
+    def refine(self, box, tolerance):
+        boxes = self.boxes
+        visible = (boxes[:, 0] <= box[2]) & (boxes[:, 2] >= box[0]) & (boxes[:, 1] <= box[3]) & (boxes[:, 3] >= box[1])
+        parts = []
+        for first in range(0, len(boxes), self.BLOCKS):
+            for block in range(first, min(first + self.BLOCKS, len(boxes))):
+                start = block * self.BLOCK
+                end = min(start + self.BLOCK, self.count)
+                if visible[block]:
+                    parts.append(simplify(np.array(self.xy[start:end]), tolerance))
+                else:
+                    parts.append(self.xy[[start, end - 1]])
+            yield None
+        points = np.concatenate(parts) if parts else np.zeros((0, 2), dtype=np.float32)
+        yield downsample(points, tolerance, self.MAX_POINTS)[0]
+
+    # XY of the last move of the line or before it, None while loading:
+    def position(self, line):
+        if not self.done or not self.count:
+            return None
+        index = max(int(np.searchsorted(self.lines, line, side='right')) - 1, 0)
+        return self.xy[index]
+
+    def close(self):
+        if not self.done:
+            self.file.close()
+            self.xy_file.close()
+            self.lines_file.close()
+        self.xy = None
+        self.lines = None
+        shutil.rmtree(self.directory, ignore_errors=True)
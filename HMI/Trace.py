@@ -0,0 +1,203 @@
+import os
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+
+"""
+Trace events: (time [s], level, category, message, arguments).
+The message is formatted with the arguments (message % arguments) only when
+the event is dumped or written to the file sink, recording keeps the references,
+so the arguments must not be changed afterwards.
+Binary sink record: time (float64), level (uint8), category (uint8),
+length (uint16), formatted text (UTF-8), little-endian.
+"""
+
+# Levels:
+DEBUG = 10          # Each packet, block and move
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+# Categories:
+SERIAL = "serial"       # Packets sent and acknowledged
+GCODE = "gcode"         # Blocks and programs
+MOTION = "motion"       # Moves and homing
+GUI = "gui"             # Operator actions
+CATEGORIES = (SERIAL, GCODE, MOTION, GUI)
+
+RECORD = struct.Struct("<dBBH")
+MAX_TEXT = 0xffff
+
+
+def event_text(event):
+    _, _, _, message, arguments = event
+    if not arguments:
+        return message
+    try:
+        return message % arguments
+    except (TypeError, ValueError):
+        return " ".join([message] + [str(argument) for argument in arguments])
+
+
+def format_event(event):
+    stamp, level, category, _, _ = event
+    return "{:12.6f} {:<7} {:<6} {}".format(stamp, LEVELS.get(level, level), category, event_text(event))
+
+
+# Events of a binary sink file:
+def read_file(path):
+    events = []
+    with open(path, "rb") as file:
+        data = file.read()
+    position = 0
+    while position + RECORD.size <= len(data):
+        stamp, level, category, length = RECORD.unpack_from(data, position)
+        position = position + RECORD.size
+        text = data[position:position + length].decode(errors="replace")
+        position = position + length
+        category = CATEGORIES[category] if category < len(CATEGORIES) else str(category)
+        events.append((stamp, level, category, text, ()))
+    return events
+
+
+class Tracer:
+    # Structured trace instead of print(): events of the enabled level and categories
+    # are kept in a ring buffer (the last CAPACITY only), optionally also written
+    # to a binary file. A disabled call costs a method call and a comparison,
+    # nothing is formatted until dumped.
+
+    CAPACITY = 4096
+    DUMP_COUNT = 500            # Events dumped after a fault
+    # Next to the module, not in the working directory, dump_path None - faults are not dumped:
+    DUMP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trace.log")
+
+    def __init__(self, level=INFO, capacity=CAPACITY, categories=CATEGORIES):
+        self.level = level
+        self.categories = frozenset(categories)
+        self.events = deque(maxlen=capacity)
+        self.start = time.monotonic()
+        self.dump_path = self.DUMP_PATH
+        self.sink = None
+        self.sink_lock = threading.Lock()
+
+        # Statistics:
+        self.recorded = 0
+        self.dumps = 0
+
+    def set_level(self, level, categories=None):
+        self.level = level
+        if categories is not None:
+            self.categories = frozenset(categories)
+
+    def enabled(self, level, category):
+        return level >= self.level and category in self.categories
+
+    def record(self, level, category, message, *arguments):
+        if level < self.level or category not in self.categories:
+            return
+        event = (time.monotonic() - self.start, level, category, message, arguments)
+        # deque.append() is atomic, the serial threads record without a lock:
+        self.events.append(event)
+        self.recorded = self.recorded + 1
+        if self.sink is not None:
+            self.write(event)
+
+    def debug(self, category, message, *arguments):
+        if self.level > DEBUG:
+            return
+        self.record(DEBUG, category, message, *arguments)
+
+    def info(self, category, message, *arguments):
+        if self.level > INFO:
+            return
+        self.record(INFO, category, message, *arguments)
+
+    def warning(self, category, message, *arguments):
+        self.record(WARNING, category, message, *arguments)
+
+    def error(self, category, message, *arguments):
+        self.record(ERROR, category, message, *arguments)
+
+    # Records the error and dumps the events before it:
+    def fault(self, category, message, *arguments):
+        self.record(ERROR, category, message, *arguments)
+        if self.dump_path is not None:
+            try:
+                self.dump(self.dump_path, self.DUMP_COUNT)
+            except OSError:
+                pass
+
+    # Binary file sink, None - close it:
+    def open_sink(self, path):
+        with self.sink_lock:
+            if self.sink is not None:
+                self.sink.close()
+            self.sink = None if path is None else open(path, "ab")
+
+    def close_sink(self):
+        self.open_sink(None)
+
+    def write(self, event):
+        stamp, level, category, _, _ = event
+        text = event_text(event).encode()[:MAX_TEXT]
+        number = CATEGORIES.index(category) if category in CATEGORIES else 0xff
+        with self.sink_lock:
+            if self.sink is not None:
+                self.sink.write(RECORD.pack(stamp, level, number, len(text)) + text)
+
+    # The last count events (all if None), the oldest first:
+    def last(self, count=None):
+        events = list(self.events)
+        if count is not None:
+            events = events[-count:] if count > 0 else []
+        return events
+
+    # Write the last count events as text to the path or file (stdout if None),
+    # returns: the number of events written:
+    def dump(self, path=None, count=None):
+        events = self.last(count)
+        text = "".join(format_event(event) + "\n" for event in events)
+        if path is None:
+            sys.stdout.write(text)
+        elif hasattr(path, "write"):
+            path.write(text)
+        else:
+            with open(path, "w") as file:
+                file.write(text)
+        with self.sink_lock:
+            if self.sink is not None:
+                self.sink.flush()
+        self.dumps = self.dumps + 1
+        return len(events)
+
+    def clear(self):
+        self.events.clear()
+
+    def report(self):
+        return "Trace: {} recorded, {} kept, {} dumps, level {}".format(self.recorded,
+                                                                       len(self.events),
+                                                                       self.dumps,
+                                                                       LEVELS.get(self.level, self.level))
+
+
+# Shared by all modules:
+tracer = Tracer()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print the last events of a binary trace file")
+    parser.add_argument('path')
+    parser.add_argument('--count', type=int, default=None)
+    args = parser.parse_args()
+
+    events = read_file(args.path)
+    if args.count is not None:
+        events = events[-args.count:] if args.count > 0 else []
+    for event in events:
+        print(format_event(event))
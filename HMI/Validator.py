@@ -0,0 +1,373 @@
+import argparse
+import threading
+import time
+import numpy as np
+from GCode import parse_line, interpret, GCodeError
+
+
+class ProgramValidator:
+    # Dry run of a whole program before it is executed.
+    # Blocks are interpreted by GCode.interpret() like in Scara.convert(),
+    # but positions follow the program as written: a violating move doesn't shift
+    # the later ones, so all violations are found in one pass.
+    # Joint targets, XY reachability, linear paths and collisions are checked with array operations.
+    # Positions of the scara are not changed.
+
+    def __init__(self, scara):
+        self.scara = scara
+        self.state = None       # Simulated state after the validated blocks, the next call continues from it
+
+    # The scara's planned state, where a new simulation starts:
+    def initial_state(self):
+        scara = self.scara
+        return {"target": [scara.target_position[name] for name in scara.axes_names],
+                "is_absolute": scara.is_absolute,
+                "is_linear": scara.is_linear,
+                "feed": scara.feed,
+                "saved": {}}
+
+    def reset(self):
+        self.state = None
+
+    def validate_file(self, path):
+        with open(path, "r") as file:
+            return self.validate_lines(file)
+
+    def validate_text(self, text):
+        return self.validate_lines(text.splitlines())
+
+    # Returns GCodeError of each violation, ordered by line:
+    def validate_lines(self, lines, start=1):
+        blocks = []
+        violations = []
+        for line, text in enumerate(lines, start):
+            # Syntax errors don't stop the check:
+            try:
+                block = parse_line(text, line)
+            except GCodeError as error:
+                violations.append(error)
+                continue
+            if block.words:
+                blocks.append(block)
+        violations.extend(self.validate(blocks))
+        violations.sort(key=lambda error: error.line)
+        return violations
+
+    def validate(self, blocks):
+        blocks = list(blocks)
+        start = (self.state or self.initial_state())["target"]
+        targets, lines, linear, violations = self.simulate(blocks)
+        violations.extend(self.check_ranges(targets, lines, start))
+        violations.extend(self.check_linear(linear, set(error.line for error in violations)))
+        violations.extend(self.check_collisions(targets, lines, linear, start,
+                                                set(error.line for error in violations)))
+        return violations
+
+    # Modal state of the blocks,
+    # returns: joint targets of the moves (M x 4) and their lines,
+    # linear moves (line, start A1, A2, end X, Y, row of the target) and violations found on the way:
+    def simulate(self, blocks):
+        scara = self.scara
+        names = scara.axes_names
+        state = self.state or self.initial_state()
+        target = list(state["target"])
+        xy = None               # XY of the target, None until needed
+        is_absolute = state["is_absolute"]
+        is_linear = state["is_linear"]
+        feed = state["feed"]
+        table = scara.points
+        saved = dict(state["saved"])    # Points saved by P= in the program
+
+        targets = []
+        lines = []
+        linear = []
+        violations = []
+
+        # Inverse kinematics of blocks with X and Y at once:
+        both = [k for k, block in enumerate(blocks) if 'X' in block and 'Y' in block]
+        end_xy = np.array([[blocks[k].get('X'), blocks[k].get('Y')] for k in both], dtype=float).reshape(-1, 2)
+        solutions = {}          # elbow -> {block index: (A1, A2) or None}
+        for elbow in (scara.ELBOW_POSITIVE, scara.ELBOW_NEGATIVE):
+            angles, _ = scara.inverse_kinematics_batch(end_xy, elbow)
+            reachable = scara.workspace.is_reachable_batch(end_xy, elbow)
+            solutions[elbow] = {k: tuple(a) if r else None for k, a, r in zip(both, angles.tolist(), reachable)}
+        elbows = (scara.elbow,) if scara.elbow else (scara.ELBOW_POSITIVE, scara.ELBOW_NEGATIVE)
+
+        # Scara.fastest_solution() without dicts, motor speeds of the feed:
+        def fastest(candidates, speeds):
+            best = None
+            best_time = None
+            for a1, a2 in candidates:
+                d1 = (a1 - target[1]) * scara.reduction['A1']
+                d2 = ((a2 - target[2]) * scara.reduction['A21'] + a1 - target[1]) * scara.reduction['A2']
+                time = max(abs(d1) / speeds[0], abs(d2) / speeds[1])
+                if best_time is None or time < best_time:
+                    best = (a1, a2)
+                    best_time = time
+            return best
+
+        def motor_speeds(feed):
+            # Before any F, all motors run with the same default speed:
+            feeds = scara.axis_feeds(feed) if feed else dict.fromkeys(names, 1.0)
+            return feeds['A1'], feeds['A2']
+
+        speeds = motor_speeds(feed)
+
+        def solution(k, end, elbow):
+            if k in solutions[elbow]:
+                return solutions[elbow][k]
+            if not scara.workspace.is_reachable(end['X'], end['Y'], elbow):
+                return None
+            angles = scara.inverse_kinematics(end, elbow)
+            return angles['A1'], angles['A2']
+
+        for k, block in enumerate(blocks):
+            motion = interpret(block, is_absolute, is_linear)
+            is_absolute = motion.is_absolute
+            is_linear = motion.is_linear
+            line = block.line
+
+            # Like Scara.feed_packet():
+            if motion.feed:
+                value = motion.feed
+                if value > scara.max_feed:
+                    violations.append(GCodeError(line, "feed {:g} above {:g}, limited".format(value, scara.max_feed)))
+                    feed = scara.max_feed
+                elif value < scara.min_feed:
+                    violations.append(GCodeError(line, "feed {:g} below {:g}, {:g} used".format(
+                        value, scara.min_feed, scara.max_feed)))
+                    feed = scara.max_feed
+                else:
+                    feed = value
+                speeds = motor_speeds(feed)
+
+            if motion.save is not None:
+                saved[motion.save] = table.solve(table.point(dict(zip(names, target))))
+
+            point = None
+            if motion.recall is not None:
+                number = motion.recall
+                if number in saved:
+                    point = saved[number]
+                elif number in table:
+                    point = table.recall(number)
+                else:
+                    violations.append(GCodeError(line, "point {} not defined".format(number)))
+                    number = None
+                if number is not None and point is None:
+                    violations.append(GCodeError(line, "point {} out of range".format(number)))
+
+            # Motion programming:
+            is_motion_programmed = bool(motion.joints)
+            if is_motion_programmed:
+                target = motion.joint_target(names, target)
+                xy = None
+
+            # If A1 or A2 programmed, skip X and Y:
+            if motion.xy is not None:
+                if motion.is_absolute_xy():
+                    end = motion.end()
+                else:
+                    if xy is None:
+                        xy = scara.forward_kinematics({'A1': target[1], 'A2': target[2]})
+                    end = motion.end(xy)
+
+                if is_linear:
+                    # The line keeps the elbow configuration of the start:
+                    elbow = 1 if target[2] >= 0 else -1
+                    angles = solution(k, end, elbow)
+                    if angles is not None:
+                        linear.append((line, target[1], target[2], end['X'], end['Y'], len(targets)))
+                else:
+                    candidates = [angles for angles in (solution(k, end, elbow) for elbow in elbows) if angles]
+                    angles = fastest(candidates, speeds)
+
+                if angles is None:
+                    violations.append(GCodeError(line, "X{:g} Y{:g} out of reach".format(end['X'], end['Y'])))
+                else:
+                    target[1], target[2] = angles
+                xy = end
+                is_motion_programmed = True
+
+            if is_motion_programmed:
+                targets.append(list(target))
+                lines.append(line)
+
+            # Taught points are in range:
+            if point is not None:
+                target = [point["position"][name] for name in names]
+                xy = None
+                targets.append(list(target))
+                lines.append(line)
+
+        self.state = {"target": target,
+                      "is_absolute": is_absolute,
+                      "is_linear": is_linear,
+                      "feed": feed,
+                      "saved": saved}
+        return np.array(targets, dtype=float).reshape(-1, len(names)), np.array(lines, dtype=np.int64), \
+            linear, violations
+
+    # Joint targets (M x 4) within min_range and max_range,
+    # an axis is reported when it moves, not while it stays out of range,
+    # start - target before the first move:
+    def check_ranges(self, targets, lines, start):
+        scara = self.scara
+        names = scara.axes_names
+        low = np.array([scara.min_range[name] for name in names])
+        high = np.array([scara.max_range[name] for name in names])
+        previous = np.vstack([start, targets])[:-1]
+        outside = ((targets < low) | (targets > high)) & (targets != previous)
+
+        violations = []
+        for row in np.flatnonzero(outside.any(axis=1)):
+            for i in np.flatnonzero(outside[row]):
+                violations.append(GCodeError(int(lines[row]), "{} {:.2f} out of range [{:g}, {:g}]".format(
+                    names[i], targets[row, i], low[i], high[i])))
+        return violations
+
+    # Linear moves sampled like Scara.linear_segments(), all lines at once,
+    # lines already reported are skipped:
+    def check_linear(self, linear, reported):
+        scara = self.scara
+        linear = [move for move in linear if move[0] not in reported]
+        if not linear:
+            return []
+        moves = np.array(linear, dtype=float)
+        start = scara.forward_kinematics_batch(moves[:, 1:3])
+        line = moves[:, 3:5] - start
+        length = np.hypot(line[:, 0], line[:, 1])
+        elbow = np.where(moves[:, 2] >= 0, 1, -1)
+        counts = np.where(length > scara.linear_tolerance, np.ceil(length / scara.linear_resolution), 1)
+        counts = counts.astype(np.int64)
+
+        # Samples after the start of each line:
+        move = np.repeat(np.arange(len(moves)), counts)
+        offsets = np.cumsum(counts) - counts
+        t = (np.arange(len(move)) - offsets[move] + 1) / counts[move]
+        xy = start[move] + t[:, None] * line[move]
+
+        # A1 crosses +-180 deg only out of its range, so no unwrap is needed:
+        reachable = np.empty(len(move), dtype=bool)
+        for value in (1, -1):
+            samples = np.flatnonzero(elbow[move] == value)
+            reachable[samples] = scara.workspace.is_reachable_batch(xy[samples], value)
+
+        violations = []
+        for i in np.unique(move[~reachable]):
+            violations.append(GCodeError(int(moves[i, 0]), "linear move leaves the workspace"))
+        return violations
+
+    # Moves swept by the collision checker, all at once, lines already reported are skipped.
+    # Linear moves follow their line: sampled each STEP of the checker, through the inverse kinematics:
+    def check_collisions(self, targets, lines, linear, start, reported):
+        scara = self.scara
+        collision = scara.collision
+        if collision is None or not len(targets):
+            return []
+        names = scara.axes_names
+        previous = np.vstack([start, targets])[:-1]
+        skipped = np.isin(lines, list(reported))
+        is_linear = np.zeros(len(targets), dtype=bool)
+        is_linear[[move[5] for move in linear]] = True
+
+        rows = np.flatnonzero(~is_linear & ~skipped)
+        starts = [previous[rows]]
+        ends = [targets[rows]]
+        owners = [rows]
+
+        moves = np.array([move for move in linear if move[0] not in reported], dtype=float).reshape(-1, 6)
+        if len(moves):
+            row = moves[:, 5].astype(np.int64)
+            start_xy = scara.forward_kinematics_batch(moves[:, 1:3])
+            line = moves[:, 3:5] - start_xy
+            counts = np.maximum(np.ceil(np.hypot(line[:, 0], line[:, 1]) / collision.step), 1).astype(np.int64)
+
+            # Samples after the start of each line, other axes move proportionally:
+            move = np.repeat(np.arange(len(moves)), counts)
+            offsets = np.cumsum(counts) - counts
+            t = (np.arange(len(move)) - offsets[move] + 1) / counts[move]
+            samples = previous[row][move] + t[:, None] * (targets[row] - previous[row])[move]
+            xy = start_xy[move] + t[:, None] * line[move]
+            for elbow in (1, -1):
+                index = np.flatnonzero(np.where(moves[move, 2] >= 0, 1, -1) == elbow)
+                angles, _ = scara.inverse_kinematics_batch(xy[index], elbow)
+                samples[index, names.index('A1')] = angles[:, 0]
+                samples[index, names.index('A2')] = angles[:, 1]
+
+            first = np.zeros(len(move), dtype=bool)
+            first[offsets] = True
+            before = np.roll(samples, 1, axis=0)
+            before[first] = previous[row]
+            clear = ~np.isnan(samples).any(axis=1) & ~np.isnan(before).any(axis=1)
+            starts.append(before[clear])
+            ends.append(samples[clear])
+            owners.append(row[move][clear])
+
+        owners = np.concatenate(owners)
+        found = collision.check_segments(np.concatenate(starts), np.concatenate(ends))
+        violations = {}
+        for segment in sorted(found, key=lambda segment: owners[segment]):
+            line = int(lines[owners[segment]])
+            violations.setdefault(line, GCodeError(line, found[segment]))
+        return list(violations.values())
+
+
+class BackgroundValidation:
+    # validate_file() of a program in a thread, so the GUI keeps running, it polls done().
+    # The thread reads the scara, so it should be a copy (Parallel.detached()),
+    # large programs are validated on the pool of the converter.
+
+    def __init__(self, scara, path, converter=None):
+        self.scara = scara
+        self.path = path
+        self.converter = converter
+        self.violations = None      # GCodeError of each violation, when done
+        self.error = None           # Exception if the program can't be read or validated
+        self.elapsed = 0.0          # [s]
+        self.thread = threading.Thread(target=self.run, name="validation", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            if self.converter is not None:
+                self.violations = self.converter.validate_file(self.path, self.scara)
+            else:
+                self.violations = ProgramValidator(self.scara).validate_file(self.path)
+        except Exception as error:
+            # Undecodable file, pool or pickling errors, the GUI shows it instead of a result:
+            self.error = error
+        self.elapsed = time.perf_counter() - start
+
+    def done(self):
+        return not self.thread.is_alive()
+
+
+if __name__ == "__main__":
+    from SCARA import Scara
+
+    parser = argparse.ArgumentParser(description="SCARA program dry run")
+    parser.add_argument('program')
+    parser.add_argument('--processes', type=int, default=0, help="validate large programs on N processes")
+    args = parser.parse_args()
+
+    # From the home position:
+    scara = Scara()
+    scara.target_position.update({'Z': scara.min_range['Z'],
+                                  'A1': scara.max_range['A1'],
+                                  'A2': scara.min_range['A2'],
+                                  'A3': 0.0})
+
+    start = time.perf_counter()
+    if args.processes:
+        from Parallel import ParallelConverter
+        with ParallelConverter(scara, args.processes) as converter:
+            violations = converter.validate_file(args.program)
+    else:
+        violations = ProgramValidator(scara).validate_file(args.program)
+    elapsed = time.perf_counter() - start
+
+    for error in violations:
+        print(error)
+    print("Violations: {}, validated in {:.3f} s".format(len(violations), elapsed))
@@ -0,0 +1,253 @@
+import os
+import re
+import numpy as np
+from Trace import tracer, GUI
+
+
+"""
+Arm view from the STL parts.
+Binary STL: 80 byte header, uint32 count of triangles, 50 bytes per triangle:
+normal (3 x float32), vertices (3 x 3 x float32), attribute (uint16).
+"""
+
+STL_DTYPE = np.dtype([("normal", "<f4", (3,)),
+                      ("vertices", "<f4", (3, 3)),
+                      ("attribute", "<u2")])
+STL_HEADER_SIZE = 84
+
+_VERTEX_PATTERN = re.compile(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)")
+
+# Part paths are relative to this file, not to the working directory:
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+# N x 3 x 3 vertices [mm], binary files are memory-mapped, not copied:
+def read_stl(path):
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        header = file.read(STL_HEADER_SIZE)
+    if len(header) == STL_HEADER_SIZE:
+        count = int(np.frombuffer(header, dtype="<u4", count=1, offset=80)[0])
+        if size == STL_HEADER_SIZE + count * STL_DTYPE.itemsize:
+            if not count:
+                return np.zeros((0, 3, 3), dtype=np.float32)
+            triangles = np.memmap(path, dtype=STL_DTYPE, mode="r", offset=STL_HEADER_SIZE, shape=(count,))
+            return triangles["vertices"]
+
+    # ASCII STL ("solid" header in binary files too, so it's told by the size):
+    with open(path, "rb") as file:
+        values = _VERTEX_PATTERN.findall(file.read())
+    return np.array(values, dtype=np.float32).reshape(-1, 3, 3)
+
+
+# Vertex clustering: vertices in the same grid cell are merged,
+# the finest grid with at most count triangles is used:
+def decimate(triangles, count):
+    triangles = np.asarray(triangles, dtype=np.float32)
+    if len(triangles) <= count:
+        return np.array(triangles)
+    vertices = triangles.reshape(-1, 3).astype(float)
+    low = vertices.min(axis=0)
+    size = max(float((vertices.max(axis=0) - low).max()), 1e-9)
+
+    cells = 256
+    while True:
+        index = np.minimum(((vertices - low) / size * cells).astype(np.int64), cells - 1)
+        keys = (index[:, 0] * cells + index[:, 1]) * cells + index[:, 2]
+        _, cluster = np.unique(keys, return_inverse=True)
+        cluster = cluster.ravel()
+        members = np.bincount(cluster)
+        centers = np.column_stack([np.bincount(cluster, vertices[:, i]) for i in range(3)]) / members[:, None]
+
+        # Collapsed and repeated triangles are dropped:
+        faces = cluster.reshape(-1, 3)
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+        _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+        faces = faces[np.sort(first)]
+        if len(faces) <= count or cells == 1:
+            return centers[faces].astype(np.float32)
+        cells = max(int(cells * 0.8), 1)
+
+
+class MeshCache:
+    # Decimated meshes, each file is read once for each level of detail.
+
+    def __init__(self):
+        self.meshes = {}        # (path, triangles) -> N x 3 x 3 vertices
+
+        # Statistics:
+        self.loads = 0
+
+    def get(self, path, triangles):
+        key = (os.path.abspath(path), triangles)
+        mesh = self.meshes.get(key)
+        if mesh is None:
+            mesh = decimate(read_stl(path), triangles)
+            self.meshes[key] = mesh
+            self.loads = self.loads + 1
+        return mesh
+
+
+# Shared by all views:
+meshes = MeshCache()
+
+
+class ArmModel:
+    # Arm posed from joint positions, projected for a 2D canvas.
+    # Links: base (fixed), arm (A1), forearm (A1 + A2), tool (A1 + A2, at the end of l2).
+    # The parts are not drawn to the exact assembly: each one is centred at its place
+    # on the link with the longest side along the link, the links themselves
+    # (base -> elbow -> wrist -> tool point) are drawn exactly, from forward_kinematics().
+
+    BASE = "base"
+    ARM = "arm"
+    FOREARM = "forearm"
+    TOOL = "tool"
+    LINKS = (BASE, ARM, FOREARM, TOOL)
+
+    # (file relative to DIRECTORY, link, place along the link 0..1):
+    PARTS = (("../Base.STL", BASE, 0.0),
+             ("../Rod.STL", BASE, 0.0),
+             ("../DN.STL", ARM, 0.5),
+             ("../UP.STL", FOREARM, 0.5),
+             ("../3D/Gripper/Stl/Base.STL", TOOL, 0.0),
+             ("../3D/Gripper/Stl/Arm.STL", TOOL, 0.0),
+             ("../3D/Gripper/Stl/Gear.STL", TOOL, 0.0),
+             ("../3D/Gripper/Stl/Rack.STL", TOOL, 0.0),
+             ("../3D/Gripper/Stl/Jaw.STL", TOOL, 0.0))
+
+    COLORS = {BASE: (0.55, 0.55, 0.6),
+              ARM: (1.0, 0.6, 0.1),
+              FOREARM: (1.0, 0.75, 0.3),
+              TOOL: (0.4, 0.5, 0.8)}
+
+    TRIANGLES = 120         # Level of detail, triangles of each part
+
+    # Views, (azimuth, elevation) [deg]:
+    VIEWS = {"3D": (-60.0, 30.0),
+             "top": (0.0, 90.0)}
+
+    LIGHT = np.array([0.3, 0.5, 0.8]) / np.linalg.norm([0.3, 0.5, 0.8])
+
+    def __init__(self, scara, parts=PARTS, triangles=TRIANGLES, cache=meshes):
+        self.scara = scara
+        self.parts = parts
+        self.triangles = triangles
+        self.cache = cache
+        self.meshes = None      # link -> N x 3 x 3 in the link frame
+        self.missing = []       # Parts not found
+
+    def lengths(self):
+        scara = self.scara
+        return {self.BASE: 0.0,
+                self.ARM: scara.l1,
+                self.FOREARM: scara.l2,
+                self.TOOL: scara.current_tool["x_offset"]}
+
+    # Meshes of the links in the link frames, placed once:
+    def link_meshes(self):
+        if self.meshes is not None:
+            return self.meshes
+        lengths = self.lengths()
+        placed = {link: [] for link in self.LINKS}
+        for path, link, place in self.parts:
+            path = os.path.join(DIRECTORY, path)
+            try:
+                mesh = self.cache.get(path, self.triangles)
+            except OSError:
+                self.missing.append(path)
+                tracer.warning(GUI, "arm part not found: %s", path)
+                continue
+            if not len(mesh):
+                continue
+            vertices = mesh.reshape(-1, 3).astype(float)
+            low = vertices.min(axis=0)
+            high = vertices.max(axis=0)
+            vertices = vertices - [(low[0] + high[0]) / 2, (low[1] + high[1]) / 2, low[2]]
+            if high[1] - low[1] > high[0] - low[0]:
+                # Longest side along the link (x):
+                vertices = vertices[:, [1, 0, 2]]
+            vertices[:, 0] = vertices[:, 0] + place * lengths[link]
+            placed[link].append(vertices.reshape(-1, 3, 3))
+        self.meshes = {link: np.concatenate(parts) if parts else np.zeros((0, 3, 3))
+                       for link, parts in placed.items()}
+        return self.meshes
+
+    # Link frames of N joint positions (N x 4, axes_names order), the links only turn about Z:
+    # link -> (N angles [rad], N x 3 origins [mm]):
+    def link_poses(self, positions):
+        scara = self.scara
+        positions = np.asarray(positions, dtype=float).reshape(-1, len(scara.axes_names))
+        names = scara.axes_names
+        height = scara.basement_height + positions[:, names.index("Z")]
+        a1 = np.radians(positions[:, names.index("A1")])
+        a12 = a1 + np.radians(positions[:, names.index("A2")])
+        zero = np.zeros(len(positions))
+        shoulder = np.column_stack([zero, zero, height])
+        elbow = shoulder + np.column_stack([scara.l1 * np.cos(a1), scara.l1 * np.sin(a1), zero])
+        wrist = elbow + np.column_stack([scara.l2 * np.cos(a12), scara.l2 * np.sin(a12), zero])
+        return {self.BASE: (zero, np.zeros((len(positions), 3))),
+                self.ARM: (a1, shoulder),
+                self.FOREARM: (a12, elbow),
+                self.TOOL: (a12, wrist)}
+
+    # Link frames (4 x 4) and the skeleton points of the joint position:
+    def frames(self, position):
+        scara = self.scara
+        poses = self.link_poses([[position[name] for name in scara.axes_names]])
+        tool = scara.forward_kinematics(position)
+
+        frames = {}
+        for link, (angles, origins) in poses.items():
+            angle = angles[0]
+            matrix = np.eye(4)
+            matrix[:2, :2] = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+            matrix[:3, 3] = origins[0]
+            frames[link] = matrix
+        shoulder = poses[self.ARM][1][0]
+        skeleton = np.array([[0.0, 0.0, 0.0],
+                             shoulder,
+                             poses[self.FOREARM][1][0],
+                             poses[self.TOOL][1][0],
+                             [tool["X"], tool["Y"], shoulder[2]]])
+        return frames, skeleton
+
+    # View rotation (3 x 3), x right, y up, z towards the viewer:
+    def rotation(self, view):
+        azimuth, elevation = np.radians(self.VIEWS[view])
+        turn = np.array([[np.cos(azimuth), -np.sin(azimuth), 0.0],
+                         [np.sin(azimuth), np.cos(azimuth), 0.0],
+                         [0.0, 0.0, 1.0]])
+        tilt = np.array([[1.0, 0.0, 0.0],
+                         [0.0, np.sin(elevation), np.cos(elevation)],
+                         [0.0, -np.cos(elevation), np.sin(elevation)]])
+        return tilt @ turn
+
+    # Triangles back to front: N x 3 x 2 view coordinates [mm], N colors (r, g, b 0..1),
+    # and the skeleton points, M x 2:
+    def project(self, position, view="3D"):
+        frames, skeleton = self.frames(position)
+        rotation = self.rotation(view)
+        triangles = []
+        colors = []
+        for link, mesh in self.link_meshes().items():
+            if not len(mesh):
+                continue
+            matrix = frames[link]
+            world = mesh @ matrix[:3, :3].T + matrix[:3, 3]
+            triangles.append(world @ rotation.T)
+            colors.append(np.broadcast_to(self.COLORS[link], (len(mesh), 3)))
+        if not triangles:
+            return np.zeros((0, 3, 2)), np.zeros((0, 3)), (skeleton @ rotation.T)[:, :2]
+        triangles = np.concatenate(triangles)
+        colors = np.concatenate(colors)
+
+        # Flat shading, both sides lit (normals of the parts are not reliable):
+        normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+        length = np.linalg.norm(normals, axis=1)
+        light = np.abs(normals @ self.LIGHT) / np.where(length > 0, length, 1.0)
+        colors = colors * (0.35 + 0.65 * light)[:, None]
+
+        # Painter's algorithm, the farthest first:
+        order = np.argsort(triangles[:, :, 2].mean(axis=1))
+        return triangles[order, :, :2], colors[order], (skeleton @ rotation.T)[:, :2]
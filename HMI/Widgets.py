@@ -1,5 +1,16 @@
+import os
+import time
 import tkinter as tk
 from tkinter import ttk
+from tkinter import filedialog
+from GCode import GCodeError
+from Communication import BufferFull
+from Validator import BackgroundValidation
+from Parallel import detached
+from Visualization import ArmModel
+from Toolpath import ToolpathPreview
+from Trace import tracer, GCODE, GUI
+import numpy as np
 
 # style = {"font": "none 10 bold",
 #          "anchor": "w",
@@ -8,6 +19,12 @@ from tkinter import ttk
 #          "pady": "3"}
 
 
+# Tk configure() redraws the widget, skip it if the text is the same:
+def configure_text(widget, text):
+    if widget.cget("text") != text:
+        widget.configure(text=text)
+
+
 class Title(tk.Label):
     def __init__(self, master=None, **kwargs):
         self.style = {"font": "none 10 bold",
@@ -59,12 +76,20 @@ class StatusLED(tk.Frame):
         self.led = tk.Label(self, image=self.led_inactive)
         self.text.grid(column=0, row=0, sticky='NE')
         self.led.grid(column=1, row=0, sticky='NE')
+        self.active = False
 
     def activate(self):
-        self.led.configure(image=self.led_active)
+        self.set(True)
 
     def deactivate(self):
-        self.led.configure(image=self.led_inactive)
+        self.set(False)
+
+    # Configured only when the state changes:
+    def set(self, active):
+        if active == self.active:
+            return
+        self.active = active
+        self.led.configure(image=self.led_active if active else self.led_inactive)
 
 
 class StatusBar(tk.Frame):
@@ -77,30 +102,262 @@ class StatusBar(tk.Frame):
         self.zero_point = Title(self, text='Active zero point: ---')
         self.zero_point.grid(column=0, row=0, sticky='EW')
 
+        self.in_flight = Title(self, text='In flight: -/-', anchor='e')
+        self.in_flight.grid(column=1, row=0, sticky='EW')
+
         self.feed = Title(self, text='Feed: ---.-- mm/min', anchor='e')
-        self.feed.grid(column=1, row=0, sticky='EW')
+        self.feed.grid(column=2, row=0, sticky='EW')
 
     def refresh(self):
         zp = "Active zero point: "
+        in_flight = "In flight: {}/{}"
         feed = "Feed: " + "{:.2f}" + " mm/min"
 
-        self.zero_point.configure(text=zp)
-        self.feed.configure(text=feed.format(self.scara.feed))
+        communication = self.scara.communication
+        configure_text(self.zero_point, zp)
+        configure_text(self.in_flight, in_flight.format(len(communication.in_flight), communication.window))
+        configure_text(self.feed, feed.format(self.scara.feed))
 
 
 class Simulation(tk.Frame):
-    def __init__(self, master=None):
+    # Arm posed from current_position, drawn from the STL parts.
+    # Redrawn only when the pose changes, at most every REDRAW_INTERVAL
+    # and only while visible. Click switches 3D and top view.
+    SIZE = 320
+    REDRAW_INTERVAL = 100       # [ms]
+
+    def __init__(self, master=None, scara=None):
         tk.Frame.__init__(self, master)
+        self.scara = scara
+        self.model = ArmModel(scara)
+        self.view = "3D"
 
-        self.img = tk.PhotoImage(file="pybot.png")
-        self.position_label = tk.Label(self, image=self.img)
-        self.position_label.grid(column=0, row=0, padx=5, pady=5)
+        self.canvas = tk.Canvas(self, width=self.SIZE, height=self.SIZE, bg='white', highlightthickness=0)
+        self.canvas.grid(column=0, row=0, padx=5, pady=5)
+        self.canvas.bind("<Button-1>", self.switch_view)
+        self.bind("<Map>", self.refresh)
 
+        # Polygons are reused, their stacking order is the drawing order:
+        self.polygons = []
+        self.skeleton = self.canvas.create_line(0, 0, 0, 0, width=3, fill='black')
+
+        self.pose = None            # Pose drawn
+        self.pending = False        # Redraw scheduled
+        self.drawn = 0.0
+
+    # Call when the position changes:
+    def refresh(self, event=None):
+        if self.pending or self.get_pose() == self.pose:
+            return
+        self.pending = True
+        elapsed = (time.monotonic() - self.drawn) * 1000
+        self.after(max(int(self.REDRAW_INTERVAL - elapsed), 0), self.draw)
+
+    def get_pose(self):
+        return tuple(round(self.scara.current_position[name], 1) for name in self.scara.axes_names)
+
+    def switch_view(self, event=None):
+        self.view = "top" if self.view == "3D" else "3D"
+        self.pose = None
+        self.refresh()
+
+    def draw(self):
+        self.pending = False
+        if not self.winfo_ismapped():
+            # Drawn when shown:
+            self.pose = None
+            return
+        self.drawn = time.monotonic()
+        self.pose = self.get_pose()
+        triangles, colors, skeleton = self.model.project(dict(self.scara.current_position), self.view)
+
+        # View [mm] -> canvas [px], y down:
+        scara = self.scara
+        scale = self.SIZE / (2.4 * (scara.l1 + scara.l2 + scara.current_tool["x_offset"]))
+        center = self.SIZE / 2
+        middle = self.SIZE * (0.5 if self.view == "top" else 0.7)
+        triangles = triangles * [scale, -scale] + [center, middle]
+        skeleton = skeleton * [scale, -scale] + [center, middle]
+        fills = ["#{:02x}{:02x}{:02x}".format(*rgb) for rgb in (colors * 255).astype(int).tolist()]
+
+        while len(self.polygons) < len(triangles):
+            self.polygons.append(self.canvas.create_polygon(0, 0, 0, 0, 0, 0, outline=''))
+        for polygon, points, fill in zip(self.polygons, triangles.reshape(-1, 6).tolist(), fills):
+            self.canvas.coords(polygon, *points)
+            self.canvas.itemconfigure(polygon, fill=fill, state='normal')
+        for polygon in self.polygons[len(triangles):]:
+            self.canvas.itemconfigure(polygon, state='hidden')
+        self.canvas.coords(self.skeleton, *skeleton.ravel().tolist())
+        self.canvas.tag_raise(self.skeleton)
+
+
+class Toolpath(tk.Frame):
+    # XY toolpath of the open program and a marker at the running line.
+    # The program is loaded in steps between the updates, the path is drawn
+    # downsampled to a few canvas lines. Wheel zooms, drag pans, double-click
+    # shows the whole workspace; zoomed views are refined in steps over the overview.
+    SIZE = 320
+    COORDINATES = 4000      # Points of one canvas line
+    ZOOM = 1.25
+    MIN_WIDTH = 2.0         # [mm]
 
-class MDI(tk.Frame):
     def __init__(self, master=None, scara=None):
         tk.Frame.__init__(self, master)
         self.scara = scara
+        self.preview = None
+        self.box = None             # Shown (x0, y0, x1, y1) [mm]
+        self.refinement = None      # Running ToolpathPreview.refine()
+        self.steps = 0
+        self.line = None            # Line of the marker
+        self.shown = 0              # Running line
+        self.drag = None
+
+        self.canvas = tk.Canvas(self, width=self.SIZE, height=self.SIZE, bg='white', highlightthickness=0)
+        self.canvas.grid(column=0, row=0, padx=5, pady=5)
+        self.canvas.bind("<MouseWheel>", lambda event: self.zoom(event, event.delta > 0))
+        self.canvas.bind("<Button-4>", lambda event: self.zoom(event, True))
+        self.canvas.bind("<Button-5>", lambda event: self.zoom(event, False))
+        self.canvas.bind("<ButtonPress-1>", self.start_drag)
+        self.canvas.bind("<B1-Motion>", self.move_drag)
+        self.canvas.bind("<ButtonRelease-1>", self.stop_drag)
+        self.canvas.bind("<Double-Button-1>", self.reset_view)
+        self.bind("<Destroy>", lambda event: self.close())
+
+        self.lines = []
+        self.marker = self.canvas.create_oval(0, 0, 0, 0, fill='red', outline='', state='hidden')
+
+    def load(self, path):
+        self.close()
+        self.preview = ToolpathPreview(self.scara, path, self.SIZE)
+        self.box = self.preview.extent
+        self.steps = 0
+        self.line = None
+        self.after(1, self.load_step, self.preview)
+
+    def close(self):
+        self.refinement = None
+        if self.preview is not None:
+            self.preview.close()
+            self.preview = None
+        for item in self.lines:
+            self.canvas.itemconfigure(item, state='hidden')
+        self.canvas.itemconfigure(self.marker, state='hidden')
+
+    def load_step(self, preview):
+        if preview is not self.preview:
+            return
+        loading = preview.step()
+        self.steps = self.steps + 1
+        # The overview grows while loading:
+        if not loading or self.steps % 10 == 0:
+            self.show()
+        if loading:
+            self.after(1, self.load_step, preview)
+
+    # Overview at once, refined when zoomed in and loaded:
+    def show(self):
+        preview = self.preview
+        if preview is None:
+            return
+        self.draw(preview.overview)
+        tolerance = (self.box[2] - self.box[0]) / self.SIZE
+        self.refinement = None
+        if preview.done and tolerance < preview.overview_tolerance:
+            self.refinement = preview.refine(self.box, tolerance)
+            self.after(1, self.refine_step, self.refinement)
+
+    def refine_step(self, refinement):
+        if refinement is not self.refinement:
+            return
+        points = next(refinement)
+        if points is None:
+            self.after(1, self.refine_step, refinement)
+            return
+        self.refinement = None
+        self.draw(points)
+
+    # View [mm] -> canvas [px], y up:
+    def to_canvas(self, points):
+        x0, y0, x1, y1 = self.box
+        scale = self.SIZE / (x1 - x0)
+        return (np.asarray(points, dtype=float) - [x0, y1]) * [scale, -scale]
+
+    def draw(self, points):
+        points = self.to_canvas(points)
+        count = 0
+        # Canvas lines share their end points:
+        for start in range(0, max(len(points) - 1, 0), self.COORDINATES - 1):
+            if count == len(self.lines):
+                self.lines.append(self.canvas.create_line(0, 0, 0, 0, fill='steelblue'))
+            part = points[start:start + self.COORDINATES]
+            self.canvas.coords(self.lines[count], *part.ravel().tolist())
+            self.canvas.itemconfigure(self.lines[count], state='normal')
+            count = count + 1
+        for item in self.lines[count:]:
+            self.canvas.itemconfigure(item, state='hidden')
+        self.line = None
+        self.show_line(self.shown)
+
+    # Call with the running line:
+    def show_line(self, line):
+        self.shown = line
+        if self.preview is None or line == self.line:
+            return
+        position = self.preview.position(line)
+        if position is None:
+            return
+        self.line = line
+        x, y = self.to_canvas([position])[0]
+        self.canvas.coords(self.marker, x - 4, y - 4, x + 4, y + 4)
+        self.canvas.itemconfigure(self.marker, state='normal')
+        self.canvas.tag_raise(self.marker)
+
+    def zoom(self, event, zoom_in):
+        if self.box is None:
+            return
+        x0, y0, x1, y1 = self.box
+        scale = (x1 - x0) / self.SIZE
+        x = x0 + event.x * scale
+        y = y1 - event.y * scale
+        factor = 1 / self.ZOOM if zoom_in else self.ZOOM
+        extent = self.preview.extent
+        factor = min(max(factor, self.MIN_WIDTH / (x1 - x0)), (extent[2] - extent[0]) / (x1 - x0))
+        self.box = (x - (x - x0) * factor, y - (y - y0) * factor,
+                    x + (x1 - x) * factor, y + (y1 - y) * factor)
+        self.show()
+
+    def reset_view(self, event=None):
+        if self.preview is not None:
+            self.box = self.preview.extent
+            self.show()
+
+    # Items are moved while dragging, drawn again when released:
+    def start_drag(self, event):
+        self.drag = (event.x, event.y)
+
+    def move_drag(self, event):
+        if self.drag is None or self.box is None:
+            return
+        dx = event.x - self.drag[0]
+        dy = event.y - self.drag[1]
+        self.drag = (event.x, event.y)
+        for item in self.lines + [self.marker]:
+            self.canvas.move(item, dx, dy)
+        x0, y0, x1, y1 = self.box
+        scale = (x1 - x0) / self.SIZE
+        self.box = (x0 - dx * scale, y0 + dy * scale, x1 - dx * scale, y1 + dy * scale)
+
+    def stop_drag(self, event):
+        if self.drag is not None and self.box is not None:
+            self.show()
+        self.drag = None
+
+
+class MDI(tk.Frame):
+    def __init__(self, master=None, scara=None, app=None):
+        tk.Frame.__init__(self, master)
+        self.scara = scara
+        self.app = app
 
         self.columnconfigure(0, weight=1)
 
@@ -117,8 +374,119 @@ class MDI(tk.Frame):
             return
         line = self.text_field.get("1.0", "end-2c")
         self.text_field.delete("1.0", "end")
-        print(line)
-        self.scara.g_code(line)
+        tracer.info(GCODE, "MDI %s", line)
+        try:
+            self.scara.g_code(line)
+        except (GCodeError, BufferFull) as error:
+            self.app.message_box.throw(str(error))
+
+
+class ProgramControl(tk.Frame):
+    def __init__(self, master=None, runner=None, app=None):
+        tk.Frame.__init__(self, master)
+        self.runner = runner
+        self.app = app
+
+        self.columnconfigure(0, weight=1)
+        self.columnconfigure(1, weight=1)
+
+        self.label = Title(self, text='Program:')
+        self.label.grid(column=0, row=0, columnspan=2, sticky='EW', pady=5)
+
+        self.file_label = tk.Label(self, text='---', font='none 10', anchor='w')
+        self.file_label.grid(column=0, row=1, columnspan=2, sticky='EW')
+
+        self.line_label = tk.Label(self, text='Line: ---', font='none 10', anchor='w')
+        self.line_label.grid(column=0, row=2, columnspan=2, sticky='EW')
+
+        self.open_button = tk.Button(self,
+                                     text='Open',
+                                     font='none 10 bold',
+                                     bg='gray75',
+                                     activebackground='gray75',
+                                     width=10,
+                                     height=2,
+                                     command=self.open)
+        self.open_button.grid(column=0, row=3, columnspan=2, pady=5)
+
+        self.start_button = tk.Button(self,
+                                      text='Start',
+                                      font='none 10 bold',
+                                      bg='gray75',
+                                      activebackground='gray75',
+                                      width=10,
+                                      height=2,
+                                      command=self.start)
+        self.start_button.grid(column=0, row=4, pady=5)
+
+        self.stop_button = tk.Button(self,
+                                     text='Stop',
+                                     font='none 10 bold',
+                                     bg='gray75',
+                                     activebackground='gray75',
+                                     width=10,
+                                     height=2,
+                                     command=self.stop)
+        self.stop_button.grid(column=1, row=4, pady=5)
+
+        # Violations found by the dry run:
+        self.validation = None
+        self.validation_label = tk.Label(self, text='Violations: ---', font='none 10', anchor='w')
+        self.validation_label.grid(column=0, row=5, columnspan=2, sticky='EW')
+
+        self.violations_list = tk.Listbox(self, height=4, font='none 9')
+        self.violations_list.grid(column=0, row=6, columnspan=2, sticky='EW')
+
+    def open(self):
+        path = filedialog.askopenfilename(filetypes=[("G-code", "*.nc *.gcode *.txt"),
+                                                     ("All files", "*")])
+        if not path:
+            return
+        self.runner.load(path)
+        self.file_label.configure(text=os.path.basename(path))
+
+        # Dry run in the background, lists all violations before the program is started:
+        self.violations_list.delete(0, "end")
+        self.validation_label.configure(text='Violations: checking...')
+        self.validation = BackgroundValidation(detached(self.runner.scara), path, self.runner.converter)
+
+        # Loaded in steps, drawn while loading:
+        self.app.toolpath.load(path)
+
+    # Violations of the finished dry run:
+    def show_validation(self):
+        validation = self.validation
+        self.validation = None
+        violations = validation.violations
+        if validation.error is not None or violations is None:
+            # Failed, not clean:
+            tracer.error(GCODE, "%s: validation failed: %s", validation.path, validation.error)
+            self.validation_label.configure(text='Violations: ---')
+            self.app.message_box.throw("Validation failed: {}".format(validation.error or "no result"))
+            return
+        tracer.info(GCODE, "%s: %d violations, validated in %.3f s",
+                    validation.path, len(violations), validation.elapsed)
+        for error in violations:
+            tracer.warning(GCODE, "%s", error)
+            self.violations_list.insert("end", str(error))
+        self.validation_label.configure(text='Violations: {}'.format(len(violations)))
+        if violations:
+            self.app.message_box.throw("{} violations, {}".format(len(violations), violations[0]))
+
+    def start(self):
+        if not self.runner.start():
+            self.app.message_box.throw("Program not started")
+
+    def stop(self):
+        self.runner.stop()
+
+    def refresh(self):
+        configure_text(self.line_label, "Line: " + str(self.runner.scara.executed_line))
+        if self.validation is not None and self.validation.done():
+            self.show_validation()
+        if self.runner.error is not None:
+            self.app.message_box.throw(str(self.runner.error))
+            self.runner.error = None
 
 
 class StepSize(tk.Frame):
@@ -144,7 +512,7 @@ class StepSize(tk.Frame):
 
     # Change step size:
     def set_step_size(self):
-        print(str(self.step_size.get()))
+        tracer.debug(GUI, "step size %s", self.step_size.get())
 
     """
         step_size = self.step_size.get()
@@ -178,12 +546,12 @@ class GripperButton(tk.Frame):
             # Close the gripper:
             self.gripper_state = 1
             self.button.configure(image=self.gripper_active)
-            print("Gripper closed")
+            tracer.info(GUI, "gripper closed")
         else:
             # Open the gripper:
             self.gripper_state = 0
             self.button.configure(image=self.gripper_inactive)
-            print("Gripper opened")
+            tracer.info(GUI, "gripper opened")
 
 
 class HomeButton(tk.Button):
@@ -223,7 +591,7 @@ class HomeButton(tk.Button):
             self.configure(bg="orange", activebackground="orange")
         """
         self.scara.home()
-        print(self.scara.homed)
+        tracer.info(GUI, "homing started")
 
 
 class PositionBar(tk.Frame):
@@ -292,11 +660,11 @@ class PositionBar(tk.Frame):
         self.panel.scara.is_absolute = is_absolute
 
     def display_current_position(self, position):
-        self.current_position_label.configure(text=str(position))
+        configure_text(self.current_position_label, str(position))
 
     def display_displacement(self, displacement):
         delta = '\u0394'
-        self.displacement_label.configure(text=delta + str(displacement))
+        configure_text(self.displacement_label, delta + str(displacement))
 
     """
     def button_pressed(self, direction):
@@ -434,6 +802,323 @@ class Connection(tk.Frame):
         self.scara.communication.connected = False
 
 
+class Points(tk.Frame):
+    COLUMNS = ("X", "Y", "Z", "A3", "A1", "A2")
+
+    def __init__(self, master=None, scara=None, app=None):
+        tk.Frame.__init__(self, master)
+        self.scara = scara
+        self.app = app
+
+        self.table = ttk.Treeview(self, columns=self.COLUMNS, height=12)
+        self.table.heading("#0", text="P")
+        self.table.column("#0", width=50)
+        for name in self.COLUMNS:
+            self.table.heading(name, text=name)
+            self.table.column(name, width=70, anchor='e')
+        self.table.grid(column=0, row=0, columnspan=3, pady=5)
+        self.table.bind("<<TreeviewSelect>>", self.select)
+
+        self.number_label = tk.Label(self, text="Point: ")
+        self.number_label.grid(column=0, row=1, sticky='E')
+        self.number = tk.IntVar()
+        self.number.set(1)
+        self.number_box = tk.Spinbox(self, from_=0, to=9999, textvariable=self.number, width=12)
+        self.number_box.grid(column=1, row=1, sticky='W', pady=5)
+
+        self.save_button = tk.Button(self,
+                                     text='Save',
+                                     font='none 10 bold',
+                                     bg='gray75',
+                                     activebackground='gray75',
+                                     width=10,
+                                     height=2,
+                                     command=self.save)
+        self.save_button.grid(column=0, row=2, pady=5)
+
+        self.delete_button = tk.Button(self,
+                                       text='Delete',
+                                       font='none 10 bold',
+                                       bg='gray75',
+                                       activebackground='gray75',
+                                       width=10,
+                                       height=2,
+                                       command=self.delete)
+        self.delete_button.grid(column=1, row=2, pady=5)
+
+        self.refresh()
+
+    def grid(self, *args, **kwargs):
+        # Cached joints change with the tool:
+        self.refresh()
+        tk.Frame.grid(self, *args, **kwargs)
+
+    def refresh(self):
+        self.table.delete(*self.table.get_children())
+        points = self.scara.points
+        for number in points.numbers():
+            point = points.get(number)
+            entry = points.recall(number)
+            values = ["{:.2f}".format(point[name]) for name in ("X", "Y", "Z", "A3")]
+            if entry is None:
+                values = values + ["---", "---"]
+            else:
+                values = values + ["{:.2f}".format(entry["position"][name]) for name in ("A1", "A2")]
+            self.table.insert("", "end", iid=str(number), text=str(number), values=values)
+
+    def select(self, event=None):
+        selection = self.table.selection()
+        if selection:
+            self.number.set(int(selection[0]))
+
+    # Save the current position:
+    def save(self):
+        if not self.scara.homed or not self.scara.is_ready():
+            self.app.message_box.throw("Point not saved")
+            return
+        try:
+            number = self.number.get()
+        except tk.TclError:
+            self.app.message_box.throw("Wrong point number")
+            return
+        self.scara.points.save(number, self.scara.current_position)
+        self.scara.points.flush()
+        self.refresh()
+
+    def delete(self):
+        try:
+            self.scara.points.delete(self.number.get())
+            self.scara.points.flush()
+        except tk.TclError:
+            self.app.message_box.throw("Wrong point number")
+            return
+        self.refresh()
+
+
+class Obstacles(tk.Frame):
+    # Boxes in the cell moves must keep clear of, corners in the base frame [mm]:
+    COLUMNS = ("Min X", "Min Y", "Min Z", "Max X", "Max Y", "Max Z")
+
+    def __init__(self, master=None, scara=None, app=None):
+        tk.Frame.__init__(self, master)
+        self.scara = scara
+        self.app = app
+
+        self.table = ttk.Treeview(self, columns=self.COLUMNS, height=12)
+        self.table.heading("#0", text="Name")
+        self.table.column("#0", width=100)
+        for name in self.COLUMNS:
+            self.table.heading(name, text=name)
+            self.table.column(name, width=60, anchor='e')
+        self.table.grid(column=0, row=0, columnspan=7, pady=5)
+        self.table.bind("<<TreeviewSelect>>", self.select)
+
+        self.name_label = tk.Label(self, text="Name: ")
+        self.name_label.grid(column=0, row=1, sticky='E')
+        self.name = tk.StringVar()
+        self.name_box = tk.Entry(self, textvariable=self.name, width=12)
+        self.name_box.grid(column=1, row=1, columnspan=2, sticky='W', pady=5)
+
+        self.corners = []
+        for i, name in enumerate(self.COLUMNS):
+            label = tk.Label(self, text=name + ": ")
+            label.grid(column=2 * (i % 3), row=2 + i // 3, sticky='E')
+            value = tk.DoubleVar()
+            box = tk.Entry(self, textvariable=value, width=8)
+            box.grid(column=2 * (i % 3) + 1, row=2 + i // 3, sticky='W', pady=2)
+            self.corners.append(value)
+
+        self.save_button = tk.Button(self,
+                                     text='Save',
+                                     font='none 10 bold',
+                                     bg='gray75',
+                                     activebackground='gray75',
+                                     width=10,
+                                     height=2,
+                                     command=self.save)
+        self.save_button.grid(column=0, row=4, columnspan=2, pady=5)
+
+        self.delete_button = tk.Button(self,
+                                       text='Delete',
+                                       font='none 10 bold',
+                                       bg='gray75',
+                                       activebackground='gray75',
+                                       width=10,
+                                       height=2,
+                                       command=self.delete)
+        self.delete_button.grid(column=2, row=4, columnspan=2, pady=5)
+
+        self.refresh()
+
+    def refresh(self):
+        self.table.delete(*self.table.get_children())
+        for name, (low, high) in sorted(self.scara.collision.obstacles.items()):
+            values = ["{:.1f}".format(value) for value in list(low) + list(high)]
+            self.table.insert("", "end", iid=name, text=name, values=values)
+
+    def select(self, event=None):
+        selection = self.table.selection()
+        if selection:
+            name = selection[0]
+            low, high = self.scara.collision.obstacles[name]
+            self.name.set(name)
+            for value, corner in zip(self.corners, list(low) + list(high)):
+                value.set(corner)
+
+    def save(self):
+        name = self.name.get().strip()
+        if not name:
+            self.app.message_box.throw("Wrong obstacle name")
+            return
+        try:
+            corners = [value.get() for value in self.corners]
+        except tk.TclError:
+            self.app.message_box.throw("Wrong obstacle corner")
+            return
+        self.scara.collision.add_obstacle(name, corners[:3], corners[3:])
+        self.refresh()
+
+    def delete(self):
+        self.scara.collision.remove_obstacle(self.name.get().strip())
+        self.refresh()
+
+
+class Diagnostics(tk.Frame):
+    # Where the time of the packets goes: rates, queue depth and histograms
+    # of queue wait (host), transfer (link) and execute time (controller),
+    # refreshed every REFRESH_INTERVAL while shown.
+    REFRESH_INTERVAL = 1000         # [ms]
+    WIDTH = 260
+    HEIGHT = 70
+
+    HISTOGRAMS = (("queue_wait", "Queue wait"),
+                  ("transfer", "Transfer"),
+                  ("execute", "Execute"),
+                  ("queue_depth", "Queue depth"))
+
+    def __init__(self, master=None, scara=None, app=None):
+        tk.Frame.__init__(self, master)
+        self.scara = scara
+        self.app = app
+        self.refreshing = False
+
+        self.rates = tk.Label(self, text="Packets: -", anchor='w')
+        self.rates.grid(column=0, row=0, columnspan=3, sticky='EW')
+
+        self.titles = {}
+        self.canvases = {}
+        for i, (name, title) in enumerate(self.HISTOGRAMS):
+            self.titles[name] = tk.Label(self, text=title, anchor='w')
+            self.titles[name].grid(column=0, row=1 + 2 * i, columnspan=3, sticky='EW')
+            self.canvases[name] = tk.Canvas(self, width=self.WIDTH, height=self.HEIGHT, bg='white')
+            self.canvases[name].grid(column=0, row=2 + 2 * i, columnspan=3, pady=2)
+
+        row = 1 + 2 * len(self.HISTOGRAMS)
+        self.csv_button = tk.Button(self,
+                                    text='Export CSV',
+                                    font='none 10 bold',
+                                    bg='gray75',
+                                    activebackground='gray75',
+                                    width=10,
+                                    height=2,
+                                    command=self.export_csv)
+        self.csv_button.grid(column=0, row=row, pady=5)
+
+        self.json_button = tk.Button(self,
+                                     text='Export JSON',
+                                     font='none 10 bold',
+                                     bg='gray75',
+                                     activebackground='gray75',
+                                     width=10,
+                                     height=2,
+                                     command=self.export_json)
+        self.json_button.grid(column=1, row=row, pady=5)
+
+        self.reset_button = tk.Button(self,
+                                      text='Reset',
+                                      font='none 10 bold',
+                                      bg='gray75',
+                                      activebackground='gray75',
+                                      width=10,
+                                      height=2,
+                                      command=self.reset)
+        self.reset_button.grid(column=2, row=row, pady=5)
+
+    def grid(self, *args, **kwargs):
+        tk.Frame.grid(self, *args, **kwargs)
+        if not self.refreshing:
+            self.refreshing = True
+            self.refresh()
+
+    def refresh(self):
+        # Stops when hidden, grid() starts it again:
+        if not self.winfo_manager():
+            self.refreshing = False
+            return
+        snapshot = self.scara.communication.monitor.snapshot()
+        configure_text(self.rates, "Packets: {} ({:.1f}/s), {} B ({:.0f} B/s), queue depth: {}".format(
+            snapshot["packets"], snapshot["packets_per_s"], snapshot["bytes"], snapshot["bytes_per_s"],
+            snapshot["queue_depth"]))
+        for name, title in self.HISTOGRAMS:
+            summary = snapshot["histograms"][name]
+            if name == "queue_depth":
+                text = "{}: mean {:.1f}, max {:.0f}".format(title, summary["mean"], summary["max"])
+            else:
+                text = "{}: p50 {:.2f} ms, p95 {:.2f} ms, max {:.2f} ms".format(title,
+                                                                              summary["p50"] * 1000,
+                                                                              summary["p95"] * 1000,
+                                                                              summary["max"] * 1000)
+            configure_text(self.titles[name], text)
+            self.draw(self.canvases[name], summary["bins"])
+        self.after(self.REFRESH_INTERVAL, self.refresh)
+
+    # Bars of the bins from the first to the last used one, the bounds below:
+    def draw(self, canvas, bins):
+        canvas.delete("all")
+        used = [i for i, (_, _, count) in enumerate(bins) if count]
+        if not used:
+            return
+        bins = bins[used[0]:used[-1] + 1]
+        top = max(count for _, _, count in bins)
+        width = self.WIDTH / len(bins)
+        bottom = self.HEIGHT - 14
+        for i, (_, _, count) in enumerate(bins):
+            height = (bottom - 4) * count / top
+            canvas.create_rectangle(i * width + 1, bottom - height, (i + 1) * width - 1, bottom,
+                                    fill='steelblue', outline='')
+        low = bins[0][0]
+        high = bins[-1][1]
+        canvas.create_text(2, self.HEIGHT - 2, anchor='sw', font='none 7',
+                           text="-" if low is None else "{:g}".format(low))
+        canvas.create_text(self.WIDTH - 2, self.HEIGHT - 2, anchor='se', font='none 7',
+                           text="-" if high is None else "{:g}".format(high))
+
+    # Timestamps of the last packets:
+    def export_csv(self):
+        self.export(".csv")
+
+    # Rates and histograms:
+    def export_json(self):
+        self.export(".json")
+
+    def export(self, extension):
+        path = filedialog.asksaveasfilename(defaultextension=extension,
+                                            filetypes=[(extension[1:].upper(), "*" + extension)])
+        if not path:
+            return
+        try:
+            self.scara.communication.monitor.export(path)
+        except OSError as error:
+            self.app.message_box.throw(str(error))
+            return
+        self.app.message_box.throw("Saved to " + os.path.basename(path))
+
+    def reset(self):
+        self.scara.communication.monitor.reset()
+        for canvas in self.canvases.values():
+            canvas.delete("all")
+
+
 class Service(tk.Frame):
     PASSWORD = '1234'
 
@@ -457,6 +1142,26 @@ class Service(tk.Frame):
                                 command=self.service_log)
         self.button.grid(column=0, row=1, pady=10)
 
+        self.trace_button = tk.Button(self,
+                                      text="SAVE TRACE",
+                                      font='none 10 bold',
+                                      bg='gray75',
+                                      activebackground='gray75',
+                                      width=10,
+                                      height=2,
+                                      command=self.save_trace)
+        self.trace_button.grid(column=0, row=2, pady=10)
+
+    # The last events, for the diagnosis of a fault:
+    def save_trace(self):
+        path = tracer.dump_path or tracer.DUMP_PATH
+        try:
+            count = tracer.dump(path)
+        except OSError as error:
+            self.app.message_box.throw(str(error))
+            return
+        self.app.message_box.throw("{} events saved to {}".format(count, path))
+
     def service_log(self):
         if not self.is_service:
             if not self.pwd.get() == self.PASSWORD:
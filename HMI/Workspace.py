@@ -0,0 +1,120 @@
+import numpy as np
+
+
+class ReachabilityMap:
+    # Grid over the XY plane, tells in O(1) if a point can be reached
+    # (IK solution within joint ranges) before running the full IK.
+    # Cells crossed by the workspace boundary are checked exactly.
+    # Built lazily, rebuilt when arm lengths, ranges or the tool change.
+
+    RESOLUTION = 1.0        # Cell size [mm]
+
+    # Cell states:
+    OUTSIDE = 0
+    INSIDE = 1
+    BORDER = 2
+
+    def __init__(self, scara, resolution=RESOLUTION):
+        self.scara = scara
+        self.resolution = resolution
+        self.key = None
+        self.grids = {}         # elbow -> grid of cell states
+        self.origin = 0.0       # Grid corner, the same for X and Y [mm]
+        self.size = 0           # Cells per side
+
+        # Statistics:
+        self.builds = 0
+        self.exact_checks = 0
+
+    # Parameters the workspace depends on:
+    def parameters(self):
+        scara = self.scara
+        return (scara.l1, scara.l2, scara.current_tool["x_offset"],
+                scara.min_range["A1"], scara.max_range["A1"],
+                scara.min_range["A2"], scara.max_range["A2"],
+                self.resolution)
+
+    def invalidate(self):
+        self.key = None
+        self.grids.clear()
+
+    def grid(self, elbow):
+        key = self.parameters()
+        if key != self.key:
+            self.key = key
+            self.grids.clear()
+        grid = self.grids.get(elbow)
+        if grid is None:
+            grid = self.build(elbow)
+            self.grids[elbow] = grid
+        return grid
+
+    def build(self, elbow):
+        scara = self.scara
+        reach = scara.l1 + scara.l2 + scara.current_tool["x_offset"]
+        self.size = int(np.ceil(2 * reach / self.resolution)) + 2
+        self.origin = -self.size * self.resolution / 2
+
+        # Exact check in the cell corners:
+        corners = self.origin + np.arange(self.size + 1) * self.resolution
+        x, y = np.meshgrid(corners, corners)
+        reachable = self.check(np.column_stack([x.ravel(), y.ravel()]), elbow).reshape(x.shape)
+
+        # All corners agree, or the boundary goes through the cell:
+        count = reachable[:-1, :-1].astype(np.uint8) + reachable[1:, :-1] + reachable[:-1, 1:] + reachable[1:, 1:]
+        grid = np.where(count == 4, self.INSIDE, self.OUTSIDE).astype(np.uint8)
+        border = (count > 0) & (count < 4)
+
+        # Curved boundary may bulge into the neighbouring cells:
+        grown = border.copy()
+        grown[1:, :] |= border[:-1, :]
+        grown[:-1, :] |= border[1:, :]
+        grown[:, 1:] |= border[:, :-1]
+        grown[:, :-1] |= border[:, 1:]
+        # and thin slivers at the outer and inner circle, where the joint range ends:
+        centers = corners[:-1] + self.resolution / 2
+        radius = np.hypot(*np.meshgrid(centers, centers))
+        l2 = scara.l2 + scara.current_tool["x_offset"]
+        margin = 2 * self.resolution
+        grown |= (np.abs(radius - reach) <= margin) | (np.abs(radius - abs(scara.l1 - l2)) <= margin)
+        grid[grown] = self.BORDER
+
+        self.builds = self.builds + 1
+        return grid
+
+    # Exact check, N x 2 array of X, Y [mm] -> N mask:
+    def check(self, xy, elbow=1):
+        scara = self.scara
+        angles, reachable = scara.inverse_kinematics_batch(xy, elbow)
+        with np.errstate(invalid='ignore'):
+            for i, name in enumerate(("A1", "A2")):
+                reachable = reachable & (angles[:, i] >= scara.min_range[name]) & (angles[:, i] <= scara.max_range[name])
+        return reachable
+
+    def is_reachable(self, x, y, elbow=1):
+        grid = self.grid(elbow)
+        column = int((x - self.origin) // self.resolution)
+        row = int((y - self.origin) // self.resolution)
+        if not (0 <= column < self.size and 0 <= row < self.size):
+            return False
+        state = grid[row, column]
+        if state == self.BORDER:
+            self.exact_checks = self.exact_checks + 1
+            return bool(self.check(np.array([[x, y]]), elbow)[0])
+        return bool(state == self.INSIDE)
+
+    # N x 2 array of X, Y [mm] -> N mask:
+    def is_reachable_batch(self, xy, elbow=1):
+        grid = self.grid(elbow)
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        cells = np.floor((xy - self.origin) / self.resolution)
+        inside = ((cells >= 0) & (cells < self.size)).all(axis=1)
+        cells = np.where(inside[:, None], cells, 0).astype(np.intp)
+
+        state = np.where(inside, grid[cells[:, 1], cells[:, 0]], self.OUTSIDE)
+        reachable = state == self.INSIDE
+        border = np.flatnonzero(state == self.BORDER)
+        if len(border):
+            self.exact_checks = self.exact_checks + len(border)
+            reachable[border] = self.check(xy[border], elbow)
+        return reachable
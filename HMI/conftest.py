@@ -0,0 +1,24 @@
+import pytest
+from SCARA import Scara
+from Trace import tracer
+
+
+@pytest.fixture(autouse=True)
+def trace_dump(tmp_path, monkeypatch):
+    # Faults dump the trace to the test's directory:
+    monkeypatch.setattr(tracer, "dump_path", str(tmp_path / "trace.log"))
+
+
+@pytest.fixture
+def scara():
+    scara = Scara()
+    # Positions are class attributes shared by all instances, each test gets its own:
+    for name in ("current_position", "displacement", "target_position", "rounding_error"):
+        setattr(scara, name, dict.fromkeys(scara.axes_names, 0.0))
+    # No taught points or obstacles, nothing is written:
+    scara.points.points = {}
+    scara.points.cache = {}
+    scara.points.path = None
+    scara.collision.obstacles = {}
+    scara.collision.path = None
+    return scara
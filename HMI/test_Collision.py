@@ -0,0 +1,59 @@
+import os
+import pytest
+import Collision
+from Collision import CollisionChecker
+from GCode import GCodeError, parse_line
+
+
+def home(scara):
+    scara.target_position.update({"Z": scara.min_range["Z"], "A1": scara.max_range["A1"],
+                                  "A2": scara.min_range["A2"], "A3": 0.0})
+
+
+def convert(scara, text):
+    return list(scara.convert(parse_line(text)))
+
+
+def test_self_collision_is_rejected(scara):
+    home(scara)
+    # Folded past 160 deg, the tool hits the arm:
+    scara.max_range = dict(scara.max_range, A2=180.0)
+    convert(scara, "G0 Z50 A1=0 A2=90")
+    target = dict(scara.target_position)
+    with pytest.raises(GCodeError) as error:
+        convert(scara, "A2=175")
+    assert "tool with arm" in error.value.message
+    # Nothing was planned:
+    assert scara.target_position == target
+    assert len(convert(scara, "A2=120")) == 1
+
+
+def test_obstacle_is_rejected(scara):
+    home(scara)
+    convert(scara, "G0 X150 Y-60 Z10")
+    scara.collision.add_obstacle("box", (140.0, -10.0, 0.0), (160.0, 10.0, 120.0))
+    target = dict(scara.target_position)
+    with pytest.raises(GCodeError) as error:
+        convert(scara, "X150 Y0")
+    assert "box" in error.value.message
+    assert scara.target_position == target
+    # Around it:
+    assert convert(scara, "X120 Y-80")
+    scara.collision.remove_obstacle("box")
+    assert convert(scara, "X150 Y0")
+
+
+def test_obstacles_are_written_atomically(scara, tmp_path):
+    path = str(tmp_path / "obstacles.json")
+    checker = CollisionChecker(scara, path=path)
+    checker.add_obstacle("box", (1, 2, 3), (-1, 5, 0))
+    checker.add_obstacle("other", (0, 0, 0), (1, 1, 1))
+    checker.remove_obstacle("other")
+    assert os.listdir(str(tmp_path)) == ["obstacles.json"]
+    loaded = CollisionChecker(scara, path=path)
+    loaded.load()
+    assert loaded.obstacles == {"box": ((-1.0, 2.0, 0.0), (1.0, 5.0, 3.0))}
+
+
+def test_path_is_next_to_the_module():
+    assert os.path.dirname(CollisionChecker.PATH) == os.path.dirname(os.path.abspath(Collision.__file__))
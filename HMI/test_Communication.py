@@ -0,0 +1,266 @@
+import time
+import pytest
+from Communication import BufferFull, Communication
+from Controller import VirtualController
+from Protocol import ACK, BINARY
+
+
+class NoisyController(VirtualController):
+    # Flips a bit of the given writes (counted from 1):
+    def __init__(self, corrupted, slots=1):
+        VirtualController.__init__(self, slots=slots)
+        self.corrupted = set(corrupted)
+
+    def write(self, data):
+        if self.writes + 1 in self.corrupted:
+            data = bytearray(data)
+            data[4] ^= 0x01
+            data = bytes(data)
+        return VirtualController.write(self, data)
+
+
+def connect(controller, protocol=BINARY, window=1, capacity=100, when_full=Communication.REJECT):
+    communication = Communication(capacity=capacity, when_full=when_full, protocol=protocol, window=window,
+                                  slots=controller.slots)
+    communication.serial_port = controller
+    communication.connected = True
+    communication.ready = True
+    return communication
+
+
+def run(communication, packets, steps=1000):
+    for i, packet in enumerate(packets):
+        communication.to_buffer(packet, i)
+    for _ in range(steps):
+        if communication.is_idle() or communication.error is not None:
+            break
+        communication.ready_check()
+        communication.send()
+
+
+PACKETS = [['G', float(i), 2.0, -3.0, 0.0] for i in range(10)]
+
+
+def test_corrupted_frame_is_sent_again():
+    controller = NoisyController(corrupted=[3, 4])
+    communication = connect(controller)
+    run(communication, PACKETS)
+    # Each packet executed once, in order:
+    assert controller.log == PACKETS
+    assert list(communication.completed) == list(range(len(PACKETS)))
+    assert communication.resent == 2
+    assert communication.error is None
+    assert controller.decoder.rejected == 2
+
+
+def test_too_many_rejections_fault():
+    controller = NoisyController(corrupted=range(3, 3 + Communication.RESENDS + 1))
+    communication = connect(controller)
+    run(communication, PACKETS)
+    assert controller.log == PACKETS[:2]
+    assert communication.error is not None
+    # Nothing is sent after a fault:
+    assert communication.is_idle()
+    assert not communication.ready
+    communication.clear_error()
+    assert communication.ready
+
+
+def test_rejection_within_a_window_faults():
+    # Packets after the rejected one may be executed, it can't be sent again in order:
+    controller = NoisyController(corrupted=[3], slots=4)
+    communication = connect(controller, window=4)
+    run(communication, PACKETS)
+    assert communication.error is not None
+    assert PACKETS[2] not in controller.log
+
+
+def test_fault_loses_the_position(scara):
+    controller = NoisyController(corrupted=range(1, Communication.RESENDS + 2))
+    scara.communication = connect(controller)
+    scara.homed = True
+    scara.dispatch(['G', 10.0, 0.0, 0.0, 0.0], {"Z": 1.0, "A1": 0.0, "A2": 0.0, "A3": 0.0})
+    run(scara.communication, [])
+    scara.update_position()
+    assert not scara.homed
+    assert scara.displacement == dict.fromkeys(scara.axes_names, 0.0)
+    assert scara.target_position == scara.current_position
+
+
+class SilentController(VirtualController):
+    # Takes packets, never answers:
+    def run(self):
+        pass
+
+
+def queued(communication):
+    return [packet for packet, _, _ in communication.buffer]
+
+
+def test_full_buffer_rejects():
+    communication = connect(VirtualController(), capacity=3)
+    communication.connected = False
+    for packet in PACKETS[:3]:
+        communication.to_buffer(packet)
+    with pytest.raises(BufferFull):
+        communication.to_buffer(PACKETS[3])
+    assert queued(communication) == PACKETS[:3]
+    assert (communication.rejected, communication.high_water) == (1, 3)
+
+
+def test_full_buffer_drops_the_oldest_feed_or_wait():
+    communication = connect(VirtualController(), capacity=3, when_full=Communication.DROP_OLDEST)
+    communication.connected = False
+    for packet in (PACKETS[0], ['F', 1.0, 2.0, 3.0], ['W', 1.0]):
+        communication.to_buffer(packet)
+    communication.to_buffer(PACKETS[1])
+    communication.to_buffer(PACKETS[2])
+    assert queued(communication) == PACKETS[:3]
+    assert communication.dropped == 2
+    # Moves and encoded packets are never dropped:
+    with pytest.raises(BufferFull):
+        communication.to_buffer(b"encoded")
+    assert queued(communication) == PACKETS[:3]
+    assert communication.rejected == 1
+
+
+def test_full_buffer_blocks_until_sent():
+    controller = VirtualController(slots=1)
+    communication = connect(controller, capacity=2, when_full=Communication.BLOCK)
+    # Without I/O threads the caller drains the buffer:
+    for packet in PACKETS:
+        communication.to_buffer(packet)
+    assert communication.rejected == 0
+    assert communication.high_water == 2
+    assert communication.wait_idle(1.0)
+    assert controller.log == PACKETS
+
+
+def test_full_buffer_blocks_until_timeout():
+    communication = connect(SilentController(slots=1), capacity=2, when_full=Communication.BLOCK)
+    for packet in PACKETS[:3]:
+        communication.to_buffer(packet)
+    started = time.monotonic()
+    with pytest.raises(BufferFull):
+        communication.to_buffer(PACKETS[3], timeout=0.05)
+    assert time.monotonic() - started >= 0.05
+    assert communication.rejected == 1
+    # One in flight, the buffer is full:
+    assert queued(communication) == PACKETS[1:3]
+    # Disconnected, nothing drains it:
+    communication.connected = False
+    with pytest.raises(BufferFull):
+        communication.to_buffer(PACKETS[3], timeout=None)
+
+
+def test_window_is_limited_to_the_slots():
+    assert Communication(window=8, slots=4).window == 4
+    communication = Communication(window=1, slots=Communication.MAX_WINDOW + 4)
+    communication.set_window(100)
+    assert communication.window == Communication.MAX_WINDOW
+    communication.set_window(0)
+    assert communication.window == 1
+
+
+def test_window_of_packets_in_flight():
+    communication = connect(SilentController(slots=4), window=4)
+    for i, packet in enumerate(PACKETS):
+        communication.to_buffer(packet, i)
+    communication.send()
+    assert len(communication.in_flight) == 4
+    assert not communication.ready
+    assert communication.outstanding() == len(PACKETS)
+    # Each ack frees one place, in order:
+    communication.receive(bytes([ACK, ACK]))
+    assert list(communication.completed) == [0, 1]
+    assert communication.ready
+    communication.send()
+    assert len(communication.in_flight) == 4
+    assert [tag for _, tag, _, _, _ in communication.in_flight] == [2, 3, 4, 5]
+    # Extra acks with nothing in flight are ignored:
+    communication.receive(bytes([ACK] * 10))
+    assert list(communication.completed) == list(range(6))
+    assert communication.ready
+
+
+@pytest.mark.parametrize("slots", [1, 4, 16])
+def test_controller_slots_never_overflow(slots):
+    controller = VirtualController(slots=slots)
+    communication = connect(controller, window=slots)
+    run(communication, PACKETS * 5)
+    assert controller.log == PACKETS * 5
+    assert controller.overflows == 0
+    assert list(communication.completed) == list(range(50))
+
+
+def test_window_over_the_slots_loses_packets():
+    controller = VirtualController(slots=1)
+    communication = Communication(window=4, slots=4, protocol=BINARY)
+    communication.serial_port = controller
+    communication.connected = True
+    communication.ready = True
+    for packet in PACKETS[:4]:
+        communication.to_buffer(packet)
+    communication.send()
+    controller.run()
+    assert controller.overflows == 3
+    assert controller.log == PACKETS[:1]
+
+
+class LostController(VirtualController):
+    # Unplugged after `count` writes:
+    def __init__(self, count, slots=1):
+        VirtualController.__init__(self, slots=slots)
+        self.count = count
+
+    def read(self, size=1):
+        if self.writes >= self.count:
+            raise OSError("device disconnected")
+        return VirtualController.read(self, size)
+
+
+@pytest.fixture
+def io():
+    started = []
+
+    def start(communication):
+        communication.start_io()
+        started.append(communication)
+        return communication
+
+    yield start
+    for communication in started:
+        communication.stop_io(1.0)
+
+
+@pytest.mark.parametrize("window", [1, 4])
+def test_io_threads_send_on_acks(io, window):
+    controller = VirtualController(slots=window)
+    communication = io(connect(controller, window=window))
+    assert communication.is_io_running()
+    for i, packet in enumerate(PACKETS * 5):
+        communication.to_buffer(packet, i)
+    assert communication.wait_idle(5.0)
+    assert controller.log == PACKETS * 5
+    assert list(communication.completed) == list(range(50))
+    communication.stop_io(1.0)
+    assert not communication.is_io_running()
+
+
+def test_io_threads_make_space_for_blocked_callers(io):
+    controller = VirtualController(slots=1)
+    communication = io(connect(controller, capacity=2, when_full=Communication.BLOCK))
+    for packet in PACKETS:
+        communication.to_buffer(packet, timeout=5.0)
+    assert communication.wait_idle(5.0)
+    assert controller.log == PACKETS
+    assert communication.rejected == 0
+
+
+def test_io_threads_notice_a_lost_port(io):
+    communication = io(connect(LostController(3)))
+    for packet in PACKETS:
+        communication.to_buffer(packet)
+    assert not communication.wait_idle(5.0)
+    assert not communication.connected
+    assert len(communication.serial_port.log) <= 3
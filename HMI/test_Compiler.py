@@ -0,0 +1,113 @@
+import os
+import Compiler
+from Compiler import ProgramCache
+from Protocol import encode
+from Runner import ProgramRunner
+
+
+def home(scara):
+    scara.target_position.update({"Z": scara.min_range["Z"], "A1": scara.max_range["A1"],
+                                  "A2": scara.min_range["A2"], "A3": 0.0})
+    scara.rounding_error.update(dict.fromkeys(scara.axes_names, 0.0))
+    scara.is_absolute = scara.G90
+    scara.is_linear = scara.G0
+    scara.feed = 0
+    # Points taught by an earlier run are part of the key:
+    scara.points.points = {}
+    scara.points.cache = {}
+
+
+def write_program(tmp_path, count=1500):
+    lines = ["G90 F1500", "X150 Y20 Z10", "P=1"]
+    for i in range(count):
+        lines.append("X{:.2f} Y{:.2f} Z{:.1f}".format(140 + i % 40, -30 + i % 60, i % 20))
+        if i % 100 == 0:
+            lines += ["G1 X160 Y10", "G0", "G4.0.1", "P(1)"]
+    path = tmp_path / "program.gcode"
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def run(cache, runner):
+    return [item for item in cache.packets(runner) if item is not None]
+
+
+def test_compiled_packets_are_the_converted_ones(scara, tmp_path):
+    cache = ProgramCache(scara, directory=str(tmp_path / "cache"))
+    runner = ProgramRunner(scara, cache=cache)
+    runner.path = write_program(tmp_path)
+
+    home(scara)
+    converted = run(cache, runner)
+    end = cache.state()
+    assert (cache.hits, cache.misses) == (0, 1)
+    # No index buffer is left:
+    assert sorted(name.rsplit(".", 1)[1] for name in os.listdir(cache.directory)) == ["bin", "json", "npy"]
+
+    home(scara)
+    compiled = run(cache, runner)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(compiled) == len(converted) > ProgramCache.CHUNK
+    for (line, packet, displacement), (compiled_line, data, record) in zip(converted, compiled):
+        assert compiled_line == line
+        assert bytes(data) == encode(packet, scara.communication.protocol)
+        if displacement:
+            assert {name: record[name] for name in scara.axes_names} == displacement
+        else:
+            assert record is None
+    # Left in the same state as after converting:
+    assert cache.state() == end
+
+
+def test_compiled_moves_are_dispatched(scara, tmp_path):
+    cache = ProgramCache(scara, directory=str(tmp_path / "cache"))
+    runner = ProgramRunner(scara, cache=cache)
+    runner.path = write_program(tmp_path, 10)
+    home(scara)
+    run(cache, runner)
+    home(scara)
+    _, _, record = next(item for item in run(cache, runner) if item[2] is not None)
+    scara.dispatch(['G', 1.0, 2.0, 3.0, 0.0], record, 5)
+    _, (line, displacement) = scara.communication.buffer[-1][:2]
+    assert line == 5
+    assert displacement == {name: float(record[name]) for name in scara.axes_names}
+    assert scara.displacement == displacement
+
+
+def test_changed_parameters_compile_again(scara, tmp_path):
+    cache = ProgramCache(scara, directory=str(tmp_path / "cache"))
+    runner = ProgramRunner(scara, cache=cache)
+    runner.path = write_program(tmp_path, 50)
+    home(scara)
+    first = cache.key(runner.path, runner)
+    run(cache, runner)
+
+    home(scara)
+    scara.reduction = dict(scara.reduction, Z=scara.reduction["Z"] * 2)
+    assert cache.key(runner.path, runner) != first
+    doubled = run(cache, runner)
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert len(os.listdir(cache.directory)) == 6
+
+    # The program changed:
+    home(scara)
+    with open(runner.path, "a") as file:
+        file.write("X150 Y0\n")
+    assert len(run(cache, runner)) == len(doubled) + 1
+    assert (cache.hits, cache.misses) == (0, 3)
+
+
+def test_stopped_program_is_not_cached(scara, tmp_path):
+    cache = ProgramCache(scara, directory=str(tmp_path / "cache"))
+    runner = ProgramRunner(scara, cache=cache)
+    runner.path = write_program(tmp_path)
+    home(scara)
+    packets = cache.packets(runner)
+    for _ in range(10):
+        next(packets)
+    packets.close()
+    assert os.listdir(cache.directory) == []
+
+
+def test_directory_is_next_to_the_module():
+    assert os.path.dirname(ProgramCache.DIRECTORY) == os.path.dirname(os.path.abspath(Compiler.__file__))
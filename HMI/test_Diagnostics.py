@@ -0,0 +1,90 @@
+import csv
+import json
+import pytest
+from Diagnostics import RollingHistogram, LinkMonitor, log_edges
+
+
+def test_log_edges():
+    assert log_edges(1.0, 10.0) == [1.0, 2.0, 4.0, 8.0, 16.0]
+    assert log_edges(1.0, 1.0) == [1.0]
+
+
+def test_bins():
+    histogram = RollingHistogram([1, 2, 4], 100)
+    for value in (0.5, 1, 1.5, 3, 4, 100):
+        histogram.add(value)
+    # Edges belong to the bin above them:
+    assert histogram.bins() == [(None, 1, 1), (1, 2, 2), (2, 4, 1), (4, None, 2)]
+    assert histogram.count() == 6
+    assert histogram.mean() == pytest.approx(110.0 / 6)
+
+
+def test_only_last_samples_are_kept():
+    histogram = RollingHistogram([10], 3)
+    for value in (20, 30, 1, 2, 3):
+        histogram.add(value)
+    assert histogram.count() == 3
+    assert [count for _, _, count in histogram.bins()] == [3, 0]
+    assert histogram.mean() == pytest.approx(2.0)
+    assert histogram.quantile(1.0) == 3
+
+
+def test_quantiles():
+    histogram = RollingHistogram(log_edges(1, 1000), 1000)
+    for value in range(100, 0, -1):
+        histogram.add(value)
+    assert histogram.quantile(0.0) == 1
+    assert histogram.quantile(0.5) == 51
+    assert histogram.quantile(0.95) == 96
+    assert histogram.quantile(1.0) == 100
+    summary = histogram.summary()
+    assert (summary["count"], summary["p50"], summary["max"]) == (100, 51, 100)
+    assert sum(count for _, _, count in summary["bins"]) == 100
+
+
+def test_clear():
+    histogram = RollingHistogram([1], 10)
+    histogram.add(5)
+    histogram.clear()
+    assert histogram.count() == 0
+    assert histogram.mean() == 0.0
+    assert histogram.quantile(0.5) == 0.0
+    assert [count for _, _, count in histogram.bins()] == [0, 0]
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def test_link_monitor_split(tmp_path):
+    clock = Clock()
+    monitor = LinkMonitor(clock=clock)
+    # 100 B at 10000 Bd: 0.1 s on the wire:
+    enqueued = monitor.enqueued(0)
+    clock.time = 0.5
+    sent = monitor.sent(0)
+    clock.time = 1.0
+    monitor.acknowledged(enqueued, sent, 100, 10000)
+
+    histograms = monitor.snapshot()["histograms"]
+    assert histograms[LinkMonitor.QUEUE_WAIT]["mean"] == pytest.approx(0.5)
+    assert histograms[LinkMonitor.TRANSFER]["mean"] == pytest.approx(0.1)
+    assert histograms[LinkMonitor.EXECUTE]["mean"] == pytest.approx(0.4)
+    assert monitor.rates() == (pytest.approx(1 / LinkMonitor.RATE_WINDOW), pytest.approx(100 / LinkMonitor.RATE_WINDOW))
+
+    monitor.export(str(tmp_path / "link.json"))
+    with open(str(tmp_path / "link.json")) as file:
+        assert json.load(file)["packets"] == 1
+    monitor.export(str(tmp_path / "link.csv"))
+    with open(str(tmp_path / "link.csv"), newline="") as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == list(LinkMonitor.CSV_COLUMNS)
+    assert len(rows) == 2
+
+    monitor.reset()
+    assert monitor.snapshot()["packets"] == 0
+    assert monitor.rates() == (0.0, 0.0)
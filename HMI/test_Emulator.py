@@ -0,0 +1,94 @@
+import os
+import select
+import pytest
+from Emulator import Emulator, run_program
+from Firmware import Firmware
+from GCode import parse_file
+from Protocol import ACK, NAK, BINARY, TEXT, encode
+
+
+MOVE = ['G', 90.0, -45.0, 10.0, 0.0]
+
+
+@pytest.fixture
+def emulator():
+    with Emulator(speed=0) as emulator:
+        yield emulator
+
+
+# Host side of the pty, raw like a serial port:
+@pytest.fixture
+def port(emulator):
+    fd = os.open(emulator.port, os.O_RDWR | os.O_NOCTTY)
+    yield fd
+    os.close(fd)
+
+
+def read(fd, count=1, timeout=2.0):
+    data = b''
+    while len(data) < count:
+        ready, _, _ = select.select([fd], [], [], timeout)
+        if not ready:
+            break
+        data = data + os.read(fd, count - len(data))
+    return data
+
+
+def test_packets_are_acknowledged_when_executed(emulator, port):
+    # First menu() call:
+    assert read(port) == bytes([ACK])
+    os.write(port, encode(MOVE, BINARY))
+    assert read(port) == bytes([ACK])
+    os.write(port, encode(['W', 0.5], TEXT))
+    assert read(port) == bytes([ACK])
+
+    assert [packet for _, packet, _ in emulator.log] == [MOVE, ['W', 0.5]]
+    # Emulated time: transfer at the baudrate and execution:
+    firmware = Firmware()
+    duration = firmware.execute(MOVE) + firmware.execute(['W', 0.5])
+    transfer = emulator.bytes_received * Emulator.BITS_PER_BYTE / emulator.baudrate
+    assert emulator.clock.now == pytest.approx(duration + transfer)
+
+
+def test_corrupted_frame_is_answered_with_nak(emulator, port):
+    read(port)
+    frame = bytearray(encode(MOVE, BINARY))
+    frame[4] ^= 0x01
+    os.write(port, bytes(frame))
+    assert read(port) == bytes([NAK])
+    assert emulator.rejected == 1
+    assert emulator.log == []
+    # The next frame is taken:
+    os.write(port, encode(MOVE, BINARY))
+    assert read(port) == bytes([ACK])
+    assert len(emulator.log) == 1
+
+
+def test_packets_beyond_the_slots_are_lost(emulator, port):
+    read(port)
+    # Both come at once, one slot like the firmware:
+    os.write(port, encode(MOVE, BINARY) * 2)
+    assert read(port, 2) == bytes([ACK])
+    assert emulator.overflows == 1
+    assert len(emulator.log) == 1
+
+
+def test_long_waits_are_counted_as_hangs(emulator, port):
+    read(port)
+    os.write(port, encode(['W', 30.0], TEXT))
+    assert read(port) == bytes([ACK])
+    assert emulator.hangs == 1
+
+
+@pytest.mark.parametrize("protocol, slots", [(TEXT, 1), (BINARY, 1), (BINARY, 4)])
+def test_program_runs_through_the_pty(tmp_path, protocol, slots):
+    lines = ["G90 F1500"] + ["X{} Y{} Z{}".format(140 + i % 30, i % 40 - 20, i % 10) for i in range(200)] + ["G4.0.2"]
+    path = tmp_path / "program.gcode"
+    path.write_text("\n".join(lines) + "\n")
+
+    with Emulator(speed=0, slots=slots) as emulator:
+        assert run_program(str(path), emulator, window=slots, protocol=protocol, timeout=30) == 202
+    assert emulator.log[-1][1] == ['W', 0.2]
+    packets = sum(1 for block in parse_file(str(path)) if block.line > 1) + 1
+    assert len(emulator.log) == packets
+    assert (emulator.overflows, emulator.rejected, emulator.flushed) == (0, 0, 0)
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+from Estimator import CycleTimeEstimator, round_tenths, text_lengths
+from Firmware import Firmware
+from GCode import parse_lines
+from Notifier import ChangeNotifier
+from Protocol import encode, TEXT, BINARY
+
+PROGRAM = """G90 F1500
+X150 Y20 Z10
+G4.0.5
+X161.1 Y-24.4 Z24.8
+F3000
+G1 X152.1 Y28.8
+G0 A1=30 A2=-40
+G91 Z-5 A1=2.005
+G90 F500
+X500 Y0
+P=1
+X140 Y-30 Z2
+P(1)
+G4.1.25
+"""
+
+
+def home(scara):
+    scara.target_position.update({"Z": scara.min_range["Z"], "A1": scara.max_range["A1"],
+                                  "A2": scara.min_range["A2"], "A3": 0.0})
+
+
+# Packets of Scara.convert() timed by Firmware and sent with an ack each:
+def firmware_time(scara, text, protocol, baudrate):
+    firmware = Firmware()
+    total = 0.0
+    packets = 0
+    for block in parse_lines(text.splitlines()):
+        for packet, _ in scara.convert(block):
+            size = len(encode(packet, protocol)) + CycleTimeEstimator.ACK_SIZE
+            total = total + firmware.execute(packet) + size * CycleTimeEstimator.BITS_PER_BYTE / baudrate
+            packets = packets + 1
+    return total, packets
+
+
+def test_round_tenths():
+    generator = np.random.default_rng(1)
+    values = np.concatenate([generator.uniform(-1000, 1000, 10000),
+                             generator.integers(-2000, 2000, 10000) * 0.05,     # Halves
+                             generator.uniform(-0.1, 0.1, 1000)])
+    rounded = round_tenths(values)
+    expected = np.array([round(value, 1) for value in values.tolist()])
+    assert (rounded == expected).all()
+    # -0.0 is written as text too:
+    assert (np.signbit(rounded) == np.signbit(expected)).all()
+
+
+def test_text_lengths():
+    values = [0.0, -0.0, 1.5, -12.25, 123.4, 1200.0]
+    assert text_lengths(values).tolist() == [len(str(value)) for value in values]
+
+
+@pytest.mark.parametrize("protocol", [TEXT, BINARY])
+def test_matches_firmware_timing(scara, protocol):
+    home(scara)
+    result = CycleTimeEstimator(scara, protocol=protocol).estimate_text(PROGRAM)
+    home(scara)
+    total, packets = firmware_time(scara, PROGRAM, protocol, CycleTimeEstimator(scara).baudrate)
+    assert result["packets"] == packets
+    assert result["total"] == pytest.approx(total, rel=1e-9)
+    assert result["waits"] == pytest.approx(0.5 + 1.3)
+    assert result["rejected"] == 1
+    assert result["times"].shape == (len(result["lines"]),)
+    assert result["times"].sum() == pytest.approx(result["total"])
+
+
+def test_rounding_is_carried(scara):
+    # Decimal ties may go the other way than in move_packet(), the sums stay the same:
+    scara.target_position.update({"Z": 60.0, "A1": 0.0, "A2": 0.0, "A3": 0.0})
+    generator = np.random.default_rng(2)
+    displacements = generator.uniform(-0.5, 0.5, (500, 4)).round(3)
+    displacements[:, 3] = 0.0
+    values = CycleTimeEstimator(scara).move_values(displacements.tolist())
+    serial = []
+    for row in displacements.tolist():
+        packet = scara.move_packet(dict(zip(scara.axes_names, row)))
+        serial.append(packet[1:])
+    serial = np.array(serial)
+    assert np.abs(values - serial).max() <= 0.1 + 1e-9
+    np.testing.assert_allclose(values.sum(axis=0), serial.sum(axis=0), atol=0.1 + 1e-9)
+
+
+def test_estimate_has_no_side_effects(scara):
+    home(scara)
+    scara.feed = 1000
+    scara.notifier.dispatch()
+    target = dict(scara.target_position)
+    rounding_error = dict(scara.rounding_error)
+    CycleTimeEstimator(scara).estimate_text(PROGRAM)
+    assert scara.feed == 1000
+    assert scara.target_position == target
+    assert scara.rounding_error == rounding_error
+    # No GUI refresh:
+    assert ChangeNotifier.FEED not in scara.notifier.dispatch()
+
+
+def test_feed_packet(scara):
+    estimator = CycleTimeEstimator(scara)
+    assert estimator.feed_packet(None, 700) == (None, 700)
+    packet, feed = estimator.feed_packet(20000, 700)
+    assert feed == scara.max_feed
+    assert packet == scara.feed_packet(20000)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from Firmware import trapezoid_time
+
+
+# Distance covered in time by the profile, integrated in small steps:
+def simulated_length(time, entry, cruise, exit, acceleration, steps=100000):
+    dt = time / steps
+    speed = entry
+    length = 0.0
+    for i in range(steps):
+        left = time - i * dt
+        # Decelerate when the exit speed is just reachable:
+        if speed - exit >= acceleration * left:
+            speed = max(speed - acceleration * dt, exit)
+        else:
+            speed = min(speed + acceleration * dt, cruise)
+        length = length + speed * dt
+    return length
+
+
+def test_trapezoid():
+    # 1 s to cruise, 90 deg at cruise speed, 1 s to stop:
+    assert trapezoid_time(100.0, 0.0, 10.0, 0.0, 10.0) == pytest.approx(11.0)
+    # Entry and exit at cruise speed:
+    assert trapezoid_time(30.0, 10.0, 10.0, 10.0, 10.0) == pytest.approx(3.0)
+    assert trapezoid_time(38.75, 5.0, 10.0, 0.0, 10.0) == pytest.approx(0.5 + 3.0 + 1.0)
+
+
+def test_triangle():
+    # Cruise speed not reached, peak at sqrt(a * L):
+    peak = np.sqrt(10.0 * 4.0)
+    assert trapezoid_time(4.0, 0.0, 10.0, 0.0, 10.0) == pytest.approx(2 * peak / 10.0)
+    # Just reaches cruise speed:
+    assert trapezoid_time(10.0, 0.0, 10.0, 0.0, 10.0) == pytest.approx(2.0)
+
+
+def test_zero_length():
+    assert trapezoid_time(0.0, 0.0, 10.0, 0.0, 10.0) == 0.0
+
+
+@pytest.mark.parametrize("length, entry, cruise, exit", [(50.0, 0.0, 20.0, 0.0),
+                                                         (5.0, 2.0, 20.0, 4.0),
+                                                         (12.0, 6.0, 8.0, 1.0)])
+def test_profile_covers_the_length(length, entry, cruise, exit):
+    time = float(trapezoid_time(length, entry, cruise, exit, 10.0))
+    assert simulated_length(time, entry, cruise, exit, 10.0) == pytest.approx(length, rel=1e-3)
+
+
+def test_arrays():
+    lengths = np.array([100.0, 4.0, 0.0])
+    times = trapezoid_time(lengths, 0.0, 10.0, 0.0, 10.0)
+    assert times.shape == (3,)
+    for length, time in zip(lengths, times):
+        assert time == pytest.approx(trapezoid_time(length, 0.0, 10.0, 0.0, 10.0))
+    speeds = np.array([[5.0], [10.0]])
+    assert trapezoid_time(lengths, speeds, 10.0, speeds, 10.0).shape == (2, 3)
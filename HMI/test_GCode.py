@@ -0,0 +1,68 @@
+import pytest
+from GCode import (GCodeError, parse_line, parse_lines, parse_file, interpret,
+                   MOTION, DISTANCE, AXIS, FEED, POINT, NON_MODAL, LINE_NUMBER)
+
+
+def test_words_and_groups():
+    block = parse_line("n10 g1 g91 x-1.5 Y.25 a1=+30 f2000 ; comment X5", 7)
+    assert block.line == 7
+    assert block.words == (("N", 10.0, LINE_NUMBER),
+                           ("G", 1.0, MOTION),
+                           ("G", 91.0, DISTANCE),
+                           ("X", -1.5, AXIS),
+                           ("Y", 0.25, AXIS),
+                           ("A1", 30.0, AXIS),
+                           ("F", 2000.0, FEED))
+
+
+def test_points_and_wait():
+    assert parse_line("P=3").words == (("P=", 3.0, POINT),)
+    assert parse_line("P(12)").words == (("P(", 12.0, POINT),)
+    assert parse_line("G4.2.5").words == (("G4.", 2.5, NON_MODAL),)
+
+
+def test_empty_lines_are_skipped():
+    blocks = list(parse_lines(["G90", "", "  ; only a comment", "X1"], start=5))
+    assert [block.line for block in blocks] == [5, 8]
+    assert parse_line("; nothing").words == ()
+
+
+@pytest.mark.parametrize("text, message", [
+    ("G1 X1 #", "unexpected '#'"),
+    ("P(3", "unbalanced bracket in 'P(3'"),
+    ("P=3)", "unbalanced bracket in 'P=3'"),
+    ("G2 X1", "unsupported G2"),
+    ("Q5", "unsupported word 'Q'"),
+    ("A4=1", "unsupported word 'A'"),
+    ("G0 G1", "more than one word of 'motion' group"),
+    ("G90 G91", "more than one word of 'distance' group"),
+    ("X1 X2", "X programmed twice"),
+])
+def test_errors(text, message):
+    with pytest.raises(GCodeError) as error:
+        parse_line(text, 42)
+    assert error.value.line == 42
+    assert error.value.message == message
+    assert str(error.value) == "Line 42: " + message
+
+
+def test_error_line_in_file(tmp_path):
+    path = tmp_path / "program.gcode"
+    path.write_text("G90\nX1 Y2\n\nG1 X3 X4\nX5\n")
+    blocks = parse_file(str(path))
+    assert next(blocks).line == 1
+    assert next(blocks).line == 2
+    with pytest.raises(GCodeError) as error:
+        next(blocks)
+    assert error.value.line == 4
+
+
+def test_interpret_modal_state():
+    motion = interpret(parse_line("G91 G1 X2 A3=5"), True, False)
+    assert not motion.is_absolute
+    assert motion.is_linear
+    assert motion.xy == {"X": 2.0}
+    assert motion.joints == {"A3": 5.0}
+    assert motion.end({"X": 1.0, "Y": 3.0}) == {"X": 3.0, "Y": 3.0}
+    # A1 and A2 win over X and Y:
+    assert interpret(parse_line("X1 A1=10 A2=20"), True, False).xy is None
@@ -0,0 +1,103 @@
+import threading
+import time
+from types import SimpleNamespace
+import HMI
+from Notifier import ChangeNotifier
+
+
+def counter(notifier, topics=ChangeNotifier.TOPICS):
+    calls = dict.fromkeys(topics, 0)
+    for topic in topics:
+        def callback(topic=topic):
+            calls[topic] = calls[topic] + 1
+        notifier.subscribe(topic, callback)
+    return calls
+
+
+def test_changes_are_dispatched_once():
+    notifier = ChangeNotifier()
+    calls = counter(notifier)
+    for _ in range(100):
+        notifier.publish(notifier.POSITION)
+    notifier.publish(notifier.FEED)
+    assert notifier.dispatch() == {notifier.POSITION, notifier.FEED}
+    assert calls[notifier.POSITION] == calls[notifier.FEED] == 1
+    # Nothing changed since:
+    assert notifier.dispatch() == set()
+    assert notifier.dispatched == 2
+
+
+def test_other_topics_wait():
+    notifier = ChangeNotifier()
+    calls = counter(notifier)
+    notifier.publish(notifier.POSITION)
+    notifier.publish(notifier.CONNECTED)
+    assert notifier.dispatch([notifier.CONNECTED]) == {notifier.CONNECTED}
+    assert calls[notifier.POSITION] == 0
+    assert notifier.dispatch() == {notifier.POSITION}
+
+
+def test_publish_all():
+    notifier = ChangeNotifier()
+    calls = counter(notifier)
+    notifier.publish_all()
+    notifier.dispatch()
+    assert set(calls.values()) == {1}
+
+
+def test_changes_from_other_threads_are_not_lost():
+    notifier = ChangeNotifier()
+    calls = counter(notifier)
+    stop = threading.Event()
+
+    def publisher(topic):
+        while not stop.is_set():
+            notifier.publish(topic)
+
+    threads = [threading.Thread(target=publisher, args=(topic,)) for topic in notifier.TOPICS]
+    for thread in threads:
+        thread.start()
+    for _ in range(200):
+        notifier.dispatch()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    notifier.dispatch()
+    # The last change of each topic is shown, at most once per dispatch:
+    assert all(1 <= count <= 201 for count in calls.values())
+    assert notifier.dispatch() == set()
+
+
+# Application.display() of a homed scara without the window:
+def application(homed=True):
+    notifier = ChangeNotifier()
+    scara = SimpleNamespace(homed=homed, notifier=notifier, executed_line=0, update_position=lambda: None)
+    app = SimpleNamespace(scara=scara, refreshed=0.0, REFRESH_INTERVAL=HMI.Application.REFRESH_INTERVAL,
+                          program_control=SimpleNamespace(refresh=lambda: None),
+                          toolpath=SimpleNamespace(show_line=lambda line: None))
+    return app, HMI.Application.display
+
+
+def test_refresh_rate_is_capped():
+    app, display = application()
+    calls = counter(app.scara.notifier)
+    started = time.monotonic()
+    while time.monotonic() - started < 0.3:
+        app.scara.notifier.publish(ChangeNotifier.POSITION)
+        display(app)
+    # At most 20 per second, whatever the timer and publish rate:
+    assert 2 <= calls[ChangeNotifier.POSITION] <= 0.3 / app.REFRESH_INTERVAL + 1
+
+
+def test_only_connection_is_shown_before_homing():
+    app, display = application(homed=False)
+    calls = counter(app.scara.notifier)
+    app.scara.notifier.publish_all()
+    display(app)
+    assert calls[ChangeNotifier.CONNECTED] == 1
+    assert calls[ChangeNotifier.POSITION] == 0
+    # Shown once homed:
+    app.scara.homed = True
+    app.refreshed = 0.0
+    display(app)
+    assert set(calls.values()) == {1}
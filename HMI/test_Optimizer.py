@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+from Firmware import Firmware
+from Optimizer import PacketOptimizer
+
+
+def displacement(z=0.0, a1=0.0, a2=0.0):
+    return {"Z": z, "A1": a1, "A2": a2, "A3": 0.0}
+
+
+def optimize(items, optimizer=None):
+    optimizer = PacketOptimizer() if optimizer is None else optimizer
+    released = []
+    for packet, tag in items:
+        released.extend(optimizer.push(packet, tag))
+    return released + optimizer.flush()
+
+
+FEED = ['F', 10.0, 20.0, 30.0, 1.0]
+
+
+def test_collinear_moves_are_merged():
+    items = [(['G', 1.0, 2.0, 0.0, 0.0], (line, displacement(0.1, 0.2))) for line in range(1, 4)]
+    [(packet, (line, moved))] = optimize(items)
+    assert packet == ['G', 3.0, 6.0, 0.0, 0.0]
+    # The last line, the sum of displacements:
+    assert line == 3
+    assert moved == pytest.approx(displacement(0.3, 0.6))
+
+
+def test_corners_are_kept():
+    items = [(['G', 10.0, 0.0, 0.0, 0.0], None), (['G', 0.0, 10.0, 0.0, 0.0], None)]
+    assert [packet for packet, _ in optimize(items)] == [items[0][0], items[1][0]]
+    # Within the tolerance:
+    items = [(['G', 10.0, 0.0, 0.0, 0.0], None), (['G', 10.0, 0.1, 0.0, 0.0], None)]
+    assert [packet for packet, _ in optimize(items)] == [['G', 20.0, 0.1, 0.0, 0.0]]
+    # Back and forth isn't a line:
+    items = [(['G', 10.0, 0.0, 0.0, 0.0], None), (['G', -5.0, 0.0, 0.0, 0.0], None)]
+    assert len(optimize(items)) == 2
+    items = [(['G', 10.0, 0.0, 0.0, 0.0], None), (['G', -10.0, 0.0, 0.0, 0.0], None)]
+    assert [packet for packet, _ in optimize(items)] == [items[0][0], items[1][0]]
+    # Nor without merging:
+    items = [(['G', 1.0, 2.0, 0.0, 0.0], None)] * 3
+    assert len(optimize(items, PacketOptimizer(merge_moves=False))) == 3
+
+
+def test_merged_values_stay_encodable():
+    items = [(['G', PacketOptimizer.MAX_VALUE * 0.6, 0.0, 0.0, 0.0], None)] * 2
+    assert len(optimize(items)) == 2
+
+
+def test_zero_moves_carry_their_displacement():
+    items = [(['G', 0.0, 0.0, 0.0, 0.0], (1, displacement(z=0.01))),
+             (['G', 5.0, 0.0, 0.0, 0.0], (2, displacement(z=1.0))),
+             (['W', 1.0], (3, None)),
+             (['G', 0.0, 0.0, 0.0, 0.0], (4, displacement(a1=0.02)))]
+    optimizer = PacketOptimizer()
+    released = optimize(items, optimizer)
+    assert [packet for packet, _ in released] == [['G', 5.0, 0.0, 0.0, 0.0], ['W', 1.0], ['G', 0.0, 0.0, 0.0, 0.0]]
+    assert released[0][1][0] == 2
+    assert released[0][1][1] == pytest.approx(displacement(z=1.01))
+    # Nothing is lost at the end:
+    assert released[2][1] == (4, displacement(a1=0.02))
+    assert optimizer.dropped_moves == 2
+
+
+def test_feeds_are_released_before_their_moves():
+    move = ['G', 1.0, 0.0, 0.0, 0.0]
+    other = ['F', 5.0, 5.0, 5.0, 1.0]
+    packets = [FEED, other, move, move, FEED, move, FEED, move]
+    optimizer = PacketOptimizer()
+    released = optimize([(packet, (line, None)) for line, packet in enumerate(packets, 1)], optimizer)
+    # Overwritten before any move: only the second, the same feed again: dropped:
+    assert released == [(other, (2, None)), (['G', 2.0, 0.0, 0.0, 0.0], (4, None)),
+                        (FEED, (5, None)), (['G', 2.0, 0.0, 0.0, 0.0], (8, None))]
+    assert optimizer.dropped_feeds == 2
+    # A trailing feed is sent, unless it's the current one:
+    assert optimize([(FEED, None)], optimizer) == []
+    assert optimize([(other, None)], optimizer) == [(other, None)]
+    # Cleared: sent again:
+    optimizer.clear()
+    assert optimize([(other, None), (move, None)], optimizer) == [(other, None), (move, None)]
+
+
+def test_waits_are_merged_up_to_the_loop_counter():
+    released = optimize([(['W', 10.0], (line, None)) for line in range(1, 6)])
+    # 100 steps each, 255 at most:
+    assert released == [(['W', 20.0], (2, None)), (['W', 20.0], (4, None)), (['W', 10.0], (5, None))]
+    assert all(Firmware.wait_steps(packet[1]) <= Firmware.MAX_WAIT_STEPS for packet, _ in released)
+
+
+def test_other_packets_keep_their_place():
+    items = [(['G', 1.0, 0.0, 0.0, 0.0], 1), (['M', 1.0], 2), (['G', 1.0, 0.0, 0.0, 0.0], 3), (['W', 0.5], 4),
+             (['M', 0.0], 5), (['W', 0.5], 6)]
+    assert optimize(items) == items
+
+
+def test_motion_and_time_are_kept():
+    generator = np.random.default_rng(1)
+    items = [(FEED, None)]
+    for _ in range(500):
+        direction = generator.choice([-1.0, 1.0], 4) * [1.0, 1.0, 0.0, 0.0]
+        for _ in range(generator.integers(1, 6)):
+            items.append((['G'] + [round(float(value), 1) for value in direction * generator.uniform(0.5, 2.0)],
+                          None))
+        if generator.random() < 0.1:
+            items.append((['W', 0.05], None))
+    optimizer = PacketOptimizer()
+    released = optimize(items, optimizer)
+    assert len(released) < 0.6 * len(items)
+
+    def total(packets):
+        return np.sum([packet[1:] for packet, _ in packets if packet[0] == 'G'], axis=0)
+
+    # Merged values are rounded once per packet:
+    np.testing.assert_allclose(total(released), total(items), atol=0.05 * len(released))
+    assert optimizer.packets_out == len(released)
+    assert optimizer.bytes_out < optimizer.bytes_in
@@ -0,0 +1,143 @@
+import os
+import random
+import pytest
+import Parallel
+from GCode import GCodeError, parse_file
+from Parallel import ParallelConverter, conversion_state, detached, machine, same_state
+from Validator import ProgramValidator
+
+CHUNK_SIZE = 4096
+WARMUP = 512
+
+
+def home(scara):
+    scara.target_position.update({"Z": scara.min_range["Z"], "A1": scara.max_range["A1"],
+                                  "A2": scara.min_range["A2"], "A3": 0.0})
+    scara.current_position.update(scara.target_position)
+
+
+# Moves, lines, feeds, waits, points and incremental parts, mostly absolute:
+def program_lines(count, seed=1):
+    generator = random.Random(seed)
+    lines = ["G90 F1500", "X150 Y20 Z10", "P=1"]
+    taught = [1]
+    while len(lines) < count:
+        kind = generator.random()
+        if kind < 0.5:
+            lines.append("X{:.3f} Y{:.3f} Z{:.1f}".format(generator.uniform(120, 190), generator.uniform(-50, 50),
+                                                          generator.uniform(0, 30)))
+        elif kind < 0.65:
+            lines += ["G1 X{:.3f} Y{:.3f}".format(generator.uniform(130, 180), generator.uniform(-40, 40)), "G0"]
+        elif kind < 0.75:
+            lines += ["G91 X0.3 Y-0.2 Z0.1", "G90"]
+        elif kind < 0.85:
+            lines.append("A1={:.2f} A2={:.2f}".format(generator.uniform(-100, 100), generator.uniform(-130, 130)))
+        elif kind < 0.9:
+            lines.append("F{}".format(generator.choice([500, 1500, 3000])))
+        elif kind < 0.92:
+            # Taught on the way, recalled later, also from other chunks:
+            taught.append(generator.randint(2, 20))
+            lines.append("P={}".format(taught[-1]))
+        elif kind < 0.97:
+            lines.append("P({})".format(generator.choice(taught)))
+        else:
+            lines.append("G4.0.1")
+    return lines
+
+
+def write_program(tmp_path, lines):
+    path = tmp_path / "program.gcode"
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def serial_packets(scara, path):
+    return [(block.line, packet, displacement)
+            for block in parse_file(path)
+            for packet, displacement in scara.convert(block)]
+
+
+# Packets of ParallelConverter.packets(), without the Nones of chunks not done yet:
+def parallel_packets(converter, path):
+    return [item for item in converter.packets(path) if item is not None]
+
+
+def assert_same_packets(parallel, serial):
+    assert len(parallel) == len(serial)
+    for (line, packet, displacement), (serial_line, serial_packet, serial_displacement) in zip(parallel, serial):
+        assert line == serial_line
+        assert packet == serial_packet
+        assert same_state(displacement, serial_displacement, 1e-6)
+
+
+def test_same_state():
+    assert same_state({"A1": [1.0, 2]}, {"A1": (1.0 + 1e-12, 2)})
+    assert not same_state({"A1": 1.0}, {"A1": 1.0 + 1e-6})
+    assert not same_state({"A1": 1.0}, {"A2": 1.0})
+    assert not same_state(1.0, None)
+
+
+@pytest.fixture
+def converter(scara):
+    home(scara)
+    with ParallelConverter(detached(scara), processes=2, chunk_size=CHUNK_SIZE, warmup=WARMUP) as converter:
+        yield converter
+
+
+def test_packets_equal_serial(scara, converter, tmp_path):
+    path = write_program(tmp_path, program_lines(2000))
+    serial = serial_packets(scara, path)
+    assert_same_packets(parallel_packets(converter, path), serial)
+    assert converter.chunks > 4
+    # Left in the same state, rounding carried over the whole program:
+    assert same_state(converter.scara.target_position, scara.target_position)
+    assert same_state(converter.scara.rounding_error, scara.rounding_error)
+    assert converter.scara.is_linear == scara.is_linear
+    assert converter.scara.feed == scara.feed
+
+
+def test_incremental_program_is_started_again(scara, converter, tmp_path):
+    # The state at a chunk can't be guessed from the lines before it:
+    lines = ["G90 F1500", "X150 Y20 Z10", "G91"] + ["X0.01 Y-0.01 Z0.001"] * 800
+    path = write_program(tmp_path, lines)
+    assert_same_packets(parallel_packets(converter, path), serial_packets(scara, path))
+    assert converter.reruns > 0
+
+
+def test_error_line(scara, converter, tmp_path):
+    lines = program_lines(1500)
+    lines[1200] = "G1 X150 Q12"
+    path = write_program(tmp_path, lines)
+    with pytest.raises(GCodeError) as serial_error:
+        serial_packets(scara, path)
+    with pytest.raises(GCodeError) as parallel_error:
+        parallel_packets(converter, path)
+    assert parallel_error.value.line == serial_error.value.line == 1201
+    assert str(parallel_error.value) == str(serial_error.value)
+
+
+def test_violations_equal_serial(scara, converter, tmp_path):
+    lines = program_lines(1500)
+    for line, text in ((100, "X500 Y0"), (700, "Z200"), (1300, "P(7)"), (1400, "Q12")):
+        lines[line] = text
+    path = write_program(tmp_path, lines)
+    serial = [str(error) for error in ProgramValidator(scara).validate_file(path)]
+    assert len(serial) >= 4
+    assert [str(error) for error in converter.validate_file(path)] == serial
+
+
+def test_chunk_values_are_the_planned_ones(scara, tmp_path):
+    path = write_program(tmp_path, program_lines(400))
+    home(scara)
+    settings = machine(scara)
+    state = conversion_state(scara)
+    # Motor values the serial conversion rounds, P() from the steps of the point:
+    planned = scara.move_steps = []
+    serial_packets(scara, path)
+    scara.move_steps = None
+
+    Parallel._initialize()
+    result = Parallel._convert_chunk(path, 0, os.path.getsize(path), 0, settings, state, True)
+    moves = [code == "G" for code in result["codes"]]
+    assert result["error"] is None
+    assert result["values"][moves].tolist() == planned
@@ -0,0 +1,95 @@
+import math
+import pytest
+from Planner import MotionPlanner
+
+
+SPEED = 300.0           # DEFAULT_SPEED [deg/s]
+ACCELERATION = MotionPlanner.ACCELERATION
+
+
+def move(z=0.0, a1=0.0, a2=0.0):
+    return ['G', z, a1, a2, 0.0]
+
+
+# (entry, speed, exit) of the released 'T' packets, single axis moves are not scaled:
+def profiles(released):
+    return [packet[-4:-1] for packet, tag in released if packet[0] == 'T']
+
+
+def plan(packets, **settings):
+    planner = MotionPlanner(emit_profiles=True, **settings)
+    released = []
+    for packet in packets:
+        released.extend(planner.push(packet))
+    released.extend(planner.flush())
+    return profiles(released)
+
+
+def test_collinear_moves_keep_their_speed():
+    (first, second) = plan([move(a1=100.0), move(a1=100.0)])
+    assert first == [0.0, SPEED, SPEED]
+    assert second == [SPEED, SPEED, 0.0]
+
+
+def test_reversing_moves_stop():
+    (first, second) = plan([move(a1=100.0), move(a1=-100.0)])
+    assert first[2] == second[0] == 0.0
+
+
+def test_corner_junction_deviation():
+    (first, second) = plan([move(a1=100.0), move(a2=100.0)])
+    sin_half = math.sqrt(0.5)
+    speed = math.sqrt(ACCELERATION * MotionPlanner.JUNCTION_DEVIATION * sin_half / (1.0 - sin_half))
+    assert first[2] == second[0] == pytest.approx(speed, abs=0.05)
+
+
+def test_motion_decelerates_to_zero_at_the_end():
+    # Short moves, the last ones are limited by the stop:
+    planned = plan([move(a1=1.0)] * 40, lookahead=8)
+    assert len(planned) == 40
+    assert planned[0][0] == 0.0
+    assert planned[-1][2] == 0.0
+    for (entry, speed, exit), (next_entry, _, _) in zip(planned, planned[1:]):
+        assert exit == next_entry
+    for count, (entry, speed, exit) in enumerate(reversed(planned)):
+        # Reachable from the entry, and the stop from the exit, within 1 deg per move
+        # (profiles are rounded to 0.1):
+        assert abs(exit * exit - entry * entry) <= 2 * ACCELERATION * 1.0 + 0.1 * (entry + exit)
+        assert entry <= math.sqrt(2 * ACCELERATION * (count + 1)) + 0.05
+    # Never faster than it can stop within the look-ahead:
+    assert max(entry for entry, _, _ in planned) == round(math.sqrt(2 * ACCELERATION * 8), 1)
+
+
+def test_waits_stop_the_motion():
+    planned = plan([move(a1=100.0), ['W', 1.0], move(a1=100.0)])
+    assert planned[0][2] == 0.0
+    assert planned[1][0] == 0.0
+
+
+def test_feed_changes_the_speed():
+    planned = plan([['F', 100.0, 100.0, 100.0], move(a1=100.0), move(z=100.0)])
+    assert [speed for _, speed, _ in planned] == [2 * SPEED, 2 * SPEED]
+
+
+def test_lookahead_holds_moves_back():
+    planner = MotionPlanner(lookahead=4)
+    released = []
+    for number in range(10):
+        released.extend(planner.push(move(a1=10.0), number))
+    assert [tag for packet, tag in released] == list(range(6))
+
+
+def test_flush_releases_every_pending_packet():
+    planner = MotionPlanner()
+    packets = [['F', 100.0, 100.0, 100.0], move(a1=10.0), ['W', 0.5], move(z=5.0), move(), ['M', 1.0], move(a2=3.0)]
+    released = []
+    for number, packet in enumerate(packets):
+        released.extend(planner.push(packet, number))
+    assert released == []
+    released = planner.flush()
+    # In order with their tags, the empty move too:
+    assert released == [(packet, number) for number, packet in enumerate(packets)]
+    assert (len(planner.queue), planner.moves) == (0, 0)
+    assert planner.flush() == []
+    assert planner.planned_time > 0.0
+    assert planner.stop_time >= planner.planned_time
@@ -0,0 +1,85 @@
+import json
+import os
+import pytest
+import Points
+from GCode import GCodeError, parse_line
+from Points import PointTable
+
+
+POSITION = {"Z": 20.0, "A1": 30.0, "A2": -60.0, "A3": 0.0}
+
+
+def convert(scara, text):
+    return list(scara.convert(parse_line(text)))
+
+
+def test_recalled_point_is_the_saved_position(scara):
+    points = scara.points
+    points.save(1, POSITION)
+    assert points.get(1)["elbow"] == -1
+    entry = points.recall(1)
+    assert entry["position"] == pytest.approx(POSITION)
+    assert entry["steps"] == pytest.approx(scara.motor_values(POSITION))
+    # Cached:
+    assert points.recall(1) is entry
+
+
+def test_cache_is_dropped_when_parameters_change(scara):
+    points = scara.points
+    points.save(1, POSITION)
+    entry = points.recall(1)
+    scara.reduction = dict(scara.reduction, Z=scara.reduction["Z"] * 2)
+    assert points.recall(1) is not entry
+    assert points.recall(1)["steps"]["Z"] == pytest.approx(2 * entry["steps"]["Z"])
+    # Out of the new range:
+    scara.max_range = dict(scara.max_range, A1=20.0)
+    assert points.recall(1) is None
+    assert points.recall(2) is None
+
+
+def test_points_are_written_on_flush(scara, tmp_path):
+    path = str(tmp_path / "points.json")
+    points = PointTable(scara, path)
+    points.save(1, POSITION)
+    points.save(2, dict(POSITION, A2=45.0))
+    assert not os.path.exists(path)
+    points.flush()
+    assert sorted(os.listdir(str(tmp_path))) == ["points.json"]
+
+    loaded = PointTable(scara, path)
+    loaded.load()
+    assert loaded.numbers() == [1, 2]
+    assert loaded.points == points.points
+    assert loaded.recall(2)["position"] == pytest.approx(dict(POSITION, A2=45.0))
+
+    # Nothing changed, nothing written:
+    os.remove(path)
+    loaded.flush()
+    assert not os.path.exists(path)
+    loaded.delete(1)
+    loaded.flush()
+    with open(path) as file:
+        assert list(json.load(file)) == ["2"]
+
+
+def test_missing_file_is_an_empty_table(scara, tmp_path):
+    points = PointTable(scara, str(tmp_path / "points.json"))
+    points.load()
+    assert len(points) == 0
+    assert not points.changed
+
+
+def test_program_saves_and_recalls_points(scara, tmp_path):
+    scara.points.path = str(tmp_path / "points.json")
+    scara.target_position.update(POSITION)
+    scara.g_code("P=3\nG0 X150 Y20 Z5\nP(3)")
+    assert scara.target_position == pytest.approx(POSITION)
+    # Written at the end of the program:
+    with open(scara.points.path) as file:
+        assert list(json.load(file)) == ["3"]
+    with pytest.raises(GCodeError, match="point 7 not defined"):
+        convert(scara, "P(7)")
+
+
+def test_path_is_next_to_the_module():
+    assert os.path.dirname(PointTable.PATH) == os.path.dirname(os.path.abspath(Points.__file__))
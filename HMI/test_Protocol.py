@@ -0,0 +1,125 @@
+import pytest
+from Protocol import (SYNC, SCALE, VALUE_SIZE, MAX_VALUES, REJECTED, ProtocolError, Decoder,
+                      crc16, encode_frame, encode_text, decode_frame)
+
+
+# _crc_xmodem_update() of avr-libc (util/crc16.h):
+def crc_xmodem_update(crc, data):
+    crc = crc ^ (data << 8)
+    for _ in range(8):
+        crc = (crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1
+    return crc & 0xffff
+
+
+# receive_frame() of AVR/USART.c, frame - bytes after SYNC,
+# returns: (opcode, values) or ('0', None) if rejected:
+def receive_frame(frame, max_values=MAX_VALUES):
+    data = iter(frame)
+    opcode = next(data)
+    length = next(data)
+    crc = crc_xmodem_update(0xFFFF, opcode)
+    crc = crc_xmodem_update(crc, length)
+
+    count = length // VALUE_SIZE
+    if count > max_values or length % VALUE_SIZE:
+        return '0', None
+
+    values = []
+    for _ in range(count):
+        value = 0
+        for j in range(VALUE_SIZE):
+            byte = next(data)
+            crc = crc_xmodem_update(crc, byte)
+            value |= byte << (8 * j)
+        if value & 0x800000:
+            value -= 1 << 24
+        values.append(value / SCALE)
+
+    received_crc = next(data)
+    received_crc |= next(data) << 8
+    if received_crc != crc:
+        return '0', None
+    return chr(opcode), values
+
+
+PACKETS = [['G', 1.25, -3.5, 0.0, 123.45],
+           ['F', 100.0, 200.0, 300.0, 400.0],
+           ['W', 2.5],
+           ['M'],
+           ['T', -83886.08, 83886.07, 0.01, -0.01, 1.0, 2.0, 3.0, 4.0]]
+
+
+def test_crc_matches_firmware():
+    assert crc16(b"123456789") == 0x29B1         # CRC-16/CCITT-FALSE check value
+    for data in (b"", b"\x00", b"\xff" * 7, bytes(range(256))):
+        crc = 0xFFFF
+        for byte in data:
+            crc = crc_xmodem_update(crc, byte)
+        assert crc16(data) == crc
+
+
+@pytest.mark.parametrize("packet", PACKETS)
+def test_firmware_accepts_frames(packet):
+    frame = encode_frame(packet)
+    assert frame[0] == SYNC
+    assert len(frame) == 3 + VALUE_SIZE * (len(packet) - 1) + 2
+    opcode, values = receive_frame(frame[1:])
+    assert opcode == packet[0]
+    assert values == pytest.approx(packet[1:], abs=0.5 / SCALE)
+
+
+@pytest.mark.parametrize("packet", PACKETS)
+def test_decode_round_trip(packet):
+    assert decode_frame(encode_frame(packet)) == pytest.approx(packet, abs=0.5 / SCALE)
+
+
+def test_values_are_rounded():
+    assert decode_frame(encode_frame(['W', 0.126])) == ['W', 0.13]
+    assert decode_frame(encode_frame(['W', -0.124])) == ['W', -0.12]
+
+
+def test_corrupted_frames_are_rejected():
+    frame = bytearray(encode_frame(PACKETS[0]))
+    for i in range(3, len(frame)):
+        corrupted = bytearray(frame)
+        corrupted[i] ^= 0x10
+        assert receive_frame(corrupted[1:]) == ('0', None)
+        with pytest.raises(ProtocolError):
+            decode_frame(corrupted)
+
+
+def test_encode_errors():
+    with pytest.raises(ProtocolError):
+        encode_frame(['G', 83886.08])
+    with pytest.raises(ProtocolError):
+        encode_frame(['T'] + [0.0] * (MAX_VALUES + 1))
+
+
+def test_decoder_resynchronizes():
+    decoder = Decoder()
+    data = b"\x00" + encode_frame(PACKETS[0]) + encode_text(['W', 1.5]) + encode_frame(PACKETS[3])
+    # Byte by byte, as the firmware receives it:
+    packets = []
+    for i in range(len(data)):
+        packets += decoder.feed(data[i:i + 1])
+    assert packets == [pytest.approx(PACKETS[0]), ['W', 1.5], ['M']]
+    assert decoder.discarded == 1
+
+
+def test_decoder_rejects_like_the_firmware():
+    decoder = Decoder()
+    frame = bytearray(encode_frame(PACKETS[0]))
+    frame[5] ^= 0x01
+    # The rest of the data is dropped, like discard() in menu():
+    assert decoder.feed(bytes(frame) + encode_frame(PACKETS[2])) == [[REJECTED]]
+    assert decoder.feed(encode_frame(PACKETS[2])) == [PACKETS[2]]
+    assert decoder.rejected == 1
+    assert receive_frame(frame[1:]) == (REJECTED, None)
+
+
+def test_decoder_rejects_wrong_length_at_once():
+    decoder = Decoder()
+    # Not a multiple of VALUE_SIZE, the firmware doesn't wait for the values:
+    assert decoder.feed(bytes([SYNC, ord('G'), 4])) == [[REJECTED]]
+    assert decoder.feed(bytes([SYNC, ord('T'), VALUE_SIZE * (MAX_VALUES + 1)])) == [[REJECTED]]
+    assert receive_frame(bytes([ord('G'), 4])) == (REJECTED, None)
@@ -0,0 +1,116 @@
+import pytest
+from Communication import Communication
+from Controller import VirtualController
+from GCode import GCodeError, parse_file
+from Protocol import BINARY
+from Runner import ProgramRunner
+
+
+def connect(scara, slots=4):
+    controller = VirtualController(slots=slots)
+    scara.communication = Communication(protocol=BINARY, window=slots, slots=slots, notifier=scara.notifier)
+    scara.communication.serial_port = controller
+    scara.communication.connected = True
+    scara.communication.ready = True
+    scara.homed = True
+    scara.target_position.update({"Z": 0.0, "A1": 0.0, "A2": 90.0, "A3": 0.0})
+    scara.current_position.update(scara.target_position)
+    return controller
+
+
+def write_program(tmp_path, count=300, error=None):
+    lines = ["G90 F1500"]
+    for i in range(count):
+        lines.append("X{:.2f} Y{:.2f} Z{:.1f}".format(140 + i % 40, -30 + i % 60, i % 20))
+    if error is not None:
+        lines[error - 1] = "G1 X150 Q12"
+    path = tmp_path / "program.gcode"
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+# Steps the runner like the GUI timer, the controller answers in between:
+def run(runner, steps=10000):
+    communication = runner.scara.communication
+    for _ in range(steps):
+        if not runner.running:
+            break
+        communication.ready_check()
+        communication.send()
+        runner.step()
+        assert len(runner.prepared) <= runner.lookahead
+        assert communication.outstanding() <= communication.window + runner.QUEUED
+
+
+def test_program_runs_to_the_end(scara, tmp_path):
+    controller = connect(scara)
+    path = write_program(tmp_path)
+    expected = [packet for block in parse_file(path) for packet, _ in scara.convert(block)]
+    scara.reset_target()
+    scara.rounding_error.update(dict.fromkeys(scara.axes_names, 0.0))
+    scara.feed = 0
+
+    runner = ProgramRunner(scara, lookahead=8)
+    runner.load(path)
+    assert runner.start()
+    run(runner)
+    assert not runner.running and runner.error is None
+    assert controller.log == expected
+    assert scara.executed_line == 301
+    # Every move acknowledged:
+    assert scara.current_position == pytest.approx(scara.target_position)
+    assert scara.current_position["Z"] == pytest.approx(299 % 20)
+    assert scara.displacement == pytest.approx(dict.fromkeys(scara.axes_names, 0.0))
+
+
+def test_program_is_converted_lazily(scara, tmp_path):
+    connect(scara)
+    runner = ProgramRunner(scara, lookahead=8)
+    runner.load(write_program(tmp_path, 5000))
+    assert runner.start()
+    # Only the lookahead is converted, nothing is sent before the first step:
+    assert len(runner.prepared) == 8
+    assert scara.communication.is_idle()
+    runner.step()
+    assert scara.communication.outstanding() == scara.communication.window + runner.QUEUED
+    assert len(runner.prepared) == 8
+    assert runner.line < 20
+
+
+def test_error_line_stops_the_program(scara, tmp_path):
+    controller = connect(scara)
+    runner = ProgramRunner(scara)
+    runner.load(write_program(tmp_path, error=150))
+    runner.start()
+    run(runner)
+    assert isinstance(runner.error, GCodeError)
+    assert runner.error.line == 150
+    assert not runner.running
+    # Converted packets after the last dispatched one are dropped:
+    assert 0 < len(controller.log) <= 149
+    assert scara.executed_line == runner.line < 150
+
+
+def test_stop_forgets_planned_moves(scara, tmp_path):
+    connect(scara)
+    runner = ProgramRunner(scara, lookahead=8)
+    runner.load(write_program(tmp_path))
+    runner.start()
+    runner.step()
+    runner.stop()
+    assert runner.packets is None and not runner.prepared
+    # Only the dispatched moves are planned:
+    for name in scara.axes_names:
+        assert scara.target_position[name] == pytest.approx(scara.current_position[name] + scara.displacement[name])
+
+
+def test_not_started_before_homing(scara, tmp_path):
+    connect(scara)
+    scara.homed = False
+    runner = ProgramRunner(scara)
+    runner.load(write_program(tmp_path, 10))
+    assert not runner.start()
+    assert not runner.running
+    runner.path = None
+    scara.homed = True
+    assert not runner.start()
@@ -0,0 +1,161 @@
+import numpy as np
+import pytest
+from GCode import parse_line
+
+
+def random_angles(scara, count, elbow, seed=1):
+    generator = np.random.default_rng(seed)
+    a1 = generator.uniform(scara.min_range["A1"], scara.max_range["A1"], count)
+    # Away from the stretched arm, where the elbows meet:
+    a2 = elbow * generator.uniform(1.0, scara.max_range["A2"], count)
+    return np.column_stack([a1, a2])
+
+
+@pytest.mark.parametrize("elbow", [1, -1])
+def test_inverse_of_forward_kinematics(scara, elbow):
+    angles = random_angles(scara, 1000, elbow)
+    xy = scara.forward_kinematics_batch(angles)
+    result, reachable = scara.inverse_kinematics_batch(xy, elbow)
+    assert reachable.all()
+    np.testing.assert_allclose(result, angles, atol=1e-6)
+
+
+def test_batch_kinematics_match_single_points(scara):
+    angles = random_angles(scara, 20, 1)
+    xy = scara.forward_kinematics_batch(angles)
+    for (a1, a2), (x, y) in zip(angles, xy):
+        assert scara.forward_kinematics({"A1": a1, "A2": a2}) == pytest.approx({"X": x, "Y": y})
+        assert scara.inverse_kinematics({"X": x, "Y": y}, 1) == pytest.approx({"A1": a1, "A2": a2})
+
+
+def test_unreachable_points(scara):
+    reach = scara.l1 + scara.l2 + scara.current_tool["x_offset"]
+    xy = [[reach + 1.0, 0.0], [0.0, 0.0], [0.0, -reach]]
+    angles, reachable = scara.inverse_kinematics_batch(xy)
+    assert reachable.tolist() == [False, False, True]
+    assert np.isnan(angles[~reachable]).all()
+    assert scara.inverse_kinematics({"X": reach + 1.0, "Y": 0.0}) == {}
+
+
+# Distances [mm] of points from the line through start_xy and end_xy:
+def line_distances(points, start_xy, end_xy):
+    line = end_xy - start_xy
+    normal = np.array([-line[1], line[0]]) / np.hypot(line[0], line[1])
+    return np.abs((points - start_xy) @ normal)
+
+
+def test_linear_segments_stay_near_the_line(scara):
+    generator = np.random.default_rng(2)
+    lines = 0
+    for _ in range(100):
+        start = np.array([generator.uniform(-100, 100), generator.uniform(10, 130)])
+        end_xy = scara.forward_kinematics_batch([generator.uniform(-100, 100), generator.uniform(10, 130)])[0]
+        result = scara.linear_segments(end_xy, start)
+        if result is None:
+            continue
+        lines = lines + 1
+        angles, fractions = result
+        start_xy = scara.forward_kinematics_batch(start)[0]
+
+        assert len(angles) == len(fractions)
+        assert (np.diff(fractions) > 0).all()
+        assert fractions[-1] == 1.0
+        # Segment ends are on the line, at their fractions:
+        np.testing.assert_allclose(scara.forward_kinematics_batch(angles),
+                                   start_xy + fractions[:, None] * (end_xy - start_xy), atol=1e-6)
+        # Joints move linearly within a segment, checked at linear_resolution samples,
+        # between them the path may stray a bit further:
+        previous = start
+        for angle in angles:
+            fraction = np.linspace(0.0, 1.0, 50)[:, None]
+            path = scara.forward_kinematics_batch(previous + fraction * (angle - previous))
+            assert line_distances(path, start_xy, end_xy).max() <= scara.linear_tolerance + 0.005
+            previous = angle
+    assert lines > 50
+
+
+def test_linear_segments_tolerance(scara):
+    start = np.array([-60.0, 100.0])
+    end_xy = scara.forward_kinematics_batch([60.0, 40.0])[0]
+    count = len(scara.linear_segments(end_xy, start)[0])
+    scara.linear_tolerance = scara.linear_tolerance / 10
+    assert len(scara.linear_segments(end_xy, start)[0]) > count
+
+
+def test_linear_segments_outside_workspace(scara):
+    # Through the base, where the arm can't reach:
+    start = scara.inverse_kinematics({"X": 150.0, "Y": 1.0}, 1)
+    assert scara.linear_segments([-150.0, 1.0], [start["A1"], start["A2"]]) is None
+    # Short lines are a single segment:
+    xy = scara.forward_kinematics({"A1": 10.0, "A2": 20.0})
+    angles, fractions = scara.linear_segments([xy["X"] + 0.01, xy["Y"]], [10.0, 20.0])
+    assert len(angles) == 1
+    assert fractions.tolist() == [1.0]
+
+
+def test_linear_move_leaving_the_range_is_rejected_whole(scara):
+    list(scara.convert(parse_line("G0 X150 Y-60 Z10")))
+    start = dict(scara.target_position)
+    rounding_error = dict(scara.rounding_error)
+    # Z leaves the range half way, the first segments are in range:
+    assert list(scara.convert(parse_line("G1 X150 Y60 Z-10"))) == []
+    assert scara.target_position == start
+    assert scara.rounding_error == rounding_error
+    # Through the base, where the arm can't reach:
+    assert list(scara.convert(parse_line("X-150 Y-60 Z10"))) == []
+    assert scara.target_position == start
+
+    packets = list(scara.convert(parse_line("X150 Y60 Z5")))
+    assert len(packets) > 1
+    assert scara.target_position["Z"] == pytest.approx(5.0)
+
+
+# Time of the slower arm motor [deg / rpm], A2 motor turns with A1 too:
+def arm_time(scara, start, a1, a2, feeds):
+    motor_a1 = (a1 - start["A1"]) * scara.reduction["A1"]
+    motor_a2 = ((a2 - start["A2"]) * scara.reduction["A21"] + (a1 - start["A1"])) * scara.reduction["A2"]
+    return max(abs(motor_a1) / feeds["A1"], abs(motor_a2) / feeds["A2"])
+
+
+@pytest.mark.parametrize("elbow", [1, -1])
+def test_nearby_elbow_is_kept(scara, elbow):
+    scara.target_position.update({"A1": 30.0, "A2": elbow * 60.0})
+    xy = scara.forward_kinematics({"A1": 40.0, "A2": elbow * 50.0})
+    solutions = scara.inverse_kinematics_solutions(xy)
+    assert len(solutions) == 2
+    assert scara.fastest_solution(solutions) == pytest.approx({"A1": 40.0, "A2": elbow * 50.0})
+
+    list(scara.convert(parse_line("G0 X{X} Y{Y}".format(**xy))))
+    assert scara.target_position["A2"] == pytest.approx(elbow * 50.0)
+
+
+def test_fastest_solution_has_the_shortest_motor_time(scara):
+    generator = np.random.default_rng(3)
+    feeds = scara.axis_feeds(2000.0)
+    chosen = {1: 0, -1: 0}
+    for a1, a2 in random_angles(scara, 200, 1, seed=4):
+        start = {"Z": 0.0, "A1": generator.uniform(-100, 100), "A2": generator.uniform(-130, 130), "A3": 0.0}
+        xy = scara.forward_kinematics({"A1": a1, "A2": a2})
+        solutions = scara.inverse_kinematics_solutions(xy)
+        best = scara.fastest_solution(solutions, start, 2000.0)
+        times = [arm_time(scara, start, s1, s2, feeds) for s1, s2 in solutions]
+        assert arm_time(scara, start, best["A1"], best["A2"], feeds) == pytest.approx(min(times))
+        chosen[1 if best["A2"] >= 0 else -1] += 1
+    # Both elbows are used:
+    assert min(chosen.values()) > 20
+
+
+def test_fixed_elbow(scara):
+    xy = scara.forward_kinematics({"A1": 40.0, "A2": -50.0})
+    scara.elbow = scara.ELBOW_POSITIVE
+    solutions = scara.inverse_kinematics_solutions(xy)
+    assert len(solutions) == 1 and solutions[0][1] > 0
+    scara.elbow = scara.ELBOW_NEGATIVE
+    [solution] = scara.inverse_kinematics_solutions(xy)
+    assert solution == pytest.approx((40.0, -50.0))
+    # The other elbow is out of the A1 range:
+    scara.elbow = scara.ELBOW_FASTEST
+    xy = scara.forward_kinematics({"A1": -50.0, "A2": -100.0})
+    [solution] = scara.inverse_kinematics_solutions(xy)
+    assert solution == pytest.approx((-50.0, -100.0))
+    assert scara.fastest_solution([]) == {}
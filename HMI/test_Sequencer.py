@@ -0,0 +1,87 @@
+import itertools
+import numpy as np
+import pytest
+from Firmware import Firmware
+from GCode import parse_lines
+from Sequencer import PointSequencer, load_points
+
+
+def home(scara):
+    scara.target_position.update({"Z": scara.min_range["Z"], "A1": scara.max_range["A1"],
+                                  "A2": scara.min_range["A2"], "A3": 0.0})
+
+
+def random_points(count, seed=1):
+    generator = np.random.default_rng(seed)
+    radius = generator.uniform(80, 200, count)
+    angle = generator.uniform(-2.5, 2.5, count)
+    return np.column_stack([radius * np.cos(angle), radius * np.sin(angle), generator.uniform(0, 50, count)])
+
+
+def test_every_reachable_point_is_visited_once(scara):
+    home(scara)
+    points = np.vstack([random_points(300), [[500.0, 0.0, 10.0], [150.0, 0.0, 500.0]]])
+    result = PointSequencer(scara).sequence(points)
+    order = result["order"].tolist()
+    unreachable = result["unreachable"].tolist()
+    assert len(set(order)) == len(order) > 250
+    assert sorted(order + unreachable) == list(range(302))
+    assert unreachable[-2:] == [300, 301]
+    # Joints of the chosen elbows reach the points:
+    xy = scara.forward_kinematics_batch(result["joints"][:, 1:])
+    np.testing.assert_allclose(xy, points[result["order"], :2], atol=1e-6)
+    np.testing.assert_allclose(result["joints"][:, 0], points[result["order"], 2])
+    assert result["time"] <= result["nearest_neighbour_time"]
+
+
+def test_two_opt_uncrosses_the_path(scara):
+    # Start, then points on a line visited 2, 1, 3, 4:
+    path = np.array([[0.0], [2.0], [1.0], [3.0], [4.0]])
+    tour = PointSequencer(scara).two_opt(path)
+    assert tour.tolist() == [0, 2, 1, 3, 4]
+    assert PointSequencer.path_time(path[tour]) == 4.0
+
+
+def test_small_sequence_is_near_the_optimum(scara):
+    home(scara)
+    sequencer = PointSequencer(scara)
+    points = random_points(6, seed=5)
+    result = sequencer.sequence(points)
+
+    # All orders and elbows:
+    joints, indices = sequencer.configurations(points)
+    start = sequencer.scaled([scara.target_position[name] for name in ("Z", "A1", "A2")])
+    choices = [np.flatnonzero(indices == point) for point in range(len(points))]
+    best = np.inf
+    for order in itertools.permutations(range(len(points))):
+        for states in itertools.product(*[choices[point] for point in order]):
+            best = min(best, sequencer.path_time(np.vstack([start, sequencer.scaled(joints[list(states)])])))
+    assert result["time"] <= 1.1 * best
+
+
+def test_program_takes_the_sequenced_time(scara):
+    home(scara)
+    sequencer = PointSequencer(scara, feed=3000.0)
+    result = sequencer.sequence(random_points(50))
+    program = sequencer.program(result, dwell=0.004)
+    assert "e-" not in program
+    assert "G4." not in program
+
+    firmware = Firmware()
+    moves = 0.0
+    for block in parse_lines(program.splitlines()):
+        for packet, _ in scara.convert(block):
+            time = firmware.execute(packet)
+            if packet[0] == 'G':
+                moves = moves + (time or 0.0)
+    # Steps and motor speeds of the firmware are rounded:
+    assert moves == pytest.approx(result["time"], rel=0.01)
+
+    program = sequencer.program(result, dwell=0.5)
+    assert program.count("G4.0.50") == 50
+
+
+def test_load_points(tmp_path):
+    path = tmp_path / "points.txt"
+    path.write_text("150, 0, 10\n\n120 -30 5 extra\n")
+    np.testing.assert_array_equal(load_points(str(path)), [[150.0, 0.0, 10.0], [120.0, -30.0, 5.0]])
@@ -0,0 +1,114 @@
+import os
+import numpy as np
+import pytest
+from Toolpath import ToolpathPreview, downsample, simplify
+
+
+class SmallPreview(ToolpathPreview):
+    BLOCK = 64
+    LINES = 100
+    BLOCKS = 4
+    MAX_POINTS = 500
+
+
+def spiral(count):
+    t = np.linspace(0, 6 * np.pi, count)
+    return np.column_stack([150 + 3 * t * np.cos(t), 3 * t * np.sin(t)])
+
+
+def write_program(tmp_path, points):
+    lines = ["G90 G1 Z10"] + ["X{:.3f} Y{:.3f}".format(x, y) for x, y in points]
+    lines.insert(100, "G1 Q12")
+    path = tmp_path / "program.gcode"
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def load(scara, path, pixels=400):
+    preview = SmallPreview(scara, path, pixels)
+    while preview.step():
+        assert len(preview.overview) <= preview.MAX_POINTS
+    return preview
+
+
+def test_simplify_keeps_the_shape():
+    points = spiral(5000)
+    length = np.linalg.norm(np.diff(points, axis=0), axis=1).sum()
+    for tolerance in (0.1, 1.0, 5.0):
+        kept = simplify(points, tolerance)
+        assert len(kept) <= length / tolerance + 2
+        assert (kept[0] == points[0]).all() and (kept[-1] == points[-1]).all()
+        # Every point is near a kept one:
+        distance = np.linalg.norm(points[:, None, :] - kept[None, :, :], axis=2).min(axis=1)
+        assert distance.max() <= tolerance
+    assert len(simplify(points[:2], 100.0)) == 2
+
+
+def test_downsample_fits_the_count():
+    points, tolerance = downsample(spiral(5000), 0.01, 100)
+    assert len(points) <= 100
+    assert tolerance > 0.01
+    assert np.log2(tolerance / 0.01) == pytest.approx(round(np.log2(tolerance / 0.01)))
+
+
+@pytest.fixture
+def preview(scara, tmp_path):
+    scara.target_position.update({"Z": 0.0, "A1": 0.0, "A2": 90.0, "A3": 0.0})
+    preview = load(scara, write_program(tmp_path, spiral(1000)))
+    yield preview
+    preview.close()
+
+
+def test_program_is_loaded_in_steps(scara, preview):
+    assert preview.done
+    assert preview.line == 1002
+    # The start and a point for each move, the error line is skipped:
+    assert preview.count == 1 + 1000 + 1
+    np.testing.assert_allclose(preview.xy[2:], spiral(1000), atol=1e-3)
+    assert len(preview.boxes) == int(np.ceil(preview.count / SmallPreview.BLOCK))
+    for block, box in enumerate(preview.boxes):
+        points = preview.xy[block * SmallPreview.BLOCK:(block + 1) * SmallPreview.BLOCK + 1]
+        assert (points.min(axis=0) >= box[:2]).all() and (points.max(axis=0) <= box[2:]).all()
+
+
+def test_position_of_a_line(preview):
+    xy = spiral(1000)
+    # Line 2 is the first move, the error line 101 has no move of its own:
+    assert preview.position(2) == pytest.approx(xy[0], abs=1e-3)
+    assert preview.position(101) == pytest.approx(xy[98], abs=1e-3)
+    assert preview.position(102) == pytest.approx(xy[99], abs=1e-3)
+    assert preview.position(10 ** 6) == pytest.approx(xy[-1], abs=1e-3)
+
+
+def test_refine(preview):
+    def refined(box, tolerance):
+        steps = list(preview.refine(box, tolerance))
+        assert all(step is None for step in steps[:-1])
+        assert len(steps) - 1 == int(np.ceil(len(preview.boxes) / SmallPreview.BLOCKS))
+        return steps[-1]
+
+    # All of it, as fine as it can be drawn:
+    points = refined(preview.extent, 1e-6)
+    assert SmallPreview.MAX_POINTS // 4 < len(points) <= SmallPreview.MAX_POINTS
+    assert (points[0] == preview.xy[0]).all() and (points[-1] == preview.xy[-1]).all()
+    # Out of the path, only the ends of the blocks:
+    far = refined((-200.0, -200.0, -190.0, -190.0), 0.01)
+    assert len(far) == 2 * len(preview.boxes)
+    # A part of it is refined:
+    box = (140.0, -10.0, 160.0, 10.0)
+    near = refined(box, 0.01)
+    inside = (near[:, 0] >= box[0]) & (near[:, 0] <= box[2]) & (near[:, 1] >= box[1]) & (near[:, 1] <= box[3])
+    xy = spiral(1000)
+    assert inside.sum() >= ((xy[:, 0] >= box[0]) & (xy[:, 0] <= box[2]) & (xy[:, 1] >= box[1]) &
+                            (xy[:, 1] <= box[3])).sum() // 2
+
+
+def test_temporary_files_are_removed(scara, tmp_path):
+    path = write_program(tmp_path, spiral(300))
+    preview = SmallPreview(scara, path, 400)
+    preview.step()
+    directory = preview.directory
+    assert os.path.isdir(directory)
+    # Closed while loading:
+    preview.close()
+    assert not os.path.exists(directory)
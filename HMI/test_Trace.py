@@ -0,0 +1,117 @@
+import os
+import threading
+import Trace
+from Trace import DEBUG, ERROR, GCODE, GUI, INFO, MOTION, SERIAL, WARNING, Tracer, format_event, read_file
+
+
+class Counted:
+    # Counts how many times it's formatted:
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted = self.formatted + 1
+        return "counted"
+
+
+def texts(tracer):
+    return [Trace.event_text(event) for event in tracer.last()]
+
+
+def test_levels_and_categories():
+    tracer = Tracer(level=INFO, categories=(SERIAL, GCODE))
+    tracer.debug(SERIAL, "packet %s", 1)
+    tracer.info(SERIAL, "info")
+    tracer.warning(MOTION, "other category")
+    tracer.error(GCODE, "error %d", 2)
+    assert texts(tracer) == ["info", "error 2"]
+    assert not tracer.enabled(DEBUG, SERIAL)
+    tracer.set_level(DEBUG, (MOTION,))
+    tracer.debug(MOTION, "move")
+    tracer.info(SERIAL, "not any more")
+    assert texts(tracer)[-1] == "move"
+    assert tracer.recorded == 3
+
+
+def test_only_the_last_events_are_kept():
+    tracer = Tracer(capacity=10)
+    for i in range(25):
+        tracer.info(GUI, "event %d", i)
+    assert texts(tracer) == ["event {}".format(i) for i in range(15, 25)]
+    assert [Trace.event_text(event) for event in tracer.last(3)] == ["event 22", "event 23", "event 24"]
+    assert tracer.last(0) == []
+    assert tracer.recorded == 25
+    tracer.clear()
+    assert tracer.last() == []
+
+
+def test_events_are_formatted_only_when_dumped(tmp_path):
+    tracer = Tracer()
+    argument = Counted()
+    tracer.info(SERIAL, "packet %s", argument)
+    tracer.debug(SERIAL, "skipped %s", argument)
+    assert argument.formatted == 0
+    path = tmp_path / "dump.log"
+    assert tracer.dump(str(path)) == 1
+    assert argument.formatted == 1
+    line = path.read_text()
+    assert line.endswith("INFO    serial packet counted\n")
+    # Arguments that don't fit the message are shown too:
+    tracer.info(SERIAL, "packet %d", "text")
+    assert texts(tracer)[-1] == "packet %d text"
+
+
+def test_fault_dumps_the_last_events(tmp_path):
+    tracer = Tracer()
+    tracer.dump_path = str(tmp_path / "trace.log")
+    for i in range(Tracer.DUMP_COUNT + 100):
+        tracer.info(MOTION, "move %d", i)
+    tracer.fault(SERIAL, "link fault: %s", "timeout")
+    lines = (tmp_path / "trace.log").read_text().splitlines()
+    assert len(lines) == Tracer.DUMP_COUNT
+    assert lines[-1].endswith("ERROR   serial link fault: timeout")
+    assert tracer.dumps == 1
+    # Not dumped:
+    tracer.dump_path = None
+    tracer.fault(SERIAL, "again")
+    assert tracer.dumps == 1
+    # Unwritable path, the fault is still recorded:
+    tracer.dump_path = str(tmp_path / "missing" / "trace.log")
+    tracer.fault(SERIAL, "once more")
+    assert texts(tracer)[-1] == "once more"
+
+
+def test_binary_sink(tmp_path):
+    path = str(tmp_path / "trace.bin")
+    tracer = Tracer(level=DEBUG, categories=Trace.CATEGORIES + ("other",))
+    tracer.open_sink(path)
+    tracer.debug(SERIAL, "packet %s", ['G', 1.0])
+    tracer.warning(GCODE, "line %d", 7)
+    tracer.error("other", "unknown category")
+    tracer.close_sink()
+    tracer.info(GUI, "not written")
+    events = read_file(path)
+    assert [(level, category, text) for _, level, category, text, _ in events] == [
+        (DEBUG, SERIAL, "packet ['G', 1.0]"), (WARNING, GCODE, "line 7"), (ERROR, "255", "unknown category")]
+    assert [event[0] for event in events] == sorted(event[0] for event in events)
+    assert format_event(events[1]).split()[1:] == ["WARNING", "gcode", "line", "7"]
+
+
+def test_threads_record_every_event():
+    tracer = Tracer(capacity=100000)
+
+    def record(number):
+        for i in range(5000):
+            tracer.info(SERIAL, "%d %d", number, i)
+
+    threads = [threading.Thread(target=record, args=(number,)) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(tracer.last()) == 20000
+
+
+def test_dump_path_is_next_to_the_module():
+    assert os.path.dirname(Tracer.DUMP_PATH) == os.path.dirname(os.path.abspath(Trace.__file__))
+    assert Tracer().dump_path == Tracer.DUMP_PATH
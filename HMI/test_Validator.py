@@ -0,0 +1,49 @@
+from Parallel import detached
+from Validator import ProgramValidator, BackgroundValidation
+
+
+def home(scara):
+    scara.target_position.update({"Z": scara.min_range["Z"], "A1": scara.max_range["A1"],
+                                  "A2": scara.min_range["A2"], "A3": 0.0})
+
+
+PROGRAM = "G90 F1000\nX150 Y50 Z10\nX500 Y0\nZ200\nQ12\nP(99)\nX150 Y-50\n"
+
+
+def test_violations(scara):
+    home(scara)
+    target = dict(scara.target_position)
+    violations = ProgramValidator(scara).validate_text(PROGRAM)
+    assert [error.line for error in violations] == [3, 4, 5, 6]
+    # The scara isn't moved:
+    assert scara.target_position == target
+
+
+def test_background_validation(scara, tmp_path):
+    home(scara)
+    path = tmp_path / "program.gcode"
+    path.write_text(PROGRAM)
+    validation = BackgroundValidation(detached(scara), str(path))
+    validation.thread.join(10.0)
+    assert validation.done()
+    assert validation.error is None
+    assert [error.line for error in validation.violations] == [3, 4, 5, 6]
+
+
+def test_background_validation_of_undecodable_file(scara, tmp_path):
+    home(scara)
+    path = tmp_path / "program.gcode"
+    path.write_bytes(b"\xff\xfeX\x00150\x00")
+    validation = BackgroundValidation(detached(scara), str(path))
+    validation.thread.join(10.0)
+    assert validation.done()
+    # Failed, never an empty result:
+    assert isinstance(validation.error, UnicodeDecodeError)
+    assert validation.violations is None
+
+
+def test_background_validation_of_missing_file(scara, tmp_path):
+    validation = BackgroundValidation(detached(scara), str(tmp_path / "missing.gcode"))
+    validation.thread.join(10.0)
+    assert isinstance(validation.error, OSError)
+    assert validation.violations is None
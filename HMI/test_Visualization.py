@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+from Visualization import ArmModel, MeshCache, STL_DTYPE, decimate, read_stl
+
+
+# Triangulated sphere, N x 3 x 3:
+def sphere(steps=40, radius=10.0):
+    theta = np.linspace(0, np.pi, steps + 1)
+    phi = np.linspace(0, 2 * np.pi, 2 * steps + 1)
+    points = radius * np.stack([np.outer(np.sin(theta), np.cos(phi)),
+                                np.outer(np.sin(theta), np.sin(phi)),
+                                np.outer(np.cos(theta), np.ones_like(phi))], axis=-1)
+    a = points[:-1, :-1].reshape(-1, 3)
+    b = points[1:, :-1].reshape(-1, 3)
+    c = points[1:, 1:].reshape(-1, 3)
+    d = points[:-1, 1:].reshape(-1, 3)
+    return np.concatenate([np.stack([a, b, c], axis=1), np.stack([a, c, d], axis=1)]).astype(np.float32)
+
+
+def write_binary(path, triangles, header=b"binary"):
+    data = np.zeros(len(triangles), dtype=STL_DTYPE)
+    data["vertices"] = triangles
+    with open(path, "wb") as file:
+        file.write(header.ljust(80, b" "))
+        file.write(np.uint32(len(triangles)).tobytes())
+        file.write(data.tobytes())
+
+
+def write_ascii(path, triangles):
+    lines = ["solid part"]
+    for triangle in triangles:
+        lines += ["facet normal 0 0 1", "outer loop"]
+        lines += ["vertex {:e} {:e} {:e}".format(*vertex) for vertex in triangle]
+        lines += ["endloop", "endfacet"]
+    lines.append("endsolid part")
+    path.write_text("\n".join(lines) + "\n")
+
+
+TRIANGLES = sphere(4)
+
+
+def test_read_binary_stl(tmp_path):
+    path = tmp_path / "part.stl"
+    write_binary(str(path), TRIANGLES)
+    np.testing.assert_array_equal(read_stl(str(path)), TRIANGLES)
+    # "solid" in a binary header, told by the size:
+    write_binary(str(path), TRIANGLES, header=b"solid exported")
+    np.testing.assert_array_equal(read_stl(str(path)), TRIANGLES)
+    write_binary(str(path), TRIANGLES[:0])
+    assert read_stl(str(path)).shape == (0, 3, 3)
+
+
+def test_read_ascii_stl(tmp_path):
+    path = tmp_path / "part.stl"
+    write_ascii(path, TRIANGLES)
+    np.testing.assert_allclose(read_stl(str(path)), TRIANGLES, rtol=1e-6)
+
+
+def test_decimate():
+    triangles = sphere(40)
+    assert len(triangles) > 5000
+    for count in (2000, 500, 120):
+        result = decimate(triangles, count)
+        assert 0.3 * count < len(result) <= count
+        # Still the sphere, no collapsed triangles:
+        radius = np.linalg.norm(result.reshape(-1, 3), axis=1)
+        assert radius.max() <= 10.0 + 1e-4
+        assert radius.min() > 8.0
+        assert (np.linalg.norm(np.cross(result[:, 1] - result[:, 0], result[:, 2] - result[:, 0]), axis=1) > 0).all()
+    # Small meshes are kept:
+    np.testing.assert_array_equal(decimate(TRIANGLES, len(TRIANGLES)), TRIANGLES)
+
+
+def test_meshes_are_read_once(tmp_path):
+    path = tmp_path / "part.stl"
+    write_binary(str(path), sphere(20))
+    cache = MeshCache()
+    first = cache.get(str(path), 100)
+    assert cache.get(str(path), 100) is first
+    assert len(cache.get(str(path), 300)) > len(first)
+    assert cache.loads == 2
+
+
+def test_arm_parts_are_posed(scara):
+    model = ArmModel(scara, cache=MeshCache())
+    meshes = model.link_meshes()
+    assert model.missing == []
+    assert all(len(meshes[link]) for link in ArmModel.LINKS)
+    assert all(len(mesh) <= ArmModel.TRIANGLES * 5 for mesh in meshes.values())
+
+    position = {"Z": 20.0, "A1": 30.0, "A2": -45.0, "A3": 0.0}
+    triangles, colors, skeleton = model.project(position, "top")
+    assert len(triangles) == len(colors) == sum(len(mesh) for mesh in meshes.values())
+    # Seen from the top, the skeleton ends at the tool point:
+    tool = scara.forward_kinematics(position)
+    assert skeleton[-1] == pytest.approx([tool["X"], tool["Y"]])
+    assert ((colors >= 0) & (colors <= 1)).all()
+
+
+def test_missing_parts_are_skipped(scara, tmp_path):
+    path = tmp_path / "arm.stl"
+    write_binary(str(path), TRIANGLES)
+    parts = ((str(tmp_path / "missing.stl"), ArmModel.BASE, 0.0), (str(path), ArmModel.ARM, 0.5))
+    model = ArmModel(scara, parts=parts, cache=MeshCache())
+    meshes = model.link_meshes()
+    assert model.missing == [str(tmp_path / "missing.stl")]
+    assert len(meshes[ArmModel.BASE]) == 0
+    assert len(meshes[ArmModel.ARM]) == len(TRIANGLES)
+    triangles, _, _ = model.project({"Z": 0.0, "A1": 0.0, "A2": 0.0, "A3": 0.0})
+    assert len(triangles) == len(TRIANGLES)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+
+def random_points(scara, count, seed=1):
+    generator = np.random.default_rng(seed)
+    reach = scara.l1 + scara.l2 + scara.current_tool["x_offset"]
+    return generator.uniform(-reach - 10, reach + 10, (count, 2))
+
+
+@pytest.mark.parametrize("elbow", [1, -1])
+def test_map_agrees_with_the_exact_check(scara, elbow):
+    workspace = scara.workspace
+    xy = random_points(scara, 20000)
+    exact = workspace.check(xy, elbow)
+    assert 0 < exact.sum() < len(xy)
+    np.testing.assert_array_equal(workspace.is_reachable_batch(xy, elbow), exact)
+    assert [workspace.is_reachable(x, y, elbow) for x, y in xy[:2000]] == exact[:2000].tolist()
+    # Most points are decided by the grid:
+    assert workspace.exact_checks < 0.3 * 22000
+
+
+def test_points_off_the_grid_are_unreachable(scara):
+    workspace = scara.workspace
+    reach = scara.l1 + scara.l2 + scara.current_tool["x_offset"]
+    assert not workspace.is_reachable(2 * reach, 0.0)
+    assert not workspace.is_reachable(0.0, -2 * reach)
+    assert workspace.is_reachable_batch([[2 * reach, 0.0], [-1e9, 1e9]]).tolist() == [False, False]
+
+
+def test_map_is_built_once_per_elbow(scara):
+    workspace = scara.workspace
+    workspace.is_reachable(150.0, 0.0, 1)
+    workspace.is_reachable(150.0, 0.0, -1)
+    workspace.is_reachable_batch(random_points(scara, 100), 1)
+    assert workspace.builds == 2
+
+
+def test_map_is_rebuilt_when_the_ranges_change(scara):
+    workspace = scara.workspace
+    # Beyond A1 = 90 deg only:
+    xy = scara.forward_kinematics_batch([100.0, 30.0])
+    assert workspace.is_reachable(xy[0, 0], xy[0, 1])
+    scara.max_range = dict(scara.max_range, A1=90.0)
+    assert not workspace.is_reachable(xy[0, 0], xy[0, 1])
+    assert workspace.builds == 2
+    xy = random_points(scara, 5000)
+    np.testing.assert_array_equal(workspace.is_reachable_batch(xy), workspace.check(xy))